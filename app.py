@@ -87,6 +87,9 @@ application.register_blueprint(REQUESTS_BLUEPRINT)
 application.register_blueprint(TOKEN_MANIPULATION_BLUEPRINT)
 application.register_blueprint(TRIPS_BLUEPRINT)
 
+from src.indexes import ensure_indexes
+ensure_indexes()
+
 if __name__ == "__main__":
 
     application.run(debug=True, host='0.0.0.0')
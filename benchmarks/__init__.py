@@ -0,0 +1 @@
+"""Benchmarks of the hot paths of the app server, see manage.py benchmark"""
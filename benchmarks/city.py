@@ -0,0 +1,67 @@
+"""Synthetic city generator for the benchmarks"""
+import datetime
+import math
+import random
+
+from app import db
+from src.indexes import ensure_indexes
+from src.models import User
+from src.mixins.DriversMixin import DriversMixin
+
+CITY_CENTER = (-34.6037, -58.3816)  # Buenos Aires
+CITY_RADIUS = 15  # km
+KM_PER_DEGREE = 111.2
+
+
+def random_location(rand, center=CITY_CENTER, radius=CITY_RADIUS):
+    """Gets a random (latitude, longitude) in the city, denser near the center"""
+    distance = abs(rand.gauss(0, radius / 2.0)) % radius
+    angle = rand.uniform(0, 2 * math.pi)
+    latitude = center[0] + distance * math.cos(angle) / KM_PER_DEGREE
+    longitude = center[1] + distance * math.sin(angle) / \
+        (KM_PER_DEGREE * math.cos(math.radians(center[0])))
+    return latitude, longitude
+
+
+def generate_city(drivers, riders, on_duty_ratio=0.7, on_trip_ratio=0.2, seed=0):
+    """Fills the db with the given amount of drivers (with their positions) and riders.
+
+    Returns the usernames of the riders. The collections are dropped first, so this
+    must only be run against a test db.
+    """
+    rand = random.Random(seed)
+    for collection in ['users', 'drivers', 'riders', 'positions', 'requests', 'trips']:
+        db.drop_collection(collection)
+    ensure_indexes()
+    now = datetime.datetime.utcnow()
+    users = []
+    drivers_docs = []
+    positions = []
+    for number in range(drivers):
+        username = 'driver_{}'.format(number)
+        latitude, longitude = random_location(rand)
+        location = DriversMixin.to_geojson_point(latitude, longitude)
+        users.append(User(username=username, uid=username).__dict__)
+        drivers_docs.append({'username': username, 'uid': username, 'push_token': '',
+                             'duty': rand.random() < on_duty_ratio,
+                             'trip': rand.random() < on_trip_ratio,
+                             'latitude': latitude, 'longitude': longitude,
+                             'location': location, 'last_seen': now})
+        positions.append({'username': username, 'latitude': latitude, 'longitude': longitude,
+                          'last_seen': now})
+    riders_names = []
+    riders_docs = []
+    for number in range(riders):
+        username = 'rider_{}'.format(number)
+        latitude, longitude = random_location(rand)
+        riders_names.append(username)
+        users.append(User(username=username, uid=username).__dict__)
+        riders_docs.append({'username': username})
+        positions.append({'username': username, 'latitude': latitude, 'longitude': longitude,
+                          'last_seen': now})
+    # De a tandas para no armar un unico insert gigante con 100k conductores
+    for documents, collection in [(users, db.users), (drivers_docs, db.drivers),
+                                  (riders_docs, db.riders), (positions, db.positions)]:
+        for start in range(0, len(documents), 5000):
+            collection.insert_many(documents[start:start + 5000], ordered=False)
+    return riders_names
@@ -0,0 +1,120 @@
+"""Latency and throughput of the matching and of the request submission"""
+import json
+import math
+import random
+import time
+
+from mock import Mock, patch
+
+from app import application, db, DB_NAME
+from src.models import User
+from src.mixins.DriversGridMixin import DRIVERS_GRID
+from src.mixins.DriversMixin import DriversMixin, MATCHING_INDEX
+from benchmarks.city import generate_city, random_location
+
+
+def percentile(samples, percent):
+    """Gets the given percentile (nearest rank) of the samples"""
+    ordered = sorted(samples)
+    rank = int(math.ceil(percent / 100.0 * len(ordered))) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+
+def summarize(name, samples, elapsed):
+    """Gets a report line with the latency percentiles (in ms) and the throughput"""
+    if not samples:
+        return "{:<12} n=0".format(name)
+    return "{:<12} n={:<6} p50={:8.2f}ms p95={:8.2f}ms p99={:8.2f}ms {:8.1f} ops/s".format(
+        name, len(samples), percentile(samples, 50) * 1000, percentile(samples, 95) * 1000,
+        percentile(samples, 99) * 1000, len(samples) / elapsed if elapsed else 0)
+
+
+def fake_response(body, latency):
+    """Builds a successful response of an external service, after waiting its latency"""
+    time.sleep(latency)
+    response = Mock()
+    response.ok = True
+    response.status_code = 200
+    response.json.return_value = body
+    return response
+
+
+class FakeServices(object):
+    """Stands in for google and the shared server, answering after the given latencies (in s)"""
+
+    def __init__(self, google_latency, shared_server_latency):
+        self.google_latency = google_latency
+        self.shared_server_latency = shared_server_latency
+
+    def get(self, url, params=None, **kwargs):
+        if 'distancematrix' in url:
+            origins = params['origins'].split('|')
+            rows = [{'elements': [{'status': 'OK', 'duration': {'value': 60 * (index + 1)}}]}
+                    for index in range(len(origins))]
+            return fake_response({'rows': rows}, self.google_latency)
+        leg = {'distance': {'value': 5000}, 'duration': {'value': 900}}
+        return fake_response({'routes': [{'overview_polyline': {'points': 'a~l~Fjk~uOwHJy@P'},
+                                          'legs': [leg]}]}, self.google_latency)
+
+    def post(self, url, **kwargs):
+        return fake_response({'value': 25}, self.shared_server_latency)
+
+
+def bench_matching(queries, rand):
+    """Times DriversMixin.get_closer_driver for random pickups in the city"""
+    latencies = []
+    started = time.time()
+    for _ in range(queries):
+        pickup = random_location(rand)
+        start = time.time()
+        DriversMixin.get_closer_driver(pickup)
+        latencies.append(time.time() - start)
+    return latencies, time.time() - started
+
+
+def bench_submission(riders, rand):
+    """Times POST /riders/<username>/request, each rider submits one request.
+
+    The assigned driver is released (outside of the timing) so the fleet stays the same.
+    """
+    client = application.test_client()
+    latencies = []
+    timed = 0
+    for rider in riders:
+        auth_token = User(username=rider, uid=rider).encode_auth_token()
+        pickup = random_location(rand)
+        destination = random_location(rand)
+        data = json.dumps(dict(latitude_initial=pickup[0], longitude_initial=pickup[1],
+                               latitude_final=destination[0], longitude_final=destination[1]))
+        start = time.time()
+        response = client.post('/riders/{}/request'.format(rider), data=data,
+                               headers=dict(Authorization='Bearer ' + auth_token),
+                               content_type='application/json')
+        latencies.append(time.time() - start)
+        timed += latencies[-1]
+        driver = json.loads(response.data.decode()).get('driver')
+        db.requests.delete_many({'rider': rider})
+        if driver:
+            DriversMixin.set_trip(driver, False)
+    return latencies, timed
+
+
+def run(drivers, riders, queries, google_latency, shared_server_latency, seed=0):
+    """Generates the city and prints the report of every benchmark"""
+    if 'test' not in DB_NAME and 'bench' not in DB_NAME:
+        raise Exception("The benchmarks drop the collections of the db, DB_NAME ({}) must be a "
+                        "test or benchmark db".format(DB_NAME))
+    rand = random.Random(seed)
+    print("Generating a city with {} drivers and {} riders...".format(drivers, riders))
+    riders_names = generate_city(drivers, riders, seed=seed)
+    DRIVERS_GRID.loaded_at = None
+    print("Matching index: {}, google latency: {}ms, shared server latency: {}ms".format(
+        MATCHING_INDEX, google_latency * 1000, shared_server_latency * 1000))
+    services = FakeServices(google_latency, shared_server_latency)
+    with patch('requests.get', side_effect=services.get), \
+            patch('requests.post', side_effect=services.post), \
+            patch('pyfcm.FCMNotification.notify_single_device', return_value={}):
+        latencies, elapsed = bench_matching(queries, rand)
+        print(summarize('matching', latencies, elapsed))
+        latencies, elapsed = bench_submission(riders_names, rand)
+        print(summarize('submission', latencies, elapsed))
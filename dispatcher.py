@@ -0,0 +1,4 @@
+from src.mixins.DispatchMixin import Dispatcher
+
+if __name__ == "__main__":
+    Dispatcher.run()
@@ -0,0 +1,33 @@
+"""Settings of the gunicorn workers (gunicorn -c gunicorn_config.py)"""
+import os
+import uuid
+
+# Los streams de posiciones y de eventos quedan abiertos mucho tiempo (hasta que vence el token),
+# con workers asincronicos cada uno ocupa una greenlet en vez de uno de los pocos threads que
+# atienden los requests. Ademas solo con gevent se puede cortar una lectura del stream de
+# posiciones que no llega, ver PositionHandler.read_line. Con GUNICORN_WORKER_CLASS=gthread (y
+# --threads) vuelve a funcionar como antes, con los streams sin tiempo maximo entre lineas
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+
+def on_starting(server):
+    """Stamps this boot, so the workers don't use the shared positions table left by the
+    previous one"""
+    os.environ['SHARED_POSITIONS_STAMP'] = uuid.uuid4().hex
+
+
+def worker_exit(server, worker):
+    """Writes the positions, distances and tracks that are still buffered before the worker
+    goes away"""
+    from src.mixins.OdometerMixin import ODOMETER
+    from src.mixins.PositionsBufferMixin import POSITIONS_BUFFER
+    try:
+        POSITIONS_BUFFER.flush()
+    except Exception as exc:  # pragma: no cover
+        server.log.error("Couldn't flush the positions: {}".format(exc.message))
+    try:
+        # Escribe tambien los tracks, antes de contar sus fixes
+        ODOMETER.persist()
+    except Exception as exc:  # pragma: no cover
+        server.log.error("Couldn't persist the odometer: {}".format(exc.message))
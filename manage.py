@@ -15,6 +15,9 @@ import os
 import unittest
 from app import application
 from flask_script import Manager
+from src.indexes import drop_obsolete_indexes, unique_positions
+from src.mixins.DriversMixin import DriversMixin
+from src.models import BlacklistToken
 
 LOG_LEVEL = os.environ["LOG_LEVEL"]
 
@@ -140,6 +143,34 @@ def test_integration():
         return 0
     return 1
 
+@manager.command
+def test_dispatch():
+    """Runs the batch dispatch tests without test coverage."""
+    tests = unittest.TestLoader().discover('tests', pattern='test_dispatch.py')
+    result = unittest.TextTestRunner(verbosity=2).run(tests)
+    if result.wasSuccessful():
+        return 0
+    return 1
+
+@manager.command
+def benchmark(drivers=1000, riders=200, queries=1000, google_latency=0, shared_server_latency=0):
+    """Benchmarks the matching and the request submission in a synthetic city (latencies in ms).
+    Drops the collections of the db, so it only runs against a test db."""
+    # Usa mock, que solo esta en los entornos de desarrollo
+    from benchmarks import matching
+    matching.run(int(drivers), int(riders), int(queries), float(google_latency) / 1000,
+                 float(shared_server_latency) / 1000)
+    return 0
+
+@manager.command
+def migrate():
+    """Brings the documents stored by older versions up to date, run it once after deploying."""
+    print('obsolete indexes dropped: {}'.format(', '.join(drop_obsolete_indexes()) or 'none'))
+    print('{} duplicated positions dropped'.format(unique_positions()))
+    print('{} drivers backfilled'.format(DriversMixin.backfill_drivers()))
+    print('{} blacklisted tokens keyed by digest'.format(BlacklistToken.migrate()))
+    return 0
+
 @manager.command
 def cov():
     """Runs the unit tests with coverage."""
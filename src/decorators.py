@@ -0,0 +1,102 @@
+"""Decorators shared by the handlers"""
+import functools
+
+from flask import g, request, make_response, jsonify
+from schema import Schema, SchemaError
+
+from app import db, application
+from src.models import User
+from src.mixins.AuthenticationMixin import Authenticator
+
+
+def fail(message, status_code):
+    """Builds the response of a request that can't be served"""
+    response = {
+        'status': 'fail',
+        'message': message
+    }
+    return make_response(jsonify(response)), status_code
+
+
+def internal_error(exc):
+    """Builds the response of a request that failed unexpectedly"""
+    application.logger.error('Error msg: {0}. Error doc: {1}'.format(exc.message, exc.__doc__))
+    response = {
+        'status': 'fail',
+        'message': 'internal_error',
+        'error_description': exc.message
+    }
+    return make_response(jsonify(response)), 500
+
+
+def validated(schema, message='bad_request_data'):
+    """Decorator for the endpoints that receive a json body. It's validated against the schema
+    before anything else (400 with the given message if it doesn't match) and left in g.data"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                # IMPORTANTE: el 0 es para que devuelva el diccionario dentro y no una lista
+                g.data = Schema([schema]).validate([request.get_json()])[0]
+            except SchemaError:
+                application.logger.error("Request data error")
+                return fail(message, 400)
+            except Exception as exc:  # pragma: no cover
+                return internal_error(exc)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def find_principal(role, username):
+    """Gets whether there's a user with the given role and the user itself, if it could be built
+    from the same document (drivers keep their uid), otherwise it's loaded when needed"""
+    if role == 'user':
+        user = User.get_user_by_username(username)
+        return user is not None, user
+    document = db[role + 's'].find_one({'username': username}, {'uid': 1, 'push_token': 1, '_id': 0})
+    if document and 'uid' in document:
+        return True, User(username=username, uid=document['uid'], push_token=document.get('push_token', ''))
+    return document is not None, None
+
+
+def authenticated(role=None, unauthorized=None):
+    """Decorator for the endpoints that need an authenticated user, checked only once per request.
+
+    If a role ('user', 'driver' or 'rider') is given, the user named in the url must exist with
+    that role (404 otherwise). Then the token must be valid (401) and, if an unauthorized message
+    is given, belong to that same user (401 with that message). The username of the token is left
+    in g.username, see current_user for the rest of the user.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                username = kwargs.get('username')
+                g.user = None
+                if role:
+                    exists, g.user = find_principal(role, username)
+                    if not exists:
+                        return fail('{}_not_found'.format(role), 404)
+                    application.logger.info("{} {} exists".format(role, username))
+                token_username, error_message = Authenticator.authenticate(request.headers.get('Authorization'))
+                if error_message:
+                    return fail(error_message, 401)
+                application.logger.info("Requested by: {}".format(token_username))
+                if unauthorized and token_username != username:
+                    return fail(unauthorized, 401)
+                if g.user and g.user.username != token_username:
+                    g.user = None
+                g.username = token_username
+            except Exception as exc:  # pragma: no cover
+                return internal_error(exc)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_user():
+    """Gets the authenticated user, loading it at most once per request"""
+    if g.get('user') is None:
+        g.user = User.get_user_by_username(g.username)
+    return g.user
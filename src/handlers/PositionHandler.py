@@ -1,99 +1,165 @@
 """Handlers related with the position of users"""
+import json
+import os
+import time
 
-from flask import Blueprint, request, make_response, jsonify
+from flask import Blueprint, g, request, make_response, jsonify
 from flask.views import MethodView
-from schema import Schema, And, Use, SchemaError
+from schema import Schema, And, Use, Optional, SchemaError
+try:
+    from gevent import Timeout
+    from gevent.monkey import is_module_patched
+except ImportError:  # pragma: no cover
+    Timeout = None
 
-from app import db, application
+from app import application
+from src.decorators import validated, authenticated, internal_error
 from src.mixins.AuthenticationMixin import Authenticator
-from src.mixins.DriversMixin import DriversMixin
-from src.models import User
+from src.mixins.PositionsMixin import PositionsMixin, POSITIONS_BATCH_MAX_SIZE, DEADBAND
 
 POSITION_BLUEPRINT = Blueprint('position', __name__)
+POSITIONS_STREAM_MAX_DURATION = int(os.environ.get('POSITIONS_STREAM_MAX_DURATION', 3600))  # seconds
+POSITIONS_STREAM_READ_TIMEOUT = int(os.environ.get('POSITIONS_STREAM_READ_TIMEOUT', 60))  # seconds
 
 
 class PositionAPI(MethodView):
     """Handler for position related API"""
 
     @staticmethod
+    @validated({'latitude': And(Use(float), lambda x: -90 < x < 90),
+                'longitude': And(Use(float), lambda x: -180 < x < 180)})
+    @authenticated(role='user', unauthorized='unauthorized_update')
     def put(username):
         """Endpoint for Updating a user position"""
         try:
-            data = request.get_json()
-            schema = Schema([{'latitude': And(Use(float), lambda x: -90 < x < 90),
-                              'longitude': And(Use(float), lambda x: -180 < x < 180)}])
-            # IMPORTANTE: el 0 es para que devuelva el diccionario dentro y no una lista
-            data = schema.validate([data])[0]
-            application.logger.info("Asked to update {}'s position coordinates'".format(username))
-            user = User.get_user_by_username(username)
-            if not user:
-                response = {
-                    'status': 'fail',
-                    'message': 'user_not_found'
-                }
-                return make_response(jsonify(response)), 404
-            application.logger.info("user {} exists".format(username))
-            auth_header = request.headers.get('Authorization')
-            token_username, error_message = Authenticator.authenticate(auth_header)
-            if error_message:
-                response = {
-                    'status': 'fail',
-                    'message': error_message
-                }
-                return make_response(jsonify(response)), 401
-            application.logger.info("Updating user's coordinates w/ Auth: {}".format(auth_header))
-            application.logger.info("Token decoded: Update was requested by: {}"
-                                    .format(token_username))
-            if token_username == username:
-                application.logger.info("Permission granted")
-                application.logger.info("User's position to update: {}".format(token_username))
-                latitude = data['latitude']
-                longitude = data['longitude']
-                if db.positions.count({'username': username}) == 0:
-                    db.positions.insert_one({'username': username, 'latitude': latitude,
-                                             'longitude': longitude})
-                else:
-                    if (db.drivers.count({'username': username}) > 0 and db.trips.count({'username': username}) > 0 ):
-                    #Si es un driver y esta en un trip
-                        result = db.positions.find_one({'username': username})
-                        distance = DriversMixin.distance((result['latitude'],result['longitude']),(latitude,longitude))
-                        db.trips.find_one_and_update({'username': username},
-                                                         {'$inc': {'distance': distance}})
-                    db.positions.find_one_and_update({'username': username},
-                                                     {'$set': {'latitude': latitude,
-                                                               'longitude': longitude}})
-                response = {
-                    'status': 'success',
-                    'message': 'position_updated'
-                }
-                return make_response(jsonify(response)), 200
+            application.logger.info("User's position to update: {}".format(username))
+            PositionsMixin.store_positions(username, [g.data])
             response = {
-                'status': 'fail',
-                'message': 'unauthorized_update'
+                'status': 'success',
+                'message': 'position_updated'
             }
-            return make_response(jsonify(response)), 401
+            return make_response(jsonify(response)), 200
+        except Exception as exc:  # pragma: no cover
+            return internal_error(exc)
+
+
+class PositionsBatchAPI(MethodView):
+    """Handler for uploading many positions at once"""
 
-        except SchemaError:
-            application.logger.error("Request data error")
+    @staticmethod
+    @validated({'positions': And([{'latitude': And(Use(float), lambda x: -90 < x < 90),
+                                   'longitude': And(Use(float), lambda x: -180 < x < 180),
+                                   'timestamp': And(Use(float), PositionsMixin.is_valid_timestamp)}],
+                                 lambda x: 0 < len(x) <= POSITIONS_BATCH_MAX_SIZE)})
+    @authenticated(role='user', unauthorized='unauthorized_update')
+    def post(username):
+        """Endpoint for uploading the positions buffered by the phone of a user"""
+        try:
+            application.logger.info("Uploading {} positions of {}".format(len(g.data['positions']),
+                                                                        username))
+            fixes = sorted(g.data['positions'], key=lambda fix: fix['timestamp'])
+            PositionsMixin.store_positions(username, fixes)
             response = {
-                'status': 'fail',
-                'message': 'bad_request_data'
+                'status': 'success',
+                'message': 'positions_updated',
+                'count': len(fixes)
             }
-            return make_response(jsonify(response)), 400
+            return make_response(jsonify(response)), 200
+        except Exception as exc:  # pragma: no cover
+            return internal_error(exc)
+
 
+def read_line(stream, timeout):
+    """Reads a line of the stream, None if it doesn't arrive within timeout seconds. Only the
+    gevent workers can interrupt the read, with the others it isn't bounded"""
+    if Timeout is None or not is_module_patched('socket'):
+        return stream.readline()
+    try:
+        with Timeout(timeout):
+            return stream.readline()
+    except Timeout:
+        return None
+
+
+def read_stream(username, auth_header, stream, deadline):
+    """Stores the json fixes read from the stream, one per line, until it ends, the deadline
+    passes, a line takes more than POSITIONS_STREAM_READ_TIMEOUT seconds to arrive or the token
+    can't be used anymore. Returns the response with how many fixes were stored, skipped and
+    rejected, and its status code"""
+    schema = Schema([{'latitude': And(Use(float), lambda x: -90 < x < 90),
+                      'longitude': And(Use(float), lambda x: -180 < x < 180),
+                      Optional('timestamp'): And(Use(float), PositionsMixin.is_valid_timestamp)}])
+    counts = {'stored': 0, 'skipped': 0, 'rejected': 0}
+    while True:
+        timeout = min(POSITIONS_STREAM_READ_TIMEOUT, deadline - time.time())
+        if timeout <= 0:
+            break
+        line = read_line(stream, timeout)
+        if line is None:
+            # El resto del body no se lee, gunicorn corta la conexion
+            application.logger.info("{} stopped streaming its positions".format(username))
+            break
+        if not line:
+            break
+        # Se revisa el token en cada fix, por si lo revocaron mientras el stream seguia abierto
+        error_message = Authenticator.authenticate(auth_header)[1]
+        if error_message:
+            return dict(counts, status='fail', message=error_message), 401
+        if not line.strip():
+            continue
+        try:
+            fix = schema.validate([json.loads(line)])[0]
+        except (ValueError, SchemaError):
+            counts['rejected'] += 1
+            continue
+        counts['stored' if PositionsMixin.store_positions(username, [fix]) else 'skipped'] += 1
+    return dict(counts, status='success', message='positions_stream_closed'), 200
+
+
+class PositionsStreamAPI(MethodView):
+    """Handler for streaming positions through a single long-lived request"""
+
+    @staticmethod
+    @authenticated(role='user', unauthorized='unauthorized_update')
+    def post(username):
+        """Endpoint for uploading positions as they are taken, one json fix per line of a chunked
+        body, see read_stream. It answers once the body ends. The stream lasts at most until the
+        token expires"""
+        try:
+            application.logger.info("{} streams its positions".format(username))
+            auth_header = request.headers.get('Authorization')
+            # Sin content length (chunked) werkzeug no lee el body, gunicorn ya lo decodifica
+            stream = request.stream if request.content_length else request.environ['wsgi.input']
+            deadline = min(time.time() + POSITIONS_STREAM_MAX_DURATION,
+                           Authenticator.expiration_of(auth_header))
+            response, status_code = read_stream(username, auth_header, stream, deadline)
+            application.logger.info("{} closed its positions stream".format(username))
+            return make_response(jsonify(response)), status_code
         except Exception as exc:  # pragma: no cover
-            application.logger.error('Error msg: {0}. Error doc: {1}'.
-                                     format(exc.message, exc.__doc__))
-            response = {
-                'status': 'fail',
-                'message': 'internal_error',
-                'error_description': exc.message
-            }
-            return make_response(jsonify(response)), 500
+            return internal_error(exc)
+
+
+class PositionsStatsAPI(MethodView):
+    """Handler for the position updates statistics"""
+
+    @staticmethod
+    @authenticated()
+    def get():
+        """Endpoint for getting how many position updates were received and skipped. The counts
+        are only the ones of the worker that answers, identified by its pid"""
+        response = {
+            'status': 'success',
+            'worker': os.getpid(),
+            'position_updates': DEADBAND.stats()
+        }
+        return make_response(jsonify(response)), 200
 
 
 # define the API resources
 POSITION_VIEW = PositionAPI.as_view('position_api')
+POSITIONS_BATCH_VIEW = PositionsBatchAPI.as_view('positions_batch_api')
+POSITIONS_STREAM_VIEW = PositionsStreamAPI.as_view('positions_stream_api')
+POSITIONS_STATS_VIEW = PositionsStatsAPI.as_view('positions_stats_api')
 
 # add Rules for API Endpoints
 POSITION_BLUEPRINT.add_url_rule(
@@ -101,3 +167,18 @@ POSITION_BLUEPRINT.add_url_rule(
     view_func=POSITION_VIEW,
     methods=['PUT']
 )
+POSITION_BLUEPRINT.add_url_rule(
+    '/users/<username>/coordinates/batch',
+    view_func=POSITIONS_BATCH_VIEW,
+    methods=['POST']
+)
+POSITION_BLUEPRINT.add_url_rule(
+    '/users/<username>/coordinates/stream',
+    view_func=POSITIONS_STREAM_VIEW,
+    methods=['POST']
+)
+POSITION_BLUEPRINT.add_url_rule(
+    '/positions/stats',
+    view_func=POSITIONS_STATS_VIEW,
+    methods=['GET']
+)
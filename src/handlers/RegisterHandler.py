@@ -6,7 +6,8 @@ from flask.views import MethodView
 from app import db, application
 from src.models import User
 from src.services.shared_server import register_user, remove_user, update_user_data, get_data
-from src.mixins.AuthenticationMixin import Authenticator
+from src.decorators import authenticated, current_user, internal_error
+from src.mixins.PositionsMixin import PositionsMixin
 
 REGISTRATION_BLUEPRINT = Blueprint('users', __name__)
 
@@ -48,9 +49,11 @@ class RegisterAPI(MethodView):
                 application.logger.info('User registered')
                 user = User(username=username, uid=resp.json()['id'])
                 db.users.insert_one(user.__dict__)
+                PositionsMixin.forget_role(username)
                 user_type = data['type']
                 if user_type == "driver":
-                    db.drivers.insert_one({'username': username, 'duty': False, 'trip': False})
+                    db.drivers.insert_one({'username': username, 'duty': False, 'trip': False,
+                                           'uid': user.uid, 'push_token': user.push_token})
                 else:
                     db.riders.insert_one({'username': username})
                 auth_token = user.encode_auth_token()
@@ -76,113 +79,46 @@ class RegisterAPI(MethodView):
             return make_response(jsonify(response)), 500
 
     @staticmethod
+    @authenticated(role='user', unauthorized='unauthorized_deletion')
     def delete(username):
         """Endpoint for erasign an user"""
 
         try:
-            application.logger.info("Asked to remove user: {}".format(username))
-            user = User.get_user_by_username(username)
-            if not user:
-                response = {
-                    'status': 'fail',
-                    'message': 'user_not_found'
-                }
-                return make_response(jsonify(response)), 404
-            application.logger.info("user {} exists".format(username))
-            auth_header = request.headers.get('Authorization')
-            token_username, error_message = Authenticator.authenticate(auth_header)
-            if error_message:
+            application.logger.info("User to remove {}".format(username))
+            user = current_user()
+            resp = remove_user(user.uid)
+            if resp.ok:
                 response = {
-                    'status': 'fail',
-                    'message': error_message
+                    'status': 'success',
+                    'message': 'user_deleted'
                 }
-                return make_response(jsonify(response)), 401
-            application.logger.info("Removing user w/ Auth: {}".format(auth_header))
-            application.logger.info("Deletion was requested by: {}".format(token_username))
-            if token_username == username:
-                application.logger.info("Permission granted")
-                application.logger.info("User to remove {}".format(token_username))
-                application.logger.debug(type(token_username))
-                resp = remove_user(user.uid)
-                if resp.ok:
-                    response = {
-                        'status': 'success',
-                        'message': 'user_deleted'
-                    }
-                    user.remove_from_db()
-                    return make_response(jsonify(response)), 203
-                else:
-                    return make_response(jsonify(resp.json())), resp.status_code
+                user.remove_from_db()
+                PositionsMixin.forget_role(username)
+                return make_response(jsonify(response)), 203
             else:
-                response = {
-                    'status': 'fail',
-                    'message': 'unauthorized_deletion'
-                }
-                return make_response(jsonify(response)), 401
+                return make_response(jsonify(resp.json())), resp.status_code
         except Exception as exc:  # pragma: no cover
-
-            application.logger.error('Error msg: {0}. Error doc: {1}'
-                                     .format(exc.message, exc.__doc__))
-            response = {
-                'status': 'fail',
-                'message': 'internal_error',
-                'error_description': exc.message
-            }
-            return make_response(jsonify(response)), 500
+            return internal_error(exc)
 
     @staticmethod
+    @authenticated(role='user', unauthorized='unauthorized_update')
     def put(username):
         """Endpoint for modifying an user's general info"""
 
         try:
-            application.logger.info("Asked to update user: {}".format(username))
-            user = User.get_user_by_username(username)
-            if not user:
-                response = {
-                    'status': 'fail',
-                    'message': 'user_not_found'
-                }
-                return make_response(jsonify(response)), 404
-            application.logger.info("user {} exists".format(username))
-            auth_header = request.headers.get('Authorization')
-            token_username, error_message = Authenticator.authenticate(auth_header)
-            if error_message:
+            application.logger.info("User to update {}".format(username))
+            data = request.get_json()
+            resp = update_user_data(current_user().uid, data)
+            if resp.ok:
                 response = {
-                    'status': 'fail',
-                    'message': error_message
+                    'status': 'success',
+                    'message': 'data_changed_succesfully'
                 }
-                return make_response(jsonify(response)), 401
-            application.logger.info("Updating user w/ Auth: {}".format(auth_header))
-            application.logger.info("Update was requested by: {}".format(token_username))
-            if token_username == username:
-                application.logger.info("Permission granted")
-                application.logger.info("User to update {}".format(token_username))
-                application.logger.debug(type(token_username))
-                data = request.get_json()
-                resp = update_user_data(user.uid, data)
-                if resp.ok:
-                    response = {
-                        'status': 'success',
-                        'message': 'data_changed_succesfully'
-                    }
-                    return make_response(jsonify(response)), 200
-                else:
-                    return make_response(jsonify(resp.json())), resp.status_code
+                return make_response(jsonify(response)), 200
             else:
-                response = {
-                    'status': 'fail',
-                    'message': 'unauthorized_update'
-                }
-                return make_response(jsonify(response)), 401
+                return make_response(jsonify(resp.json())), resp.status_code
         except Exception as exc:  # pragma: no cover
-            application.logger.error('Error msg: {0}. Error doc: {1}'
-                                     .format(exc.message, exc.__doc__))
-            response = {
-                'status': 'fail',
-                'message': 'internal_error',
-                'error_description': exc.message
-            }
-            return make_response(jsonify(response)), 500
+            return internal_error(exc)
 
     @staticmethod
     def get(username):
@@ -1,191 +1,124 @@
 """Handlers related with rider's specific functionality"""
 
-from flask import Blueprint, request, make_response, jsonify
+from flask import Blueprint, Response, g, request, make_response, jsonify
 from flask.views import MethodView
-from schema import Schema, And, Use, SchemaError
+from schema import And, Use
 from bson.objectid import ObjectId
+import Queue
+import datetime
+import json
+import os
 import time
 
 from app import db, application
-from src.models import User
+from src.decorators import validated, authenticated, internal_error
 from src.mixins.AuthenticationMixin import Authenticator
-from src.services.google_maps import get_directions
+from src.mixins.DispatchMixin import DISPATCH_MODE, DISPATCH_MAX_WAIT
+from src.mixins.RequestsMixin import RequestsMixin
 from src.services.push_notifications import send_push_notifications
-from src.services.shared_server import estimate_trip_cost
 from src.mixins.DriversMixin import DriversMixin
+from src.mixins.LocationHubMixin import LOCATION_HUB
 
 REQUESTS_BLUEPRINT = Blueprint('requests', __name__)
+LOCATION_STREAM_MAX_DURATION = int(os.environ.get('LOCATION_STREAM_MAX_DURATION', 600))  # seconds
+LOCATION_STREAM_KEEPALIVE = 15  # seconds
 
 
 class RequestSubmission(MethodView):
     """Handler for request submission"""
 
     @staticmethod
+    @validated({'latitude_initial': And(Use(float), lambda x: -90 < x < 90),
+                'latitude_final': And(Use(float), lambda x: -90 < x < 90),
+                'longitude_initial': And(Use(float), lambda x: -180 < x < 180),
+                'longitude_final': And(Use(float), lambda x: -180 < x < 180)})
+    @authenticated(role='rider', unauthorized='unauthorized_request')
     def post(username):
         """Endpoint for requesting a ride"""
 
         try:
-            data = request.get_json()
-            schema = Schema([{'latitude_initial': And(Use(float), lambda x: -90 < x < 90),
-                              'latitude_final': And(Use(float), lambda x: -90 < x < 90),
-                              'longitude_initial': And(Use(float), lambda x: -180 < x < 180),
-                              'longitude_final': And(Use(float), lambda x: -180 < x < 180)}])
+            data = g.data
+            application.logger.info("Rider submitting request: {}".format(username))
 
-            # IMPORTANTE: el 0 es para que devuelva el diccionario dentro y no una lista
-            data = schema \
-                .validate([data])[0]
-            application.logger.info("{} asked to submit a request for a trip".format(username))
-            if db.riders.count({'username': username}) == 0:
-                response = {
-                    'status': 'fail',
-                    'message': 'rider_not_found'
-                }
-                return make_response(jsonify(response)), 404
-            application.logger.info("rider {} exists".format(username))
-            auth_header = request.headers.get('Authorization')
-            token_username, error_message = Authenticator.authenticate(auth_header)
-            if error_message:
-                response = {
-                    'status': 'fail',
-                    'message': error_message
-                }
-                return make_response(jsonify(response)), 401
-            application.logger.info("Submitting trip request w/ Auth: {}".format(token_username))
-            application.logger.info("Token decoded: {}".format(token_username))
-            if token_username == username:
-                application.logger.info("Permission granted")
-                application.logger.info("Rider submitting request: {}".format(token_username))
-
-                if db.requests.count({'rider': username}) == 0 and db.trips.count({'rider': username}) == 0:
+            if db.requests.count({'rider': username}) == 0 and db.trips.count({'rider': username}) == 0:
 
-                    assigned_driver = DriversMixin.get_closer_driver(
-                        (data['latitude_initial'], data['longitude_initial']))
+                if DISPATCH_MODE == 'batch':
+                    # El dispatcher asigna los pedidos pendientes en tandas, el rider
+                    # consulta el estado del pedido (o recibe una notificacion)
+                    expires_at = datetime.datetime.utcnow() + \
+                        datetime.timedelta(seconds=2 * DISPATCH_MAX_WAIT)
+                    result = db.requests.insert_one(
+                        {'rider': username, 'driver': None, 'coordinates': data,
+                         'request_time': time.time(), 'status': 'pending',
+                         'expires_at': expires_at})
+                    response = {
+                        'status': 'success',
+                        'message': 'request_queued',
+                        'id': str(result.inserted_id)
+                    }
+                    status_code = 202
+                else:
+                    pickup_location = (data['latitude_initial'], data['longitude_initial'])
+                    assigned_driver, lease_expires_at = DriversMixin.claim_closer_driver(pickup_location)
 
                     if assigned_driver:
-                        driver_position = db.positions.find_one({'username': assigned_driver})
-                        if not driver_position:
-                            raise Exception('driver_position_unknown')
-                        coordinates_to_passenger = {
-                            'latitude_initial': driver_position['latitude'],
-                            'longitude_initial': driver_position['longitude'],
-                            'latitude_final': data['latitude_initial'],
-                            'longitude_final': data['longitude_initial']
+                        try:
+                            estimation = RequestsMixin.estimate_trip(username, assigned_driver, data)
+                        except Exception:
+                            DriversMixin.set_trip(assigned_driver, False)
+                            raise
+                        application.logger.info("driver assigned")
+                        result = db.requests.insert_one(
+                            {'rider': username, 'driver': assigned_driver, 'coordinates': data,
+                             'request_time': time.time(), 'status': 'assigned',
+                             'estimation': estimation, 'expires_at': lease_expires_at})
+                        message = "trip_assigned"
+                        data = {
+                            'rider': username,
+                            'directions_to_passenger': estimation['directions_to_passenger'],
+                            'directions_trip': estimation['directions_trip'],
+                            'trip_coordinates': data,
+                            'id': str(result.inserted_id)
                         }
-                        directions_trip_response = get_directions(data)
-                        directions_passenger_response = get_directions(coordinates_to_passenger)
-                        if not directions_trip_response.ok or not directions_passenger_response.ok:
-                            raise Exception('failed_to_get_directions')
-                        application.logger.debug("google directions responses:")
-                        application.logger.debug(directions_trip_response)
-                        application.logger.debug(directions_passenger_response)
-                        if directions_trip_response.json()['routes'] and directions_passenger_response.json()['routes']:
-                            directions_trip = directions_trip_response.json()['routes'][0]['overview_polyline'][
-                                'points']
-                            directions_to_passenger = directions_passenger_response.json()['routes'][0][
-                                'overview_polyline']['points']
-                            distance = directions_trip_response.json()['routes'][0]['legs'][0]['distance'][
-                                'value'] / 1000.0
-                            time_travel = directions_trip_response.json()['routes'][0]['legs'][0]['duration'][
-                                'value'] / 60.0
-                            time_pickup = directions_passenger_response.json()['routes'][0]['legs'][0]['duration'][
-                                'value'] / 60.0
-                        else:
-                            raise Exception('unreachable_destination')
-
-                        cost_estimation_data = {
-                            "start_location": [data['latitude_initial'], data['longitude_initial']],
-                            "end_location": [data['latitude_initial'], data['longitude_initial']],
-                            "distance_in_km": distance,
-                            "time_pickup_in_min": time_pickup,
-                            "time_travel_in_min": time_travel,
-                            "pay_method": "credit",
-                            "driver_id": User.get_user_by_username(assigned_driver).uid,
-                            "passenger_id": User.get_user_by_username(username).uid
+                        send_push_notifications(assigned_driver, message, data)
+                        response = {
+                            'status': 'success',
+                            'message': 'request_submitted',
+                            'id': str(result.inserted_id),
+                            'directions': estimation['directions_trip'],
+                            'driver': assigned_driver,
+                            'estimated_cost': estimation['cost'],
+                            'estimated_time_wait': estimation['time_pickup'],
+                            'estimated_time_travel': estimation['time_travel']
                         }
-                        resp = estimate_trip_cost(cost_estimation_data)
-                        if resp.ok:
-                            cost = resp.json()['value']
-                            db.drivers.update_one({'username': assigned_driver}, {'$set': {'trip': True}})
-                            application.logger.info("driver assigned")
-                            result = db.requests.insert_one(
-                                {'rider': username, 'driver': assigned_driver, 'coordinates': data,
-                                'request_time': time.time()})
-                            message = "trip_assigned"
-                            data = {
-                                'rider': username,
-                                'directions_to_passenger': directions_to_passenger,
-                                'directions_trip': directions_trip,
-                                'trip_coordinates': data,
-                                'id': str(result.inserted_id)
-                            }
-                            send_push_notifications(assigned_driver, message, data)
-                            response = {
-                                'status': 'success',
-                                'message': 'request_submitted',
-                                'id': str(result.inserted_id),
-                                'directions': directions_trip,
-                                'driver': assigned_driver,
-                                'estimated_cost': cost,
-                                'estimated_time_wait': time_pickup,
-                                'estimated_time_travel': time_travel
-                            }
-                            status_code = 201
-                        else:
-                            raise Exception('failed_to_get_cost_estimation')
+                        status_code = 201
                     else:
                         response = {
                             'status': 'fail',
                             'message': 'no_driver_available'
                         }
                         status_code = 200
-                else:
-                    response = {
-                        'status': 'fail',
-                        'message': 'request_or_trip_ongoing'
-                    }
-                    status_code = 409
             else:
                 response = {
                     'status': 'fail',
-                    'message': 'unauthorized_request'
+                    'message': 'request_or_trip_ongoing'
                 }
-                status_code = 401
+                status_code = 409
             return make_response(jsonify(response)), status_code
-        except SchemaError:
-            application.logger.error("Request data error")
-            response = {
-                'status': 'fail',
-                'message': 'bad_request_data'
-            }
-            return make_response(jsonify(response)), 400
         except Exception as exc:  # pragma: no cover
-            application.logger.error('Error msg: {0}. Error doc: {1}'
-                                     .format(exc.message, exc.__doc__))
-            response = {
-                'status': 'fail',
-                'message': 'internal_error',
-                'error_description': exc.message
-            }
-            return make_response(jsonify(response)), 500
+            return internal_error(exc)
 
 
 class RequestCancellation(MethodView):
     """Handler for request cancellation"""
 
     @staticmethod
+    @authenticated()
     def delete(request_id):
         """Endpoint for cancelling an unstarted trip a.k.a a request made that was matched"""
 
         try:
-            auth_header = request.headers.get('Authorization')
-            token_username, error_message = Authenticator.authenticate(auth_header)
-            if error_message:
-                response = {
-                    'status': 'fail',
-                    'message': error_message
-                }
-                return make_response(jsonify(response)), 401
-            application.logger.info("Verifying token: {}".format(auth_header))
+            token_username = g.username
             application.logger.info("Cancellation was requested by: {}".format(token_username))
             result = db.requests.find_one({'_id': ObjectId(request_id)})
             if result:
@@ -198,17 +131,19 @@ class RequestCancellation(MethodView):
                     application.logger.info("Permission granted")
                     application.logger.info("User cancelling request: {}".format(token_username))
                     db.requests.delete_one({'_id': ObjectId(request_id)})
-                    db.drivers.update_one({'username': driver_username}, {'$set': {'trip': False}})
-                    message = "trip_cancelled"
-                    if token_username == driver_username:
-                        receiver = rider_username
-                    else:
-                        receiver = driver_username
-                    data = {
-                        'id': request_id,
-                        'by': token_username
-                    }
-                    send_push_notifications(receiver, message, data)
+                    if driver_username:
+                        # Los pedidos que siguen pendientes de asignacion no tienen driver
+                        DriversMixin.set_trip(driver_username, False)
+                        message = "trip_cancelled"
+                        if token_username == driver_username:
+                            receiver = rider_username
+                        else:
+                            receiver = driver_username
+                        data = {
+                            'id': request_id,
+                            'by': token_username
+                        }
+                        send_push_notifications(receiver, message, data)
                     response = {
                         'status': 'success',
                         'message': 'request_cancelled'
@@ -228,19 +163,143 @@ class RequestCancellation(MethodView):
                 status_code = 404
             return make_response(jsonify(response)), status_code
         except Exception as exc:  # pragma: no cover
-            application.logger.error('Error msg: {0}. Error doc: {1}'
-                                     .format(exc.message, exc.__doc__))
-            response = {
-                'status': 'fail',
-                'message': 'internal_error',
-                'error_description': exc.message
-            }
-            return make_response(jsonify(response)), 500
+            return internal_error(exc)
+
+
+class RequestStatusAPI(MethodView):
+    """Handler for querying the state of a request"""
+
+    @staticmethod
+    @authenticated()
+    def get(request_id):
+        """Endpoint for polling a request, used to know whether a queued request was assigned"""
+
+        try:
+            token_username = g.username
+            application.logger.info("Request status was asked by: {}".format(token_username))
+            if not ObjectId.is_valid(request_id):
+                result = None
+            else:
+                result = db.requests.find_one({'_id': ObjectId(request_id)})
+            if result:
+                if token_username == result['driver'] or token_username == result['rider']:
+                    response = {
+                        'status': 'success',
+                        'message': 'request_' + result.get('status', 'assigned'),
+                        'id': request_id,
+                        'driver': result['driver']
+                    }
+                    estimation = result.get('estimation')
+                    if estimation:
+                        response.update({
+                            'directions': estimation['directions_trip'],
+                            'estimated_cost': estimation['cost'],
+                            'estimated_time_wait': estimation['time_pickup'],
+                            'estimated_time_travel': estimation['time_travel']
+                        })
+                    status_code = 200
+                else:
+                    response = {
+                        'status': 'fail',
+                        'message': 'unauthorized_action'
+                    }
+                    status_code = 401
+            else:
+                response = {
+                    'status': 'fail',
+                    'message': 'no_request_found'
+                }
+                status_code = 404
+            return make_response(jsonify(response)), status_code
+        except Exception as exc:  # pragma: no cover
+            return internal_error(exc)
+
+
+def driver_location_events(driver, auth_header, deadline):
+    """Yields the server-sent events with the positions of the driver, starting with the
+    current one, until the deadline passes (then the client reconnects). The token is checked
+    again before each event, if it can't be used anymore the last event is an error"""
+    subscription = LOCATION_HUB.subscribe(driver)
+    try:
+        position = DriversMixin.get_drivers_positions([driver]).get(driver)
+        if not position:
+            # Algo de respuesta enseguida, para que los proxies no corten el request
+            yield ': keepalive\n\n'
+        while time.time() < deadline:
+            error_message = Authenticator.authenticate(auth_header)[1]
+            if error_message:
+                yield 'event: error\ndata: {}\n\n'.format(json.dumps({
+                    'status': 'fail',
+                    'message': error_message
+                }))
+                break
+            if position:
+                yield 'event: position\ndata: {}\n\n'.format(json.dumps({
+                    'driver': driver,
+                    'latitude': position[0],
+                    'longitude': position[1]
+                }))
+            try:
+                position = subscription.get(timeout=LOCATION_STREAM_KEEPALIVE)
+            except Queue.Empty:
+                position = None
+                # Para que los proxies no cierren la conexion
+                yield ': keepalive\n\n'
+    finally:
+        LOCATION_HUB.unsubscribe(driver, subscription)
+
+
+class RequestDriverLocationAPI(MethodView):
+    """Handler for following the driver of a request or trip"""
+
+    @staticmethod
+    @authenticated()
+    def get(request_id):
+        """Endpoint for subscribing to the position of the driver (as server-sent events)"""
+
+        try:
+            token_username = g.username
+            result = None
+            if ObjectId.is_valid(request_id):
+                # El viaje conserva el id del pedido
+                query = {'_id': ObjectId(request_id)}
+                fields = {'rider': 1, 'driver': 1}
+                result = db.requests.find_one(query, fields) or db.trips.find_one(query, fields)
+            if not result:
+                response = {
+                    'status': 'fail',
+                    'message': 'no_request_found'
+                }
+                return make_response(jsonify(response)), 404
+            if token_username != result['rider'] and token_username != result['driver']:
+                response = {
+                    'status': 'fail',
+                    'message': 'unauthorized_action'
+                }
+                return make_response(jsonify(response)), 401
+            if not result['driver']:
+                response = {
+                    'status': 'fail',
+                    'message': 'request_pending'
+                }
+                return make_response(jsonify(response)), 409
+            application.logger.info("{} follows driver {}".format(token_username, result['driver']))
+            auth_header = request.headers.get('Authorization')
+            # No dura mas que el token
+            deadline = min(time.time() + LOCATION_STREAM_MAX_DURATION,
+                           Authenticator.expiration_of(auth_header))
+            return Response(driver_location_events(result['driver'], auth_header, deadline),
+                            mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        except Exception as exc:  # pragma: no cover
+            return internal_error(exc)
 
 
 # define the API resources
 REQUESTS_SUBMISSION_VIEW = RequestSubmission.as_view('request_submission')
 REQUEST_CANCELLATION_VIEW = RequestCancellation.as_view('request_cancellation')
+REQUEST_STATUS_VIEW = RequestStatusAPI.as_view('request_status')
+REQUEST_DRIVER_LOCATION_VIEW = RequestDriverLocationAPI.as_view('request_driver_location')
 
 # add Rules for API Endpoints
 REQUESTS_BLUEPRINT.add_url_rule(
@@ -254,3 +313,15 @@ REQUESTS_BLUEPRINT.add_url_rule(
     view_func=REQUEST_CANCELLATION_VIEW,
     methods=['DELETE']
 )
+
+REQUESTS_BLUEPRINT.add_url_rule(
+    '/requests/<request_id>',
+    view_func=REQUEST_STATUS_VIEW,
+    methods=['GET']
+)
+
+REQUESTS_BLUEPRINT.add_url_rule(
+    '/requests/<request_id>/driver/location',
+    view_func=REQUEST_DRIVER_LOCATION_VIEW,
+    methods=['GET']
+)
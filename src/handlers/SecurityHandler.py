@@ -1,12 +1,15 @@
 """Handlers related with loging in and out an user"""
 
-from flask import Blueprint, request, make_response, jsonify
+from flask import Blueprint, g, request, make_response, jsonify
 from flask.views import MethodView
 
 from app import db, application
+from src.decorators import authenticated, internal_error
 from src.models import User, BlacklistToken
 from src.services.shared_server import validate_user
-from src.mixins.AuthenticationMixin import Authenticator
+from src.mixins.AuthenticationMixin import VERIFIED_TOKENS
+from src.mixins.TokenBlacklistMixin import TOKEN_BLACKLIST
+from src.mixins.RevocationsMixin import REVOCATIONS
 
 SECURITY_BLUEPRINT = Blueprint('security', __name__)
 
@@ -47,7 +50,6 @@ class SecurityAPI(MethodView):
             application.logger.info("Login: user exists")
             resp = validate_user(username, password)
             if resp.ok:
-                user = User.get_user_by_username(username)
                 application.logger.info("Login: password OK")
                 auth_token = user.encode_auth_token()
                 application.logger.info(isinstance(auth_token, unicode))
@@ -77,24 +79,20 @@ class SecurityAPI(MethodView):
 
     # LOGOUT
     @staticmethod
+    @authenticated()
     def delete():
         """Endpoint for loging out a user, blacklists authentication token"""
 
         try:
-            auth_header = request.headers.get('Authorization')
-            token_username, error_message = Authenticator.authenticate(auth_header)
-            if error_message:
-                response = {
-                    'status': 'fail',
-                    'message': error_message
-                }
-                return make_response(jsonify(response)), 401
-            auth_token = auth_header.split(" ")[1]
+            auth_token = request.headers.get('Authorization').split(" ")[1]
             application.logger.debug("Log Out: {}".format(auth_token))
-            application.logger.info("Log Out: {}".format(token_username))
+            application.logger.info("Log Out: {}".format(g.username))
             blacklist_token = BlacklistToken(token=auth_token)
             application.logger.debug("blacklistToken created")
-            db.blacklistedTokens.insert_one(blacklist_token.__dict__)
+            blacklist_token.save()
+            TOKEN_BLACKLIST.add(blacklist_token.digest)
+            REVOCATIONS.publish(blacklist_token.digest)
+            VERIFIED_TOKENS.evict(auth_token)
             application.logger.debug("blacklistToken inserted")
             response_object = {
                 'status': 'success',
@@ -102,13 +100,7 @@ class SecurityAPI(MethodView):
             }
             return make_response(jsonify(response_object)), 200
         except Exception as exc:  # pragma: no cover
-            application.logger.error('Error msg: {0}. Error doc: {1}'
-                                     .format(exc.message, exc.__doc__))
-            response = {
-                'status': 'fail',
-                'message': 'internal_error'
-            }
-            return make_response(jsonify(response)), 500
+            return internal_error(exc)
 
 
 # define the API resources
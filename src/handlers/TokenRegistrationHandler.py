@@ -1,12 +1,11 @@
 """Handlers for manipulating the firebase token"""
 
-from flask import Blueprint, request, make_response, jsonify
+from flask import Blueprint, g, make_response, jsonify
 from flask.views import MethodView
-from schema import Schema, Use, SchemaError
+from schema import Use
 
 from app import db, application
-from src.mixins.AuthenticationMixin import Authenticator
-from src.models import User
+from src.decorators import validated, authenticated, internal_error
 
 TOKEN_MANIPULATION_BLUEPRINT = Blueprint('token_push_notifications', __name__)
 
@@ -15,66 +14,22 @@ class PushNotificationAPI(MethodView):
     """Handlers for manipulating the firebase token"""
 
     @staticmethod
+    @validated({'push_token': Use(unicode)})
+    @authenticated(role='user', unauthorized='unauthorized_update')
     def put(username):
         """Endpoint for changing an user's push notification token"""
         try:
-            data = request.get_json()
-            schema = Schema([{'push_token': Use(unicode)}])
-            # IMPORTANTE: el 0 es para que devuelva el diccionario dentro y no una lista
-            data = schema.validate([data])[0]
-            application.logger.info("Asked to update {}'s position coordinates'".format(username))
-            user = User.get_user_by_username(username)
-            if not user:
-                response = {
-                    'status': 'fail',
-                    'message': 'user_not_found'
-                }
-                return make_response(jsonify(response)), 404
-            application.logger.info("user {} exists".format(username))
-            auth_header = request.headers.get('Authorization')
-            token_username, error_message = Authenticator.authenticate(auth_header)
-            if error_message:
-                response = {
-                    'status': 'fail',
-                    'message': error_message
-                }
-                return make_response(jsonify(response)), 401
-            application.logger.info("Updating user's push token w/ Auth: {}".format(auth_header))
-            application.logger.info("Token decoded: Update was requested by: {}"
-                                    .format(token_username))
-            if token_username == username:
-                application.logger.info("Permission granted")
-                application.logger.info("User's position to update: {}".format(token_username))
-                push_token = data['push_token']
-                db.users.update_one({'username': username}, {'$set': {'push_token': push_token}})
-                response = {
-                    'status': 'success',
-                    'message': 'push_token_updated'
-                }
-                return make_response(jsonify(response)), 200
+            application.logger.info("User's push token to update: {}".format(username))
+            push_token = g.data['push_token']
+            db.users.update_one({'username': username}, {'$set': {'push_token': push_token}})
+            db.drivers.update_one({'username': username}, {'$set': {'push_token': push_token}})
             response = {
-                'status': 'fail',
-                'message': 'unauthorized_update'
+                'status': 'success',
+                'message': 'push_token_updated'
             }
-            return make_response(jsonify(response)), 401
-
-        except SchemaError:
-            application.logger.error("Request data error")
-            response = {
-                'status': 'fail',
-                'message': 'bad_request_data'
-            }
-            return make_response(jsonify(response)), 400
-
+            return make_response(jsonify(response)), 200
         except Exception as exc:  # pragma: no cover
-            application.logger.error('Error msg: {0}. Error doc: {1}'.
-                                     format(exc.message, exc.__doc__))
-            response = {
-                'status': 'fail',
-                'message': 'internal_error',
-                'error_description': exc.message
-            }
-            return make_response(jsonify(response)), 500
+            return internal_error(exc)
 
 
 # define the API resources
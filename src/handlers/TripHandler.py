@@ -1,13 +1,16 @@
 """Handlers related with trips"""
 
-from flask import Blueprint, request, make_response, jsonify
+from flask import Blueprint, g, make_response, jsonify
 from flask.views import MethodView
-from schema import Schema, And, Use, SchemaError
+from schema import And, Use
 from bson.objectid import ObjectId
 
 from app import db, application
+from src.decorators import validated, authenticated, current_user, internal_error
 from src.models import User
-from src.mixins.AuthenticationMixin import Authenticator
+from src.mixins.DriversMixin import DriversMixin
+from src.mixins.OdometerMixin import ODOMETER
+from src.mixins.TracksMixin import TRACKS, TracksMixin
 from src.mixins.TrackingMixin import TrackingTripsMixin
 from src.mixins.TripsMixin import add_usernames_to_trip
 from src.services.push_notifications import send_push_notifications
@@ -21,248 +24,168 @@ class TripsAPI(MethodView):
     """Handler for trips related API"""
 
     @staticmethod
+    @validated({'request_id': And(Use(unicode), lambda x: ObjectId.is_valid(x))})
+    @authenticated(role='driver', unauthorized='unauthorized_action')
     def post(username):
         """Endpoint for starting a trip"""
 
         try:
-            data = request.get_json()
-            schema = Schema([{'request_id': And(Use(unicode), lambda x: ObjectId.is_valid(x))}])
-            # IMPORTANTE: el 0 es para que devuelva el diccionario dentro y no una lista
-            data = schema \
-                .validate([data])[0]
-            requestID = data['request_id']
-            application.logger.info("{} asked to start a trip".format(username))
-            if db.drivers.count({'username': username}) == 0:
-                response = {
-                    'status': 'fail',
-                    'message': 'driver_not_found'
-                }
-                return make_response(jsonify(response)), 404
-            application.logger.info("driver {} exists".format(username))
-            auth_header = request.headers.get('Authorization')
-            token_username, error_message = Authenticator.authenticate(auth_header)
-            if error_message:
-                response = {
-                    'status': 'fail',
-                    'message': error_message
-                }
-                return make_response(jsonify(response)), 401
-            application.logger.info("Token decoded: {}".format(token_username))
-            if token_username == username:
-                application.logger.info("Permission granted")
-                application.logger.info("Driver starting trip: {}".format(token_username))
-                result = db.requests.find_one({'_id': ObjectId(requestID)})
-                if result:
-                    if result['driver'] == username:
-                        location_initial = (result['coordinates']['latitude_initial'],result['coordinates']['longitude_initial'])
-                        if TrackingTripsMixin.check_positions_with_location([result['driver'],result['rider']],location_initial):
-                            db.requests.delete_one({'_id': ObjectId(requestID)})
-                            result['start_time'] = time.time()
-                            result['distance'] = 0.0
-                            result_insertion = db.trips.insert_one(result)
-                            message = "trip_started"
-                            data = {}
-                            send_push_notifications(result['rider'], message, data)
-                            response = {
-                                'status': 'success',
-                                'message': 'trip_started',
-                                'id': str(result_insertion.inserted_id)
-                            }
-                            status_code = 201
-                        else:
-                            response = {
-                                'status': 'fail',
-                                'message': 'users_not_in_start_location',
-                            }
-                            status_code = 200
-
-                    else:
+            requestID = g.data['request_id']
+            application.logger.info("Driver starting trip: {}".format(username))
+            result = db.requests.find_one({'_id': ObjectId(requestID)})
+            if result:
+                if result['driver'] == username:
+                    location_initial = (result['coordinates']['latitude_initial'],result['coordinates']['longitude_initial'])
+                    if not TrackingTripsMixin.check_positions_with_location([result['driver'],result['rider']],location_initial):
                         response = {
                             'status': 'fail',
-                            'message': 'unauthorized_for_request'
+                            'message': 'users_not_in_start_location',
+                        }
+                        status_code = 200
+                    elif not DriversMixin.confirm_trip(username, result.get('expires_at')):
+                        response = {
+                            'status': 'fail',
+                            'message': 'request_expired'
+                        }
+                        status_code = 409
+                    else:
+                        db.requests.delete_one({'_id': ObjectId(requestID)})
+                        result.pop('expires_at', None)
+                        result['start_time'] = time.time()
+                        result['distance'] = 0.0
+                        result_insertion = db.trips.insert_one(result)
+                        ODOMETER.start(username, result_insertion.inserted_id)
+                        message = "trip_started"
+                        data = {}
+                        send_push_notifications(result['rider'], message, data)
+                        response = {
+                            'status': 'success',
+                            'message': 'trip_started',
+                            'id': str(result_insertion.inserted_id)
                         }
-                        status_code = 401
+                        status_code = 201
+
                 else:
                     response = {
                         'status': 'fail',
-                        'message': 'request_not_found'
+                        'message': 'unauthorized_for_request'
                     }
-                    status_code = 404
+                    status_code = 401
             else:
                 response = {
                     'status': 'fail',
-                    'message': 'unauthorized_action'
+                    'message': 'request_not_found'
                 }
-                status_code = 401
+                status_code = 404
             return make_response(jsonify(response)), status_code
-        except SchemaError:
-            application.logger.error("Request data error")
-            response = {
-                'status': 'fail',
-                'message': 'bad_request_data'
-            }
-            return make_response(jsonify(response)), 400
         except Exception as exc:  # pragma: no cover
-            application.logger.error('Error msg: {0}. Error doc: {1}'
-                                     .format(exc.message, exc.__doc__))
-            response = {
-                'status': 'fail',
-                'message': 'internal_error',
-                'error_description': exc.message
-            }
-            return make_response(jsonify(response)), 500
+            return internal_error(exc)
 
     @staticmethod
+    @authenticated(role='driver', unauthorized='unauthorized_action')
     def delete(username):
         """Endpoint for finishing an ongoing trip"""
 
         try:
-            application.logger.info("{} asked to finish a trip".format(username))
-            if db.drivers.count({'username': username}) == 0:
-                response = {
-                    'status': 'fail',
-                    'message': 'driver_not_found'
-                }
-                return make_response(jsonify(response)), 404
-            application.logger.info("driver {} exists".format(username))
-            auth_header = request.headers.get('Authorization')
-            token_username, error_message = Authenticator.authenticate(auth_header)
-            if error_message:
-                response = {
-                    'status': 'fail',
-                    'message': error_message
-                }
-                return make_response(jsonify(response)), 401
-            application.logger.info("Token decoded: {}".format(token_username))
-            if token_username == username:
-                application.logger.info("Permission granted")
-                application.logger.info("Driver finishing trip: {}".format(token_username))
-                result = db.trips.find_one({'driver': username})
-                if result:
-                    location_final = (result['coordinates']['latitude_final'],result['coordinates']['longitude_final'])
-                    if TrackingTripsMixin.check_positions_with_location([result['driver'],result['rider']],location_final):
-                        coordinates = result['coordinates']
-                        finish_time = time.time()
-                        time_pickup = ( result['start_time'] - result['request_time'] ) / 60.0
-                        time_travel = ( finish_time - result['start_time'] ) / 60.0
-                        cost_data = {
-                            "start_location": [coordinates['latitude_initial'], coordinates['longitude_initial']],
+            application.logger.info("Driver finishing trip: {}".format(username))
+            result = db.trips.find_one({'driver': username})
+            if result:
+                location_final = (result['coordinates']['latitude_final'],result['coordinates']['longitude_final'])
+                if TrackingTripsMixin.check_positions_with_location([result['driver'],result['rider']],location_final):
+                    coordinates = result['coordinates']
+                    # Recien ahora se cierra el viaje, con la distancia que faltaba escribir
+                    TRACKS.flush(result['_id'])
+                    trip = ODOMETER.finish(username, result['_id'])
+                    if trip:
+                        result['distance'] = trip['distance']
+                        # El track reemplaza al odometro solo si tiene todos los fixes que se midieron
+                        track_distance = TracksMixin.track_distance(result['_id'], trip.get('fixes', 0))
+                        if track_distance is not None:
+                            result['distance'] = track_distance
+                    finish_time = time.time()
+                    time_pickup = ( result['start_time'] - result['request_time'] ) / 60.0
+                    time_travel = ( finish_time - result['start_time'] ) / 60.0
+                    driver_id = current_user().uid
+                    passenger_id = User.get_user_by_username(result['rider']).uid
+                    cost_data = {
+                        "start_location": [coordinates['latitude_initial'], coordinates['longitude_initial']],
+                        'end_location': [coordinates['latitude_final'], coordinates['longitude_final']],
+                        "distance_in_km": result['distance'],
+                        "time_pickup_in_min": time_pickup,
+                        "time_travel_in_min": time_travel,
+                        "pay_method": "credit",
+                        "driver_id": driver_id,
+                        "passenger_id": passenger_id
+                    }
+                    resp = estimate_trip_cost(cost_data)
+                    if resp.ok:
+                        cost = resp.json()['value']
+                        data = {
+                            'start_location': [coordinates['latitude_initial'], coordinates['longitude_initial']],
                             'end_location': [coordinates['latitude_final'], coordinates['longitude_final']],
-                            "distance_in_km": result['distance'],
-                            "time_pickup_in_min": time_pickup,
-                            "time_travel_in_min": time_travel,
-                            "pay_method": "credit",
-                            "driver_id": User.get_user_by_username(username).uid,
-                            "passenger_id": User.get_user_by_username(result['rider']).uid
+                            'distance': result['distance'],
+                            'pay_method': 'credit',
+                            'currency': '$',
+                            'cost': cost,
+                            'driver_id': driver_id,
+                            'passenger_id': passenger_id
                         }
-                        resp = estimate_trip_cost(cost_data)
+                        resp = register_trip(data)
                         if resp.ok:
-                            cost = resp.json()['value']
+                            db.trips.delete_one({'driver': username})
+                            DriversMixin.set_trip(username, False)
+                            message = "trip_finished"
                             data = {
-                                'start_location': [coordinates['latitude_initial'], coordinates['longitude_initial']],
-                                'end_location': [coordinates['latitude_final'], coordinates['longitude_final']],
-                                'distance': result['distance'],
-                                'pay_method': 'credit',
-                                'currency': '$',
-                                'cost': cost,
-                                'driver_id': User.get_user_by_username(username).uid,
-                                'passenger_id': User.get_user_by_username(result['rider']).uid
+                                'trip_ss_id': resp.json()['id'],
+                                'cost': cost
+                            }
+                            send_push_notifications(result['rider'], message, data)
+                            response = {
+                                'status': 'success',
+                                'message': 'trip_finished',
+                                'trip_ss_id': resp.json()['id'],
+                                'cost': cost
                             }
-                            resp = register_trip(data)
-                            if resp.ok:
-                                db.trips.delete_one({'driver': username})
-                                db.drivers.update_one({'username': username}, {'$set': {'trip': False}})
-                                message = "trip_finished"
-                                data = {
-                                    'trip_ss_id': resp.json()['id'],
-                                    'cost': cost
-                                }
-                                send_push_notifications(result['rider'], message, data)
-                                response = {
-                                    'status': 'success',
-                                    'message': 'trip_finished',
-                                    'trip_ss_id': resp.json()['id'],
-                                    'cost': cost
-                                }
-                                status_code = 203
-                            else:
-                                response = resp.json()
-                                status_code = resp.status_code
+                            status_code = 203
                         else:
                             response = resp.json()
                             status_code = resp.status_code
                     else:
-                        response = {
-                            'status': 'fail',
-                            'message': 'users_not_in_final_location',
-                        }
-                        status_code = 200
+                        response = resp.json()
+                        status_code = resp.status_code
                 else:
                     response = {
                         'status': 'fail',
-                        'message': 'trip_not_found'
+                        'message': 'users_not_in_final_location',
                     }
-                    status_code = 404
+                    status_code = 200
             else:
                 response = {
                     'status': 'fail',
-                    'message': 'unauthorized_action'
+                    'message': 'trip_not_found'
                 }
-                status_code = 401
+                status_code = 404
             return make_response(jsonify(response)), status_code
         except Exception as exc:  # pragma: no cover
-            application.logger.error('Error msg: {0}. Error doc: {1}'
-                                     .format(exc.message, exc.__doc__))
-            response = {
-                'status': 'fail',
-                'message': 'internal_error',
-                'error_description': exc.message
-            }
-            return make_response(jsonify(response)), 500
+            return internal_error(exc)
 
     @staticmethod
+    @authenticated(unauthorized='unauthorized_action')
     def get(username):
         """Endpoint for getting all the trips made by the user"""
 
         try:
-            application.logger.info("{} asked for its trips".format(username))
-            auth_header = request.headers.get('Authorization')
-            token_username, error_message = Authenticator.authenticate(auth_header)
-            if error_message:
-                response = {
-                    'status': 'fail',
-                    'message': error_message
-                }
-                return make_response(jsonify(response)), 401
-            application.logger.info("Token decoded: {}".format(token_username))
-            if token_username == username:
-                application.logger.info("Permission granted")
-                application.logger.info("User getting  trips: {}".format(token_username))
-                user_id = db.users.find_one({"username": username})['uid']
-                trips = get_trips(user_id)
-                trips = [add_usernames_to_trip(trip) for trip in trips]
-                response = {
-                    'status': 'success',
-                    'message': 'trips_retrieved',
-                    'trips': trips
-                }
-                status_code = 200
-            else:
-                response = {
-                    'status': 'fail',
-                    'message': 'unauthorized_action'
-                }
-                status_code = 401
-            return make_response(jsonify(response)), status_code
-        except Exception as exc:  # pragma: no cover
-            application.logger.error('Error msg: {0}. Error doc: {1}'
-                                     .format(exc.message, exc.__doc__))
+            application.logger.info("User getting  trips: {}".format(username))
+            trips = get_trips(current_user().uid)
+            trips = [add_usernames_to_trip(trip) for trip in trips]
             response = {
-                'status': 'fail',
-                'message': 'internal_error',
-                'error_description': exc.message
+                'status': 'success',
+                'message': 'trips_retrieved',
+                'trips': trips
             }
-            return make_response(jsonify(response)), 500
+            return make_response(jsonify(response)), 200
+        except Exception as exc:  # pragma: no cover
+            return internal_error(exc)
 
 
 # define the API resources
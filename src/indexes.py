@@ -0,0 +1,70 @@
+"""Indexes required by the queries made against the db"""
+import os
+
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE
+
+from app import db
+from src.mixins.RevocationsMixin import REVOCATIONS
+
+POSITION_EXPIRATION = int(os.environ.get('POSITION_EXPIRATION', 3600))  # seconds
+
+
+def ensure_indexes():
+    """Creates (if they don't exist yet) the indexes used by the app"""
+    # Unico para que la primera posicion no se inserte dos veces, ver PositionsMixin.store_positions.
+    # Si ya existe sin unique lo reemplaza manage.py migrate
+    if 'username_1' not in db.positions.index_information():
+        db.positions.create_index('username', unique=True)
+    # Las posiciones que no se actualizan (usuarios que cerraron la app) se borran solas
+    db.positions.create_index('last_seen', expireAfterSeconds=POSITION_EXPIRATION)
+    db.drivers.create_index('username')
+    db.drivers.create_index([('location', GEOSPHERE), ('duty', ASCENDING), ('trip', ASCENDING),
+                             ('last_seen', ASCENDING)])
+    db.drivers.create_index('slot', unique=True, sparse=True)
+    db.tracks.create_index('trip_id')
+    # Sparse para poder crearlo antes de migrar los tokens guardados enteros (sin digest), ver
+    # manage.py migrate. Si ya existe (sin sparse) es que ya no quedan
+    if 'digest_1' not in db.blacklistedTokens.index_information():
+        db.blacklistedTokens.create_index('digest', unique=True, sparse=True)
+    # Los tokens revocados solo hace falta guardarlos mientras no expiren
+    db.blacklistedTokens.create_index('expires_at', expireAfterSeconds=0)
+    REVOCATIONS.create_collection()
+
+
+def drop_obsolete_indexes():
+    """Drops the indexes created by older versions that the app doesn't use anymore, run from
+    manage.py migrate. Returns the names of the dropped ones"""
+    obsolete = [
+        # Los drivers se buscan por su propio documento, ver DriversMixin.get_closer_drivers
+        (db.positions, 'location_2dsphere'),
+        # Los pedidos abandonados los borra DriversMixin.release_expired_leases, junto con el aviso
+        # al rider y la liberacion del driver (un TTL los borraba sin ninguna de las dos)
+        (db.requests, 'expires_at_1'),
+    ]
+    dropped = []
+    for collection, index in obsolete:
+        if index in collection.index_information():
+            collection.drop_index(index)
+            dropped.append('{}.{}'.format(collection.name, index))
+    return dropped
+
+
+def unique_positions():
+    """Replaces the index on the username of the positions created by older versions with a
+    unique one, dropping the duplicated positions first (the newest one of each user is kept).
+    Run from manage.py migrate, returns how many positions were dropped"""
+    index = db.positions.index_information().get('username_1')
+    if index and index.get('unique'):
+        return 0
+    dropped = 0
+    duplicated = db.positions.aggregate([{'$group': {'_id': '$username', 'count': {'$sum': 1}}},
+                                         {'$match': {'count': {'$gt': 1}}}])
+    for user in duplicated:
+        newest = db.positions.find({'username': user['_id']}, {'_id': 1}) \
+            .sort('last_seen', DESCENDING).limit(1)[0]
+        dropped += db.positions.delete_many({'username': user['_id'],
+                                             '_id': {'$ne': newest['_id']}}).deleted_count
+    if index:
+        db.positions.drop_index('username_1')
+    db.positions.create_index('username', unique=True)
+    return dropped
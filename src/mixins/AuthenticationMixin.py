@@ -1,8 +1,78 @@
 """Mixins for authentication stuff"""
-from src.models import User
+import calendar
+import datetime
+import os
+import threading
+from collections import OrderedDict
+
+from src.models import User, BlacklistToken
 from src.exceptions import InvalidTokenException, ExpiredTokenException
+from src.mixins.TokenBlacklistMixin import TOKEN_BLACKLIST
+from src.mixins.RevocationsMixin import REVOCATIONS
 from app import application
 
+VERIFIED_TOKENS_SIZE = int(os.environ.get('VERIFIED_TOKENS_SIZE', 10000))
+
+
+class VerifiedTokens(object):
+    """LRU cache of the tokens whose signature was already verified, with their subject.
+
+    A token is served from here until it expires. It's checked against the blacklist again
+    only when new revocations show up (when the blacklist revision changes), including the
+    ones made by other workers, which arrive through REVOCATIONS.
+    """
+
+    def __init__(self, size=VERIFIED_TOKENS_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, token):
+        """Gets the username of a verified token, None if it isn't cached or can't be used anymore"""
+        with self.lock:
+            entry = self.entries.pop(token, None)
+            if entry is None:
+                return None
+            self.entries[token] = entry
+        username, expires_at, digest, revision = entry
+        if datetime.datetime.utcnow() >= expires_at:
+            self.evict(token)
+            return None
+        TOKEN_BLACKLIST.ensure_refreshed()
+        if revision != TOKEN_BLACKLIST.revision:
+            revision = TOKEN_BLACKLIST.revision
+            if TOKEN_BLACKLIST.contains(digest):
+                self.evict(token)
+                return None
+            with self.lock:
+                if token in self.entries:
+                    self.entries[token] = (username, expires_at, digest, revision)
+        return username
+
+    def put(self, token, username):
+        """Caches a token that was just verified"""
+        # Sin revision, asi se revisa la blacklist una vez mas por si lo revocaron mientras se verificaba
+        entry = (username, BlacklistToken.expiration_of(token), BlacklistToken.digest_of(token), None)
+        REVOCATIONS.start()
+        with self.lock:
+            self.entries.pop(token, None)
+            self.entries[token] = entry
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def evict(self, token):
+        """Forgets a token (e.g. after logging out with it)"""
+        with self.lock:
+            self.entries.pop(token, None)
+
+    def clear(self):
+        """Forgets every token"""
+        with self.lock:
+            self.entries.clear()
+
+
+VERIFIED_TOKENS = VerifiedTokens()
+
 
 class Authenticator(object):
     """Utility class for anything related with authentication"""
@@ -15,7 +85,10 @@ class Authenticator(object):
         try:
             if auth_header and len(auth_header.split(" ")) == 2 and auth_header.split(" ")[1]:
                 auth_token = auth_header.split(" ")[1]
-                username = User.decode_auth_token(auth_token)
+                username = VERIFIED_TOKENS.get(auth_token) or ''
+                if not username:
+                    username = User.decode_auth_token(auth_token)
+                    VERIFIED_TOKENS.put(auth_token, username)
             else:
                 application.logger.info("Missing token")
                 error_message = 'missing_token'
@@ -29,3 +102,8 @@ class Authenticator(object):
             error_message = 'invalid_token'
 
         return username, error_message
+
+    @staticmethod
+    def expiration_of(auth_header):
+        """Gets when (in seconds since the epoch) the token of a valid auth header expires"""
+        return calendar.timegm(BlacklistToken.expiration_of(auth_header.split(" ")[1]).timetuple())
@@ -0,0 +1,173 @@
+"""Mixins for dispatching the pending requests in batches"""
+import os
+import time
+
+from app import db, application
+from src.mixins.DriversMixin import DriversMixin
+from src.mixins.RequestsMixin import RequestsMixin
+from src.services.push_notifications import send_push_notifications
+
+DISPATCH_MODE = os.environ.get('DISPATCH_MODE', 'immediate')  # 'immediate' o 'batch'
+DISPATCH_WINDOW = float(os.environ.get('DISPATCH_WINDOW', 2))  # seconds
+DISPATCH_CANDIDATES = int(os.environ.get('DISPATCH_CANDIDATES', 10))
+DISPATCH_MAX_WAIT = float(os.environ.get('DISPATCH_MAX_WAIT', 120))  # seconds
+
+
+def solve_assignment(costs):
+    """Solves the assignment problem for the given cost matrix with the hungarian method.
+
+    Returns the (row, column) pairs that minimize the total cost. Every row gets a column,
+    unless there are less columns than rows (in that case every column gets a row).
+    """
+    if not costs or not costs[0]:
+        return []
+    if len(costs) > len(costs[0]):
+        transposed = [list(column) for column in zip(*costs)]
+        return sorted((row, column) for column, row in solve_assignment(transposed))
+    rows, columns = len(costs), len(costs[0])
+    row_potential = [0.0] * (rows + 1)
+    column_potential = [0.0] * (columns + 1)
+    # Las filas y columnas se numeran desde 1, la columna 0 es auxiliar
+    matched_row = [0] * (columns + 1)
+    previous_column = [0] * (columns + 1)
+    for row in range(1, rows + 1):
+        matched_row[0] = row
+        column = 0
+        min_slack = [float("inf")] * (columns + 1)
+        used = [False] * (columns + 1)
+        while matched_row[column]:
+            used[column] = True
+            current_row = matched_row[column]
+            delta = float("inf")
+            next_column = 0
+            for candidate in range(1, columns + 1):
+                if not used[candidate]:
+                    slack = costs[current_row - 1][candidate - 1] - row_potential[current_row] \
+                            - column_potential[candidate]
+                    if slack < min_slack[candidate]:
+                        min_slack[candidate] = slack
+                        previous_column[candidate] = column
+                    if min_slack[candidate] < delta:
+                        delta = min_slack[candidate]
+                        next_column = candidate
+            for candidate in range(columns + 1):
+                if used[candidate]:
+                    row_potential[matched_row[candidate]] += delta
+                    column_potential[candidate] -= delta
+                else:
+                    min_slack[candidate] -= delta
+            column = next_column
+        while column:
+            matched_row[column] = matched_row[previous_column[column]]
+            column = previous_column[column]
+    return sorted((matched_row[column] - 1, column - 1)
+                  for column in range(1, columns + 1) if matched_row[column])
+
+
+class Dispatcher(object):
+    """Utility class for assigning all the pending requests at once"""
+
+    @staticmethod
+    def get_pending_requests():
+        """Gets the requests that are waiting for a driver, older first"""
+        return list(db.requests.find({'status': 'pending'}).sort('request_time', 1))
+
+    @staticmethod
+    def build_costs(pending_requests):
+        """Gets the candidate drivers (the closer ones to each pickup) and the matrix with the
+        distance (in km) from each of them to the pickup location of each request"""
+        pickups = [(pending_request['coordinates']['latitude_initial'],
+                    pending_request['coordinates']['longitude_initial'])
+                   for pending_request in pending_requests]
+        drivers = []
+        for pickup in pickups:
+            drivers += [driver for driver in DriversMixin.get_closer_drivers(pickup, DISPATCH_CANDIDATES)
+                        if driver not in drivers]
+        positions = DriversMixin.get_drivers_positions(drivers)
+        drivers = [driver for driver in drivers if driver in positions]
+        costs = [DriversMixin.distances(pickup, [positions[driver] for driver in drivers])
+                 for pickup in pickups]
+        return drivers, costs
+
+    @staticmethod
+    def assign(pending_request, driver):
+        """Assigns the driver to the pending request, returns whether it could be done"""
+        rider = pending_request['rider']
+        request_id = str(pending_request['_id'])
+        lease_expires_at = DriversMixin.claim_driver(driver)
+        if not lease_expires_at:
+            return False
+        try:
+            estimation = RequestsMixin.estimate_trip(rider, driver, pending_request['coordinates'])
+        except Exception as exc:
+            # Queda pendiente para la proxima tanda (o hasta que expire)
+            application.logger.error("Couldn't estimate request {}: {}".format(request_id, exc.message))
+            DriversMixin.set_trip(driver, False)
+            return False
+        result = db.requests.update_one({'_id': pending_request['_id'], 'status': 'pending'},
+                                        {'$set': {'driver': driver, 'status': 'assigned',
+                                                  'estimation': estimation,
+                                                  'expires_at': lease_expires_at}})
+        if not result.modified_count:
+            application.logger.info("Request {} was cancelled while dispatching".format(request_id))
+            DriversMixin.set_trip(driver, False)
+            return False
+        application.logger.info("driver {} assigned to request {}".format(driver, request_id))
+        send_push_notifications(driver, "trip_assigned", {
+            'rider': rider,
+            'directions_to_passenger': estimation['directions_to_passenger'],
+            'directions_trip': estimation['directions_trip'],
+            'trip_coordinates': pending_request['coordinates'],
+            'id': request_id
+        })
+        send_push_notifications(rider, "request_assigned", {
+            'id': request_id,
+            'driver': driver,
+            'directions': estimation['directions_trip'],
+            'estimated_cost': estimation['cost'],
+            'estimated_time_wait': estimation['time_pickup'],
+            'estimated_time_travel': estimation['time_travel']
+        })
+        return True
+
+    @staticmethod
+    def expire_pending_requests():
+        """Drops the requests that have been waiting for too long, letting the riders know"""
+        limit = time.time() - DISPATCH_MAX_WAIT
+        for expired in db.requests.find({'status': 'pending', 'request_time': {'$lt': limit}}):
+            if db.requests.delete_one({'_id': expired['_id'], 'status': 'pending'}).deleted_count:
+                send_push_notifications(expired['rider'], "no_driver_available",
+                                        {'id': str(expired['_id'])})
+
+    @staticmethod
+    def dispatch_pending_requests():
+        """Assigns drivers to the pending requests minimizing the total pickup distance,
+        returns how many requests were assigned"""
+        Dispatcher.expire_pending_requests()
+        pending_requests = Dispatcher.get_pending_requests()
+        if not pending_requests:
+            return 0
+        drivers, costs = Dispatcher.build_costs(pending_requests)
+        assigned = 0
+        for row, column in solve_assignment(costs):
+            if Dispatcher.assign(pending_requests[row], drivers[column]):
+                assigned += 1
+        return assigned
+
+    @staticmethod
+    def run():
+        """Dispatches the pending requests every DISPATCH_WINDOW seconds. Also releases the
+        drivers whose requests were abandoned, so this runs even if DISPATCH_MODE isn't batch"""
+        application.logger.info("Dispatching requests every {} seconds".format(DISPATCH_WINDOW))
+        while True:
+            time.sleep(DISPATCH_WINDOW)
+            try:
+                released = DriversMixin.release_expired_leases()
+                if released:
+                    application.logger.info("{} drivers released".format(released))
+                assigned = Dispatcher.dispatch_pending_requests()
+                if assigned:
+                    application.logger.info("{} requests assigned".format(assigned))
+            except Exception as exc:  # pragma: no cover
+                application.logger.error('Error msg: {0}. Error doc: {1}'
+                                         .format(exc.message, exc.__doc__))
@@ -0,0 +1,167 @@
+"""In-memory spatial grid of the available drivers"""
+import datetime
+from array import array
+import math
+import os
+import threading
+import time
+
+from app import db
+
+GRID_CELL_SIZE = float(os.environ.get('GRID_CELL_SIZE', 0.01))  # degrees
+GRID_RELOAD_INTERVAL = float(os.environ.get('GRID_RELOAD_INTERVAL', 30))  # seconds
+GRID_MAX_RINGS = int(os.environ.get('GRID_MAX_RINGS', 500))
+POSITION_MAX_AGE = int(os.environ.get('POSITION_MAX_AGE', 300))  # seconds
+KM_PER_DEGREE = 111.2
+
+
+class DriversGrid(object):
+    """Fixed size lat/lon cells holding the drivers that are on duty and not on a trip.
+
+    Each worker has its own grid, so it's reloaded from the db every GRID_RELOAD_INTERVAL
+    seconds to pick up the changes made by the other workers.
+
+    The drivers are kept as entries of parallel columns (the usernames in a list, the coordinates
+    in arrays of doubles) and the cells only hold entry numbers, so a driver costs a few bytes
+    instead of a tuple with its boxed floats.
+    """
+
+    def __init__(self, cell_size=GRID_CELL_SIZE, reload_interval=GRID_RELOAD_INTERVAL):
+        self.cell_size = cell_size
+        self.reload_interval = reload_interval
+        self.columns = int(math.ceil(360 / cell_size))
+        self.loaded_at = None
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Drops every driver. New containers are created since rings may be reading the old ones"""
+        with self.lock:
+            self.cells = {}
+            self.entries = {}
+            self.usernames = []
+            self.latitudes = array('d')
+            self.longitudes = array('d')
+            self.free_entries = []
+
+    def cell_of(self, latitude, longitude):
+        """Gets the (row, column) of the cell containing the given coordinates"""
+        row = int(math.floor((latitude + 90) / self.cell_size))
+        column = int(math.floor((longitude + 180) / self.cell_size)) % self.columns
+        return row, column
+
+    def add(self, username, latitude, longitude):
+        """Adds (or moves) an available driver"""
+        with self.lock:
+            self.remove(username)
+            if self.free_entries:
+                entry = self.free_entries.pop()
+                self.usernames[entry] = username
+                self.latitudes[entry] = latitude
+                self.longitudes[entry] = longitude
+            else:
+                entry = len(self.usernames)
+                self.usernames.append(username)
+                self.latitudes.append(latitude)
+                self.longitudes.append(longitude)
+            self.entries[username] = entry
+            self.cells.setdefault(self.cell_of(latitude, longitude), set()).add(entry)
+
+    def remove(self, username):
+        """Removes a driver that is no longer available"""
+        with self.lock:
+            entry = self.entries.pop(username, None)
+            if entry is not None:
+                cell = self.cell_of(self.latitudes[entry], self.longitudes[entry])
+                self.cells[cell].discard(entry)
+                if not self.cells[cell]:
+                    del self.cells[cell]
+                self.usernames[entry] = None
+                self.free_entries.append(entry)
+
+    def move(self, username, latitude, longitude):
+        """Updates the position of a driver, only if it's available"""
+        with self.lock:
+            if username in self.entries:
+                self.add(username, latitude, longitude)
+
+    def load(self):
+        """Rebuilds the grid from the db"""
+        seen_since = datetime.datetime.utcnow() - datetime.timedelta(seconds=POSITION_MAX_AGE)
+        drivers = db.drivers.find({"duty": True, "trip": False, 'last_seen': {'$gte': seen_since}},
+                                  {'username': 1, 'latitude': 1, 'longitude': 1, '_id': 0})
+        with self.lock:
+            self.clear()
+            for driver in drivers:
+                self.add(driver['username'], driver['latitude'], driver['longitude'])
+            self.loaded_at = time.time()
+
+    def ensure_loaded(self):
+        """Loads the grid if it was never loaded or if it's outdated"""
+        if self.loaded_at is None or time.time() - self.loaded_at > self.reload_interval:
+            self.load()
+
+    def rings(self, location):
+        """Yields the drivers around the location, ring of cells by ring of cells.
+
+        Each item is (candidates, lower_bound) where candidates is a tuple with the list of
+        usernames and the arrays of their latitudes and longitudes, and lower_bound is the
+        minimum distance (in km) that any driver yielded afterwards can be from the location.
+        """
+        self.ensure_loaded()
+        with self.lock:
+            cells = self.cells
+            table = (self.usernames, self.latitudes, self.longitudes)
+        center_row, center_column = self.cell_of(*location)
+        pending = len(cells)
+        for ring in range(GRID_MAX_RINGS + 1):
+            if not pending:
+                return
+            if (2 * ring + 1) ** 2 > pending:
+                # Recorrer mas anillos cuesta mas que revisar todas las celdas ocupadas que quedan
+                ring_cells = [cell for cell in list(cells)
+                              if self.ring_of(cell, center_row, center_column) >= ring]
+                yield self.candidates(ring_cells, cells, table), float('inf')
+                return
+            ring_cells = [cell for cell in self.ring_cells(center_row, center_column, ring)
+                          if cell in cells]
+            pending -= len(ring_cells)
+            farthest_latitude = min(abs(location[0]) + (ring + 1) * self.cell_size, 89.9)
+            cell_width = self.cell_size * KM_PER_DEGREE * math.cos(math.radians(farthest_latitude))
+            yield self.candidates(ring_cells, cells, table), ring * cell_width
+
+    def ring_of(self, cell, center_row, center_column):
+        """Gets the ring (chebyshev distance in cells) of a cell relative to the center one"""
+        column_offset = abs(cell[1] - center_column)
+        column_offset = min(column_offset, self.columns - column_offset)
+        return max(abs(cell[0] - center_row), column_offset)
+
+    def ring_cells(self, center_row, center_column, ring):
+        """Gets the cells that are exactly at the given ring around the center one"""
+        if ring == 0:
+            return [(center_row, center_column)]
+        cells = []
+        for offset in range(-ring, ring + 1):
+            cells.append((center_row - ring, (center_column + offset) % self.columns))
+            cells.append((center_row + ring, (center_column + offset) % self.columns))
+        for offset in range(-ring + 1, ring):
+            cells.append((center_row + offset, (center_column - ring) % self.columns))
+            cells.append((center_row + offset, (center_column + ring) % self.columns))
+        return cells
+
+    def candidates(self, ring_cells, cells, table):
+        """Gets the drivers found in the given cells as (usernames, latitudes, longitudes)"""
+        all_usernames, all_latitudes, all_longitudes = table
+        usernames, latitudes, longitudes = [], array('d'), array('d')
+        # Las columnas son las de la carga en la que empezo el recorrido, si el grid se recargo
+        # despues ya nadie las modifica
+        with self.lock:
+            for cell in ring_cells:
+                for entry in cells.get(cell, ()):
+                    usernames.append(all_usernames[entry])
+                    latitudes.append(all_latitudes[entry])
+                    longitudes.append(all_longitudes[entry])
+        return usernames, latitudes, longitudes
+
+
+DRIVERS_GRID = DriversGrid()
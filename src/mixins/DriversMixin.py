@@ -1,11 +1,34 @@
 """Mixins for drivers stuff"""
+import datetime
+import heapq
+from array import array
 import math
+import os
+import time
+from requests import RequestException
 from app import db
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+from src.mixins.DriversGridMixin import DRIVERS_GRID, POSITION_MAX_AGE
+from src.mixins.PositionsBufferMixin import POSITIONS_BUFFER
+from src.mixins.SharedPositionsMixin import SHARED_POSITIONS
+from src.services.google_maps import get_travel_times
+from src.services.push_notifications import send_push_notifications
+
+MATCHING_INDEX = os.environ.get('MATCHING_INDEX', 'db')  # 'db', 'grid' o 'shared'
+MATCHING_SHORTLIST_SIZE = int(os.environ.get('MATCHING_SHORTLIST_SIZE', 5))
+CLAIM_ATTEMPTS = 3
+DRIVER_LEASE_DURATION = int(os.environ.get('DRIVER_LEASE_DURATION', 900))  # seconds
+LEASES_SWEEP_INTERVAL = int(os.environ.get('LEASES_SWEEP_INTERVAL', 60))  # seconds
 
 
 class DriversMixin(object):
     """Utility class for anything related with drivers"""
 
+    leases_swept_at = 0
+
     @staticmethod
     def get_available_drivers():
         """Gets the ids of all the available drivers"""
@@ -13,10 +36,183 @@ class DriversMixin(object):
         return [driver['username'] for driver in
                 db.drivers.find({"duty": True, "trip": False}, {'username': 1, '_id': 0})]
 
+    @staticmethod
+    def set_duty(username, duty):
+        """Updates the duty status of a driver"""
+        driver = db.drivers.find_one_and_update({'username': username}, {'$set': {'duty': duty}})
+        if MATCHING_INDEX == 'grid':
+            if duty and driver and not driver['trip']:
+                DriversMixin.add_to_grid(driver)
+            else:
+                DRIVERS_GRID.remove(username)
+        elif MATCHING_INDEX == 'shared' and driver:
+            SHARED_POSITIONS.update(username, driver, duty=duty)
+
+    @staticmethod
+    def set_trip(username, trip):
+        """Updates the flag that tells whether a driver is busy with a request or trip"""
+        driver = db.drivers.find_one_and_update({'username': username}, {'$set': {'trip': trip},
+                                                                         '$unset': {'lease_expires_at': ''}})
+        if MATCHING_INDEX == 'grid':
+            if not trip and driver and driver['duty']:
+                DriversMixin.add_to_grid(driver)
+            else:
+                DRIVERS_GRID.remove(username)
+        elif MATCHING_INDEX == 'shared' and driver:
+            SHARED_POSITIONS.update(username, driver, trip=trip)
+
+    @staticmethod
+    def claim_driver(username):
+        """Atomically marks an available driver as busy for DRIVER_LEASE_DURATION seconds (unless
+        the trip starts before). Returns when the lease expires, or None if the driver wasn't
+        available (e.g. another request got it first)"""
+        lease_expires_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=DRIVER_LEASE_DURATION)
+        driver = db.drivers.find_one_and_update({'username': username, 'duty': True, 'trip': False},
+                                                {'$set': {'trip': True, 'lease_expires_at': lease_expires_at}})
+        if MATCHING_INDEX == 'grid':
+            DRIVERS_GRID.remove(username)
+        elif MATCHING_INDEX == 'shared' and driver:
+            SHARED_POSITIONS.update(username, driver, trip=True)
+        return lease_expires_at if driver else None
+
+    @staticmethod
+    def claim_closer_driver(location):
+        """Claims the available driver that would get faster to the location. If other requests
+        claim the candidates first, the next ones are tried.
+        Returns the driver and when its lease expires, or (None, None) if none was claimed"""
+        DriversMixin.release_expired_leases_if_due()
+        for attempt in range(CLAIM_ATTEMPTS):
+            candidates = DriversMixin.get_closer_drivers(location, MATCHING_SHORTLIST_SIZE)
+            if not candidates:
+                return None, None
+            if attempt == 0:
+                # Solo se consulta a google una vez por pedido
+                candidates = DriversMixin.rank_by_travel_time(candidates, location)
+            for driver in candidates:
+                lease_expires_at = DriversMixin.claim_driver(driver)
+                if lease_expires_at:
+                    return driver, lease_expires_at
+        return None, None
+
+    @staticmethod
+    def confirm_trip(username, lease_expires_at=None):
+        """Makes the claim over a driver permanent (until the trip finishes), only if the lease
+        (the given one, or any if None) is still held. Returns whether the trip can start"""
+        lease = lease_expires_at if lease_expires_at is not None else {'$exists': True}
+        # Si el lease ya se libero el driver puede estar en otro pedido, el viaje no empieza
+        driver = db.drivers.find_one_and_update({'username': username, 'trip': True,
+                                                 'lease_expires_at': lease},
+                                                {'$set': {'trip': True},
+                                                 '$unset': {'lease_expires_at': ''}})
+        return driver is not None
+
+    @staticmethod
+    def release_expired_leases():
+        """Frees the drivers whose requests were abandoned (the trip never started before the
+        lease expired), dropping those requests. Returns how many drivers were released"""
+        now = datetime.datetime.utcnow()
+        released = 0
+        for driver in db.drivers.find({'trip': True, 'lease_expires_at': {'$lt': now}}, {'username': 1}):
+            username = driver['username']
+            # Si el viaje justo empezo (o lo libero otro worker) el pedido no se toca
+            driver = db.drivers.find_one_and_update({'username': username, 'trip': True,
+                                                     'lease_expires_at': {'$lt': now}},
+                                                    {'$set': {'trip': False},
+                                                     '$unset': {'lease_expires_at': ''}})
+            if not driver:
+                continue
+            released += 1
+            # Solo los pedidos de este lease, el driver ya puede haber sido asignado a otro
+            for expired in db.requests.find({'driver': username,
+                                             'expires_at': {'$lte': driver['lease_expires_at']}}):
+                if db.requests.delete_one({'_id': expired['_id']}).deleted_count:
+                    send_push_notifications(expired['rider'], "request_expired", {'id': str(expired['_id'])})
+            if MATCHING_INDEX == 'grid' and driver['duty']:
+                DriversMixin.add_to_grid(driver)
+            elif MATCHING_INDEX == 'shared':
+                SHARED_POSITIONS.update(username, driver, trip=False)
+        return released
+
+    @staticmethod
+    def release_expired_leases_if_due():
+        """Releases the expired leases at most every LEASES_SWEEP_INTERVAL seconds, so the drivers
+        are freed by the web workers too when the background process isn't running"""
+        now = time.time()
+        if now - DriversMixin.leases_swept_at < LEASES_SWEEP_INTERVAL:
+            return 0
+        DriversMixin.leases_swept_at = now
+        return DriversMixin.release_expired_leases()
+
+    @staticmethod
+    def update_position(username, latitude, longitude, last_seen=None):
+        """Stores the new position of a driver in its document (it does nothing for riders)"""
+        last_seen = last_seen or datetime.datetime.utcnow()
+        db.drivers.update_one({'username': username},
+                              {'$set': {'latitude': latitude, 'longitude': longitude,
+                                        'location': DriversMixin.to_geojson_point(latitude, longitude),
+                                        'last_seen': last_seen}})
+        DriversMixin.track_position(username, latitude, longitude, last_seen)
+
+    @staticmethod
+    def backfill_drivers():
+        """Copies to the documents of the drivers stored by older versions what matching reads
+        from them: the uid and push token of the user and the last known position.
+        Returns how many documents were updated"""
+        updated = 0
+        for driver in db.drivers.find({'$or': [{'uid': {'$exists': False}}, {'location': {'$exists': False}}]},
+                                      {'username': 1, 'uid': 1, 'location': 1}):
+            fields = {}
+            if 'uid' not in driver:
+                user = db.users.find_one({'username': driver['username']}, {'uid': 1, 'push_token': 1})
+                if user:
+                    fields.update(uid=user['uid'], push_token=user.get('push_token', ''))
+            if 'location' not in driver:
+                position = db.positions.find_one({'username': driver['username']},
+                                                 {'latitude': 1, 'longitude': 1, 'last_seen': 1})
+                if position:
+                    fields.update(latitude=position['latitude'], longitude=position['longitude'],
+                                  location=DriversMixin.to_geojson_point(position['latitude'],
+                                                                         position['longitude']),
+                                  last_seen=position.get('last_seen', datetime.datetime.utcnow()))
+            if fields:
+                db.drivers.update_one({'_id': driver['_id']}, {'$set': fields})
+                updated += 1
+        return updated
+
+    @staticmethod
+    def track_position(username, latitude, longitude, last_seen=None):
+        """Lets the in-memory indexes know about a driver's new position"""
+        if MATCHING_INDEX == 'grid':
+            DRIVERS_GRID.move(username, latitude, longitude)
+        elif MATCHING_INDEX == 'shared':
+            SHARED_POSITIONS.update(username, latitude=latitude, longitude=longitude,
+                                    last_seen=last_seen or datetime.datetime.utcnow())
+
+    @staticmethod
+    def add_to_grid(driver):
+        """Adds a driver that became available to the grid, if its position is known"""
+        if 'latitude' in driver:
+            DRIVERS_GRID.add(driver['username'], driver['latitude'], driver['longitude'])
+
+    @staticmethod
+    def seen_since():
+        """Gets the oldest time a position can have been reported to be considered current"""
+        return datetime.datetime.utcnow() - datetime.timedelta(seconds=POSITION_MAX_AGE)
+
     @staticmethod
     def get_positions(drivers_names):
-        return db.positions.find({'username': {'$in': drivers_names}},
-                                 {'username': 1, 'latitude': 1, 'longitude': 1, '_id': 0})
+        """Gets the current positions of the given users, the stale ones are left out"""
+        positions = list(db.positions.find({'username': {'$in': drivers_names},
+                                            'last_seen': {'$gte': DriversMixin.seen_since()}},
+                                           {'username': 1, 'latitude': 1, 'longitude': 1, '_id': 0}))
+        return POSITIONS_BUFFER.overlay(drivers_names, positions)
+
+    @staticmethod
+    def get_drivers_positions(usernames):
+        """Gets the last known (latitude, longitude) of each of the given drivers"""
+        drivers = list(db.drivers.find({'username': {'$in': usernames}, 'latitude': {'$exists': True}},
+                                       {'username': 1, 'latitude': 1, 'longitude': 1, '_id': 0}))
+        return dict((driver['username'], (driver['latitude'], driver['longitude'])) for driver in drivers)
 
     @staticmethod
     def distance(origin, destination):
@@ -35,14 +231,133 @@ class DriversMixin(object):
 
         return final_distance
 
+    @staticmethod
+    def distances(origin, destinations):
+        """Same as distance but from one origin to many destinations at once, using numpy
+        (if installed) so that the whole batch is computed in a single vectorized pass"""
+        if not destinations:
+            return []
+        latitudes, longitudes = zip(*destinations)
+        return DriversMixin.distances_to_columns(origin, latitudes, longitudes)
+
+    @staticmethod
+    def distances_to_columns(origin, latitudes, longitudes):
+        """Same as distances but with the destinations given as a sequence of latitudes and
+        another one of longitudes (e.g. arrays of doubles, which numpy reads without copying)"""
+        if not len(latitudes):
+            return []
+        if numpy is None:
+            return [DriversMixin.distance(origin, destination) for destination in zip(latitudes, longitudes)]
+        radius = 6371  # km
+        lat1, lon1 = numpy.radians(origin[0]), numpy.radians(origin[1])
+        if isinstance(latitudes, array):
+            latitudes, longitudes = numpy.frombuffer(latitudes), numpy.frombuffer(longitudes)
+        lat2 = numpy.radians(numpy.asarray(latitudes, dtype=float))
+        lon2 = numpy.radians(numpy.asarray(longitudes, dtype=float))
+
+        aux = numpy.sin((lat2 - lat1) / 2) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) \
+                                                  * numpy.sin((lon2 - lon1) / 2) ** 2
+        unscaled_distances = 2 * numpy.arctan2(numpy.sqrt(aux), numpy.sqrt(1 - aux))
+        return (radius * unscaled_distances).tolist()
+
+    @staticmethod
+    def to_geojson_point(latitude, longitude):
+        """Builds the GeoJSON point stored along with each position (longitude goes first)"""
+        return {'type': 'Point', 'coordinates': [longitude, latitude]}
+
+    @staticmethod
+    def filter_available_drivers(usernames):
+        """Keeps (in the given order) the usernames that belong to available drivers"""
+        if not usernames:
+            return []
+        available = set(driver['username'] for driver in
+                        db.drivers.find({'username': {'$in': usernames}, 'duty': True, 'trip': False,
+                                         'last_seen': {'$gte': DriversMixin.seen_since()}},
+                                        {'username': 1, '_id': 0}))
+        return [username for username in usernames if username in available]
+
+    @staticmethod
+    def get_nearest_in_grid(location, limit):
+        """Get the ids of the closer drivers searching the in-memory grid ring by ring"""
+        found_usernames, found_distances = [], array('d')
+        for (usernames, latitudes, longitudes), lower_bound in DRIVERS_GRID.rings(location):
+            found_usernames += usernames
+            found_distances.extend(DriversMixin.distances_to_columns(location, latitudes, longitudes))
+            if len(found_distances) >= limit and \
+                    heapq.nsmallest(limit, found_distances)[-1] <= lower_bound:
+                break
+        nearest = heapq.nsmallest(limit, range(len(found_distances)), key=found_distances.__getitem__)
+        return [found_usernames[index] for index in nearest]
+
+    @staticmethod
+    def get_closer_drivers_from_grid(location, limit):
+        """Get the ids of the closer drivers using the grid, confirming their availability on the db
+        since the grid may be outdated regarding changes made by other workers"""
+        while True:
+            drivers = DriversMixin.get_nearest_in_grid(location, limit)
+            available = DriversMixin.filter_available_drivers(drivers)
+            if len(available) == len(drivers):
+                return drivers
+            for driver in set(drivers) - set(available):
+                DRIVERS_GRID.remove(driver)
+
+    @staticmethod
+    def get_closer_drivers_from_shared_table(location, limit):
+        """Get the ids of the closer drivers using the table shared by the workers, confirming
+        their availability on the db since the table may be written while it's read"""
+        excluded = set()
+        while True:
+            slots = SHARED_POSITIONS.nearest(location, limit, DriversMixin.seen_since(), excluded)
+            drivers = SHARED_POSITIONS.usernames_of(slots)
+            available = DriversMixin.filter_available_drivers([driver for driver in drivers if driver])
+            if len(available) == len(slots):
+                return available
+            excluded.update(slot for slot, driver in zip(slots, drivers) if driver not in available)
+
+    @staticmethod
+    def get_closer_drivers(location, limit):
+        """Get the ids of the (at most limit) available drivers closer to the given location,
+        sorted from the closer to the farther one"""
+        if MATCHING_INDEX == 'grid':
+            return DriversMixin.get_closer_drivers_from_grid(location, limit)
+        if MATCHING_INDEX == 'shared' and numpy is not None:
+            return DriversMixin.get_closer_drivers_from_shared_table(location, limit)
+        latitude, longitude = location
+        point = DriversMixin.to_geojson_point(latitude, longitude)
+        return [driver['username'] for driver in
+                db.drivers.find({'location': {'$near': {'$geometry': point}}, 'duty': True, 'trip': False,
+                                 'last_seen': {'$gte': DriversMixin.seen_since()}},
+                                {'username': 1, '_id': 0}).limit(limit)]
+
     @staticmethod
     def get_closer_driver(location):
         """Get the id of the driver which is closer to the given location"""
-        drivers_names = list(DriversMixin.get_available_drivers())
-        drivers_with_position = DriversMixin.get_positions(drivers_names)
-        drivers_with_distance = [(driver['username'],
-                                  DriversMixin.distance((driver['latitude'], driver['longitude']), location))
-                                 for driver in drivers_with_position]
-
-        driver = reduce(lambda x, y: x if x[1] < y[1] else y, drivers_with_distance, (None, float("inf")))
-        return driver[0]
+        drivers = DriversMixin.get_closer_drivers(location, 1)
+        return drivers[0] if drivers else None
+
+    @staticmethod
+    def get_fastest_driver(drivers, location):
+        """Get, among the given drivers, the one that would get faster to the location by road"""
+        drivers = DriversMixin.rank_by_travel_time(drivers, location)
+        return drivers[0] if drivers else None
+
+    @staticmethod
+    def rank_by_travel_time(drivers, location):
+        """Sorts the drivers by the time they would take to get to the location by road.
+        The travel times of all of them are asked to google in a single request, if they can't
+        be obtained the given order is kept"""
+        if len(drivers) < 2:
+            return drivers
+        positions = DriversMixin.get_drivers_positions(drivers)
+        drivers = [driver for driver in drivers if driver in positions]
+        try:
+            response = get_travel_times([positions[driver] for driver in drivers], location)
+            rows = response.json()['rows'] if response.ok else []
+            durations = [row['elements'][0]['duration']['value']
+                         if row['elements'][0].get('status') == 'OK' else float("inf")
+                         for row in rows]
+        except (RequestException, KeyError, IndexError, TypeError, ValueError):
+            durations = []
+        if len(durations) != len(drivers):
+            return drivers
+        return [driver for _, driver in sorted(zip(durations, drivers), key=lambda item: item[0])]
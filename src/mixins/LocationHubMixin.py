@@ -0,0 +1,79 @@
+"""In-process publish/subscribe of the drivers positions"""
+import Queue
+import os
+import threading
+import time
+
+from app import db, application
+
+LOCATION_POLL_INTERVAL = float(os.environ.get('LOCATION_POLL_INTERVAL', 2))  # seconds
+SUBSCRIPTION_QUEUE_SIZE = 10
+
+
+class LocationHub(object):
+    """Fans out the positions of the drivers to the subscriptions of this worker.
+
+    The fixes stored by this worker are published as they arrive. The ones stored by the
+    other workers are picked up every poll_interval seconds, with a single query for all
+    the drivers that have subscriptions.
+    """
+
+    def __init__(self, poll_interval=LOCATION_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.subscriptions = {}
+        self.published = {}
+        self.lock = threading.Lock()
+        self.poller = None
+
+    def subscribe(self, driver):
+        """Gets a queue that receives the (latitude, longitude) of the driver as it moves"""
+        subscription = Queue.Queue(SUBSCRIPTION_QUEUE_SIZE)
+        with self.lock:
+            self.subscriptions.setdefault(driver, set()).add(subscription)
+            if not self.poller:
+                self.poller = threading.Thread(target=self.run)
+                self.poller.daemon = True
+                self.poller.start()
+        return subscription
+
+    def unsubscribe(self, driver, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(driver, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(driver, None)
+                self.published.pop(driver, None)
+
+    def publish(self, driver, latitude, longitude):
+        """Sends the position of the driver to its subscriptions, if it changed"""
+        with self.lock:
+            if driver not in self.subscriptions or self.published.get(driver) == (latitude, longitude):
+                return
+            self.published[driver] = (latitude, longitude)
+            subscriptions = list(self.subscriptions[driver])
+        for subscription in subscriptions:
+            try:
+                subscription.put_nowait((latitude, longitude))
+            except Queue.Full:
+                # El cliente no esta leyendo, se pierde la posicion (le va a llegar la proxima)
+                pass
+
+    def poll(self):
+        """Publishes the positions stored by the other workers"""
+        with self.lock:
+            drivers = list(self.subscriptions)
+        if drivers:
+            for driver in db.drivers.find({'username': {'$in': drivers}, 'latitude': {'$exists': True}},
+                                          {'username': 1, 'latitude': 1, 'longitude': 1, '_id': 0}):
+                self.publish(driver['username'], driver['latitude'], driver['longitude'])
+
+    def run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll()
+            except Exception as exc:  # pragma: no cover
+                application.logger.error("Couldn't poll the drivers positions: {}".format(exc.message))
+
+
+LOCATION_HUB = LocationHub()
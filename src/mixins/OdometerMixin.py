@@ -0,0 +1,127 @@
+"""In-memory odometer of the ongoing trips"""
+import os
+import threading
+import time
+
+from pymongo import ReturnDocument, UpdateOne
+
+from app import db
+from src.mixins.TracksMixin import TRACKS
+
+ODOMETER_PERSIST_INTERVAL = float(os.environ.get('ODOMETER_PERSIST_INTERVAL', 10))  # seconds
+
+
+class Odometer(object):
+    """Distance (in km) covered in the ongoing trips that wasn't added to them in the db yet.
+
+    Every persist_interval seconds the pending distances are added to the trips and the
+    drivers on a trip are reloaded from the db, so each worker knows (at most that late)
+    about the trips started by the others. The distances being written are taken out of
+    pending, and a trip isn't finished while they're being written, so nothing is added twice.
+
+    Along with the distances it adds to the trips how many fixes were measured. Their tracks
+    are written first, so a track that has that many fixes covers the same distance.
+    """
+
+    def __init__(self, persist_interval=ODOMETER_PERSIST_INTERVAL):
+        self.persist_interval = persist_interval
+        self.pending = {}
+        self.pending_fixes = {}
+        self.trips = {}
+        self.persisted_at = None
+        self.lock = threading.Lock()
+        self.persisting = threading.Lock()
+
+    def start(self, driver, trip_id):
+        """Starts measuring the trip of the driver"""
+        with self.lock:
+            self.pending[driver] = 0.0
+            self.pending_fixes[driver] = 0
+            self.trips[driver] = trip_id
+
+    def trip_of(self, driver):
+        """Gets the id of the trip the driver is on, None if it isn't on a trip"""
+        self.ensure_persisted()
+        return self.trips.get(driver)
+
+    def add(self, driver, distance, fixes=0):
+        """Adds the distance (measured with the given number of fixes, already recorded in the
+        track) to the trip of the driver, if it's on one"""
+        self.ensure_persisted()
+        with self.lock:
+            if driver in self.pending:
+                self.pending[driver] += distance
+                self.pending_fixes[driver] = self.pending_fixes.get(driver, 0) + fixes
+
+    def finish(self, driver, trip_id):
+        """Adds the pending distance to the trip of the driver before it's closed, returns the
+        trip with the distance covered and the fixes measured (None if it doesn't exist)"""
+        # Espera a que se termine de escribir lo que ya se saco de pending
+        with self.persisting:
+            with self.lock:
+                distance = self.pending.pop(driver, 0.0)
+                fixes = self.pending_fixes.pop(driver, 0)
+                # Lo medido para otro viaje del driver (ya cerrado) no se le suma a este
+                if self.trips.pop(driver, None) != trip_id:
+                    distance, fixes = 0.0, 0
+            return db.trips.find_one_and_update({'_id': trip_id},
+                                                {'$inc': {'distance': distance, 'fixes': fixes}},
+                                                projection={'distance': 1, 'fixes': 1},
+                                                return_document=ReturnDocument.AFTER)
+
+    def ensure_persisted(self):
+        """Persists the pending distances if they weren't in the last persist_interval seconds"""
+        if self.persisted_at is None or time.time() - self.persisted_at > self.persist_interval:
+            self.persist(wait=False)
+
+    def persist(self, wait=True):
+        """Adds the pending distances to the trips and reloads the drivers that are on a trip.
+        If another thread is already doing it, waits for it unless wait is False"""
+        if not self.persisting.acquire(wait):
+            return
+        try:
+            self.write_pending()
+        finally:
+            self.persisting.release()
+
+    def write_pending(self):
+        """Adds the pending distances to the trips and reloads the drivers that are on a trip"""
+        with self.lock:
+            # Lo que se sume mientras se escribe queda para la proxima vez
+            persisted, self.pending = self.pending, dict((driver, 0.0) for driver in self.pending)
+            persisted_fixes, self.pending_fixes = self.pending_fixes, {}
+            persisted_trips = dict(self.trips)
+            self.persisted_at = time.time()
+        try:
+            # Los fixes que se cuentan tienen que estar antes en el track
+            TRACKS.flush_all()
+            trips = dict((trip['driver'], trip['_id']) for trip in db.trips.find({}, {'driver': 1}))
+            # Lo de los viajes que ya se cerraron (en otro worker) se descarta, cada suma va a su
+            # viaje y no al que el driver tenga ahora
+            updates = [UpdateOne({'_id': persisted_trips[driver]},
+                                 {'$inc': {'distance': distance, 'fixes': persisted_fixes.get(driver, 0)}})
+                       for driver, distance in persisted.items()
+                       if persisted_trips.get(driver) in trips.values() and
+                       (distance or persisted_fixes.get(driver))]
+            if updates:
+                db.trips.bulk_write(updates, ordered=False)
+        except Exception:
+            with self.lock:
+                for driver, distance in persisted.items():
+                    if driver in self.pending:
+                        self.pending[driver] += distance
+                        self.pending_fixes[driver] = self.pending_fixes.get(driver, 0) + \
+                            persisted_fixes.get(driver, 0)
+            raise
+        with self.lock:
+            # Se mantienen los viajes que siguen abiertos y los que empezaron mientras se escribia
+            current = dict((driver, trip_id) for driver, trip_id in self.trips.items()
+                           if trip_id in trips.values() or trip_id != persisted_trips.get(driver))
+            for driver, trip_id in trips.items():
+                current.setdefault(driver, trip_id)
+            self.trips = current
+            self.pending = dict((driver, self.pending.get(driver, 0.0)) for driver in current)
+            self.pending_fixes = dict((driver, fixes) for driver, fixes in self.pending_fixes.items()
+                                      if driver in current)
+
+ODOMETER = Odometer()
@@ -0,0 +1,99 @@
+"""In-memory buffer of the positions waiting to be written to the db"""
+import atexit
+import os
+import threading
+import time
+
+from pymongo import UpdateOne
+
+from app import db, application
+
+POSITIONS_WRITE_MODE = os.environ.get('POSITIONS_WRITE_MODE', 'direct')  # 'direct' o 'buffered'
+POSITIONS_FLUSH_INTERVAL = int(os.environ.get('POSITIONS_FLUSH_INTERVAL', 500))  # ms
+
+
+class PositionsBuffer(object):
+    """Keeps only the latest position of each user and writes all of them every
+    flush_interval ms with a single unordered bulk write per collection.
+
+    Each worker has its own buffer, the positions reported to the other workers reach
+    the db (and so this worker) at most flush_interval ms later. Only the riders are buffered,
+    the drivers are written right away so matching sees where they are.
+    """
+
+    def __init__(self, flush_interval=POSITIONS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.flushing = {}
+        self.lock = threading.Lock()
+        self.flusher = None
+
+    def add(self, username, latitude, longitude, last_seen):
+        """Buffers the position of a user, replacing the one that wasn't written yet"""
+        with self.lock:
+            self.pending[username] = (latitude, longitude, last_seen)
+            if not self.flusher:
+                self.start()
+
+    def get(self, username):
+        """Gets the buffered (latitude, longitude, last_seen) of a user, if any"""
+        with self.lock:
+            return self.pending.get(username) or self.flushing.get(username)
+
+    def overlay(self, usernames, positions):
+        """Replaces the given positions (dicts with username, latitude and longitude) of the
+        given users with the ones that are still in the buffer"""
+        with self.lock:
+            if not self.pending and not self.flushing:
+                return positions
+            buffered = {}
+            for username in usernames:
+                position = self.pending.get(username) or self.flushing.get(username)
+                if position:
+                    buffered[username] = position
+        if not buffered:
+            return positions
+        return [position for position in positions if position['username'] not in buffered] + \
+            [{'username': username, 'latitude': position[0], 'longitude': position[1]}
+             for username, position in buffered.items()]
+
+    def flush(self):
+        """Writes the buffered positions, returns how many were written"""
+        with self.lock:
+            if not self.pending:
+                return 0
+            self.flushing, self.pending = self.pending, {}
+        positions = []
+        for username, (latitude, longitude, last_seen) in self.flushing.items():
+            fields = {'latitude': latitude, 'longitude': longitude, 'last_seen': last_seen}
+            positions.append(UpdateOne({'username': username}, {'$set': fields}, upsert=True))
+        try:
+            db.positions.bulk_write(positions, ordered=False)
+        except Exception:
+            # Se reintenta en la proxima tanda, salvo que ya haya llegado una posicion mas nueva
+            with self.lock:
+                for username, position in self.flushing.items():
+                    self.pending.setdefault(username, position)
+            raise
+        finally:
+            with self.lock:
+                self.flushing = {}
+        return len(positions)
+
+    def start(self):
+        """Starts flushing the buffer in background"""
+        self.flusher = threading.Thread(target=self.run)
+        self.flusher.daemon = True
+        self.flusher.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval / 1000.0)
+            try:
+                self.flush()
+            except Exception as exc:  # pragma: no cover
+                application.logger.error("Couldn't flush the positions: {}".format(exc.message))
+
+
+POSITIONS_BUFFER = PositionsBuffer()
+atexit.register(POSITIONS_BUFFER.flush)
@@ -0,0 +1,187 @@
+"""Mixins for storing the positions reported by the users"""
+import datetime
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app import db
+from src.mixins.DriversMixin import DriversMixin
+from src.mixins.LocationHubMixin import LOCATION_HUB
+from src.mixins.OdometerMixin import ODOMETER
+from src.mixins.PositionsBufferMixin import POSITIONS_BUFFER, POSITIONS_WRITE_MODE
+from src.mixins.TracksMixin import TRACKS
+
+POSITIONS_BATCH_MAX_SIZE = 1000
+ROLE_CACHE_DURATION = int(os.environ.get('ROLE_CACHE_DURATION', 300))  # seconds
+ROLES_CACHE = {}
+POSITION_DEADBAND_DISTANCE = float(os.environ.get('POSITION_DEADBAND_DISTANCE', 0))  # meters
+POSITION_DEADBAND_INTERVAL = float(os.environ.get('POSITION_DEADBAND_INTERVAL', 30))  # seconds
+DEADBAND_MAX_USERS = 100000
+MAX_CLOCK_SKEW = 86400  # seconds, los timestamps mas adelantados son de otra unidad (e.g. ms)
+
+
+class Deadband(object):
+    """Skips the fixes that moved less than distance meters since the stored position of the
+    user, unless interval seconds passed (so the position doesn't get stale). A distance of 0
+    turns it off.
+
+    The last position written by this worker for each user (the max_users most recent ones)
+    is only a first filter, the fixes it would skip are checked against the stored position,
+    that may have been written by another worker.
+    """
+
+    def __init__(self, distance=POSITION_DEADBAND_DISTANCE, interval=POSITION_DEADBAND_INTERVAL,
+                 max_users=DEADBAND_MAX_USERS):
+        self.distance = distance
+        self.interval = interval
+        self.max_users = max_users
+        self.last = OrderedDict()
+        self.received = 0
+        self.suppressed = 0
+        self.lock = threading.Lock()
+
+    def is_redundant(self, username, latitude, longitude, force=False):
+        """Gets whether the fix can be skipped (never if forced), if it can't it's taken as the
+        last one written"""
+        now = time.time()
+        with self.lock:
+            self.received += 1
+            last = self.last.get(username)
+        redundant = bool(not force and self.distance and last and
+                         self.is_close(last, (latitude, longitude), now - last[2]))
+        if redundant:
+            stored = PositionsMixin.get_last_position(username)
+            redundant = bool(stored and stored[2] and self.is_close(
+                stored, (latitude, longitude), (datetime.datetime.utcnow() - stored[2]).total_seconds()))
+        with self.lock:
+            if redundant:
+                self.suppressed += 1
+            else:
+                # Se descartan los usuarios que hace mas tiempo que no reportan
+                self.last.pop(username, None)
+                self.last[username] = (latitude, longitude, now)
+                if len(self.last) > self.max_users:
+                    self.last.popitem(last=False)
+        return redundant
+
+    def is_close(self, position, location, elapsed):
+        """Gets whether the location is less than distance meters from the position, that was
+        taken elapsed seconds ago"""
+        return elapsed < self.interval and \
+            DriversMixin.distance(position[:2], location) * 1000 < self.distance
+
+    def stats(self):
+        """Gets how many position updates were received and how many of them were skipped"""
+        with self.lock:
+            return {'received': self.received, 'suppressed': self.suppressed,
+                    'written': self.received - self.suppressed}
+
+
+DEADBAND = Deadband()
+
+
+class PositionsMixin(object):
+    """Utility class for anything related with the users positions"""
+
+    @staticmethod
+    def fix_timestamp(fix):
+        """Gets when the fix was taken (the clocks of the phones can't be ahead of ours)"""
+        return min(fix.get('timestamp', time.time()), time.time())
+
+    @staticmethod
+    def fix_time(fix):
+        """Gets when the fix was taken as an utc datetime (with the precision of the db)"""
+        return datetime.datetime.utcfromtimestamp(round(PositionsMixin.fix_timestamp(fix), 3))
+
+    @staticmethod
+    def is_valid_timestamp(timestamp):
+        """Gets whether a timestamp reported by a phone can be taken as seconds since the epoch"""
+        return 0 < timestamp < time.time() + MAX_CLOCK_SKEW
+
+    @staticmethod
+    def path_distance(path):
+        """Gets the distance (in km) covered going through the given (latitude, longitude)"""
+        return sum(DriversMixin.distance(origin, destination)
+                   for origin, destination in zip(path, path[1:]))
+
+    @staticmethod
+    def get_last_position(username):
+        """Gets the last known (latitude, longitude, last_seen) of a user, None if it's unknown"""
+        buffered = POSITIONS_BUFFER.get(username)
+        if buffered:
+            return buffered
+        position = db.positions.find_one({'username': username},
+                                         {'latitude': 1, 'longitude': 1, 'last_seen': 1, '_id': 0})
+        if position:
+            return position['latitude'], position['longitude'], position.get('last_seen')
+        return None
+
+    @staticmethod
+    def is_driver(username):
+        """Gets whether the user is a driver. Roles are cached for ROLE_CACHE_DURATION seconds,
+        they only change if the account is removed and registered again"""
+        role = ROLES_CACHE.get(username)
+        if not role or role[1] < time.time():
+            role = (db.drivers.count({'username': username}) > 0, time.time() + ROLE_CACHE_DURATION)
+            ROLES_CACHE[username] = role
+        return role[0]
+
+    @staticmethod
+    def forget_role(username):
+        """Drops the cached role of a user"""
+        ROLES_CACHE.pop(username, None)
+
+    @staticmethod
+    def store_positions(username, fixes):
+        """Stores the last of the fixes (given in the order they were taken) as the position of
+        the user. If it's a driver on a trip, the distance covered through all of them is added
+        to the trip. The fixes taken before the stored position (e.g. a delayed upload) are left
+        out. Returns False if the fixes were skipped because they barely moved or are old"""
+        latitude = fixes[-1]['latitude']
+        longitude = fixes[-1]['longitude']
+        # Los lotes se guardan siempre, sus fixes intermedios pueden haberse alejado
+        if DEADBAND.is_redundant(username, latitude, longitude, force=len(fixes) > 1):
+            return False
+        last_seen = PositionsMixin.fix_time(fixes[-1])
+        is_driver = PositionsMixin.is_driver(username)
+        # Los drivers se escriben siempre en la base, el matching ($near) y los demas workers
+        # tienen que ver su posicion actual
+        if POSITIONS_WRITE_MODE == 'buffered' and not is_driver:
+            previous = PositionsMixin.get_last_position(username)
+            if previous and previous[2] and previous[2] > last_seen:
+                return False
+            POSITIONS_BUFFER.add(username, latitude, longitude, last_seen)
+        else:
+            # Un solo viaje a la base para los riders, los drivers tambien actualizan su documento
+            query = {'username': username, 'last_seen': {'$not': {'$gt': last_seen}}}
+            update = {'$set': {'latitude': latitude, 'longitude': longitude, 'last_seen': last_seen}}
+            projection = {'latitude': 1, 'longitude': 1, 'last_seen': 1, '_id': 0}
+            try:
+                previous = db.positions.find_one_and_update(query, update, projection=projection,
+                                                            upsert=True,
+                                                            return_document=ReturnDocument.BEFORE)
+            except DuplicateKeyError:
+                # O ya hay una mas nueva, o la primera la inserto otro pedido al mismo tiempo
+                previous = db.positions.find_one_and_update(query, update, projection=projection,
+                                                            return_document=ReturnDocument.BEFORE)
+                if not previous:
+                    return False
+            previous = previous and (previous['latitude'], previous['longitude'], previous.get('last_seen'))
+            if is_driver:
+                DriversMixin.update_position(username, latitude, longitude, last_seen)
+        if previous and previous[2]:
+            fixes = [fix for fix in fixes if PositionsMixin.fix_time(fix) >= previous[2]]
+        LOCATION_HUB.publish(username, latitude, longitude)
+        trip_id = ODOMETER.trip_of(username)
+        if trip_id:
+            TRACKS.record(trip_id, username, [(PositionsMixin.fix_timestamp(fix), fix['latitude'],
+                                               fix['longitude']) for fix in fixes])
+            path = [(fix['latitude'], fix['longitude']) for fix in fixes]
+            if previous:
+                path = [previous[:2]] + path
+            ODOMETER.add(username, PositionsMixin.path_distance(path), len(fixes))
+        return True
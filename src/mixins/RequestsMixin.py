@@ -0,0 +1,65 @@
+"""Mixins for trip requests stuff"""
+from app import db, application
+from src.models import User
+from src.services.google_maps import get_directions
+from src.services.shared_server import estimate_trip_cost
+
+
+class RequestsMixin(object):
+    """Utility class for anything related with trip requests"""
+
+    @staticmethod
+    def estimate_trip(rider, driver, coordinates):
+        """Gets the directions, times and cost of a trip made by the given driver for the given
+        rider, raises an exception if any of them can't be obtained"""
+        driver_position = db.drivers.find_one({'username': driver})
+        if not driver_position or 'latitude' not in driver_position:
+            raise Exception('driver_position_unknown')
+        coordinates_to_passenger = {
+            'latitude_initial': driver_position['latitude'],
+            'longitude_initial': driver_position['longitude'],
+            'latitude_final': coordinates['latitude_initial'],
+            'longitude_final': coordinates['longitude_initial']
+        }
+        directions_trip_response = get_directions(coordinates)
+        directions_passenger_response = get_directions(coordinates_to_passenger)
+        if not directions_trip_response.ok or not directions_passenger_response.ok:
+            raise Exception('failed_to_get_directions')
+        application.logger.debug("google directions responses:")
+        application.logger.debug(directions_trip_response)
+        application.logger.debug(directions_passenger_response)
+        if directions_trip_response.json()['routes'] and directions_passenger_response.json()['routes']:
+            directions_trip = directions_trip_response.json()['routes'][0]['overview_polyline'][
+                'points']
+            directions_to_passenger = directions_passenger_response.json()['routes'][0][
+                'overview_polyline']['points']
+            distance = directions_trip_response.json()['routes'][0]['legs'][0]['distance'][
+                'value'] / 1000.0
+            time_travel = directions_trip_response.json()['routes'][0]['legs'][0]['duration'][
+                'value'] / 60.0
+            time_pickup = directions_passenger_response.json()['routes'][0]['legs'][0]['duration'][
+                'value'] / 60.0
+        else:
+            raise Exception('unreachable_destination')
+
+        cost_estimation_data = {
+            "start_location": [coordinates['latitude_initial'], coordinates['longitude_initial']],
+            "end_location": [coordinates['latitude_initial'], coordinates['longitude_initial']],
+            "distance_in_km": distance,
+            "time_pickup_in_min": time_pickup,
+            "time_travel_in_min": time_travel,
+            "pay_method": "credit",
+            "driver_id": driver_position.get('uid') or User.get_user_by_username(driver).uid,
+            "passenger_id": User.get_user_by_username(rider).uid
+        }
+        resp = estimate_trip_cost(cost_estimation_data)
+        if not resp.ok:
+            raise Exception('failed_to_get_cost_estimation')
+        return {
+            'directions_trip': directions_trip,
+            'directions_to_passenger': directions_to_passenger,
+            'distance': distance,
+            'time_travel': time_travel,
+            'time_pickup': time_pickup,
+            'cost': resp.json()['value']
+        }
@@ -0,0 +1,82 @@
+"""Propagation of the revoked tokens to every worker"""
+import datetime
+import os
+import threading
+import time
+
+from bson import ObjectId
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+from app import db, application
+from src.mixins.TokenBlacklistMixin import TOKEN_BLACKLIST, BLACKLIST_REFRESH_OVERLAP
+
+REVOCATIONS_SIZE = int(os.environ.get('REVOCATIONS_SIZE', 2 ** 20))  # bytes
+REVOCATIONS_RETRY_INTERVAL = float(os.environ.get('REVOCATIONS_RETRY_INTERVAL', 1))  # seconds
+
+
+class RevocationsFeed(object):
+    """Channel between the workers for the revoked tokens: db.revocations, a capped collection
+    where every logout publishes the digest of the token.
+
+    Each worker tails it with a thread (started with the first token it caches) and passes
+    the digests to its blacklist as they arrive, so the tokens cached by the worker are checked
+    again right away. If the cursor dies it's opened again from the last revocation seen,
+    minus some margin (the _id are generated by the workers and may arrive out of order).
+    """
+
+    def __init__(self, size=REVOCATIONS_SIZE, retry_interval=REVOCATIONS_RETRY_INTERVAL):
+        self.size = size
+        self.retry_interval = retry_interval
+        self.last_id = None
+        self.lock = threading.Lock()
+        self.tailer = None
+
+    def create_collection(self):
+        """Creates the capped collection, if it doesn't exist yet"""
+        try:
+            db.create_collection('revocations', capped=True, size=self.size)
+        except CollectionInvalid:
+            pass
+
+    def publish(self, digest):
+        """Notifies every worker that the token with the given digest was revoked"""
+        db.revocations.insert_one({'digest': digest})
+
+    def start(self):
+        """Starts following the revocations, if this worker isn't doing it yet"""
+        if self.tailer:
+            return
+        with self.lock:
+            if not self.tailer:
+                self.tailer = threading.Thread(target=self.run)
+                self.tailer.daemon = True
+                self.tailer.start()
+
+    def tail(self):
+        """Passes the revocations to the blacklist while the cursor is alive"""
+        # Lo anterior ya lo leyo la blacklist de db.blacklistedTokens
+        since = self.last_id.generation_time if self.last_id else datetime.datetime.utcnow()
+        since -= datetime.timedelta(seconds=BLACKLIST_REFRESH_OVERLAP)
+        cursor = db.revocations.find({'_id': {'$gte': ObjectId.from_datetime(since)}},
+                                     cursor_type=CursorType.TAILABLE_AWAIT)
+        while cursor.alive:
+            for revocation in cursor:
+                TOKEN_BLACKLIST.follow(revocation['digest'])
+                self.last_id = max(self.last_id, revocation['_id']) if self.last_id else revocation['_id']
+            # Sin revocaciones nuevas por un rato, igual se sabe que se estan siguiendo. Si no hay
+            # ninguna que coincida con la consulta el cursor muere enseguida, eso no es seguirlas
+            if cursor.alive:
+                TOKEN_BLACKLIST.follow()
+
+    def run(self):
+        while True:
+            try:
+                self.create_collection()
+                self.tail()
+            except Exception as exc:  # pragma: no cover
+                application.logger.error("Couldn't follow the revocations: {}".format(exc.message))
+            time.sleep(self.retry_interval)
+
+
+REVOCATIONS = RevocationsFeed()
@@ -0,0 +1,184 @@
+"""Drivers positions table shared (through a memory mapped file) by all the workers of a host"""
+import datetime
+import fcntl
+import mmap
+import os
+import threading
+
+from pymongo import ReturnDocument
+
+from app import db, application
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+SHARED_POSITIONS_PATH = os.environ.get('SHARED_POSITIONS_PATH', '/dev/shm/fiuber-positions')
+SHARED_POSITIONS_CAPACITY = int(os.environ.get('SHARED_POSITIONS_CAPACITY', 100000))  # drivers
+# Lo pone el master de gunicorn al arrancar, los workers de otro arranque no usan la misma tabla
+SHARED_POSITIONS_STAMP = os.environ.get('SHARED_POSITIONS_STAMP', '')
+EPOCH = datetime.datetime(1970, 1, 1)
+RECORD = [('latitude', '<f8'), ('longitude', '<f8'), ('last_seen', '<f8'), ('duty', 'u1'), ('trip', 'u1')]
+# Cambia con el formato de RECORD
+LAYOUT_VERSION = 1
+HEADER = [('version', '<u4'), ('ready', 'u1'), ('stamp', 'S32')]
+HEADER_SIZE = 64  # bytes
+
+
+def to_timestamp(moment):
+    """Gets the seconds since the epoch of a (naive, utc) datetime"""
+    return (moment - EPOCH).total_seconds()
+
+
+class SharedPositions(object):
+    """Fixed size records (latitude, longitude, last_seen, duty, trip) of the drivers, one per slot.
+
+    Each driver gets a slot the first time it's seen (the slot is stored in its document, so every
+    worker agrees on it) and the records are read and written in place in a file that all the
+    workers of the host map into memory. Every field is written on its own, without locks, so the
+    drivers found must still be confirmed against the db, which stays the source of truth.
+
+    The file starts with a header with the layout version, the stamp of the boot that filled it
+    and whether it was completely filled. The first worker of a new boot (or version) fills it
+    again from the db, holding a lock on the file that makes the others wait until it's done.
+    Without a stamp (e.g. the dispatcher) any complete table is used.
+    """
+
+    def __init__(self, path=SHARED_POSITIONS_PATH, capacity=SHARED_POSITIONS_CAPACITY,
+                 stamp=SHARED_POSITIONS_STAMP):
+        self.path = path
+        self.capacity = capacity
+        self.stamp = stamp
+        self.header = None
+        self.records = None
+        self.slots = {}
+        self.usernames = {}
+        self.lock = threading.RLock()
+
+    def open(self):
+        """Maps the table into memory, filling it from the db if it's missing, incomplete or was
+        filled by another boot"""
+        size = HEADER_SIZE + self.capacity * numpy.dtype(RECORD).itemsize
+        descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # Los demas procesos esperan aca mientras uno la llena
+            fcntl.flock(descriptor, fcntl.LOCK_EX)
+            if os.fstat(descriptor).st_size < size:
+                os.ftruncate(descriptor, size)
+            memory = mmap.mmap(descriptor, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            header = numpy.frombuffer(memory, dtype=HEADER, count=1)
+            self.records = numpy.frombuffer(memory, dtype=RECORD, count=self.capacity, offset=HEADER_SIZE)
+            if not self.is_current(header[0]):
+                header['ready'] = 0
+                self.records.fill(0)
+                header['version'] = LAYOUT_VERSION
+                header['stamp'] = self.stamp
+                self.load()
+                header['ready'] = 1
+            self.header = header
+        finally:
+            # El mmap se queda con un duplicado del descriptor, cerrarlo no suelta el lock
+            fcntl.flock(descriptor, fcntl.LOCK_UN)
+            os.close(descriptor)
+
+    def is_current(self, header):
+        """Gets whether the table was completely filled by this boot and version"""
+        return bool(header['ready'] and header['version'] == LAYOUT_VERSION and
+                    (not self.stamp or header['stamp'] == self.stamp))
+
+    def ensure_open(self):
+        """Opens the table the first time it's used"""
+        if self.header is None:
+            with self.lock:
+                if self.header is None:
+                    self.open()
+
+    def load(self):
+        """Copies the drivers whose position is known from the db to the table"""
+        for driver in db.drivers.find({'latitude': {'$exists': True}}):
+            self.slot_of(driver['username'], driver)
+
+    def assign_slot(self, username):
+        """Gives a slot to a driver that doesn't have one yet, returns the updated document"""
+        counter = db.counters.find_one_and_update({'_id': 'driver_slots'}, {'$inc': {'seq': 1}},
+                                                  upsert=True, return_document=ReturnDocument.AFTER)
+        # Si otro worker le dio un slot primero, queda el suyo
+        db.drivers.update_one({'username': username, 'slot': {'$exists': False}},
+                              {'$set': {'slot': counter['seq'] - 1}})
+        return db.drivers.find_one({'username': username})
+
+    def slot_of(self, username, driver=None):
+        """Gets the slot of a driver (None if it's unknown or the table is full). The first time
+        the worker sees the driver its record is refreshed from the given (or stored) document"""
+        slot = self.slots.get(username)
+        if slot is not None:
+            return slot
+        if not driver or 'slot' not in driver:
+            driver = db.drivers.find_one({'username': username})
+            if not driver:
+                return None
+            if 'slot' not in driver:
+                driver = self.assign_slot(username)
+        slot = driver['slot']
+        if slot >= self.capacity:
+            application.logger.warning("No room for driver {} in the shared positions".format(username))
+            return None
+        self.write(slot, duty=driver.get('duty', False), trip=driver.get('trip', False))
+        if 'latitude' in driver:
+            self.write(slot, latitude=driver['latitude'], longitude=driver['longitude'],
+                       last_seen=driver.get('last_seen', EPOCH))
+        with self.lock:
+            self.slots[username] = slot
+            self.usernames[slot] = username
+        return slot
+
+    def write(self, slot, **fields):
+        """Sets the given fields of the record in the slot"""
+        for field, value in fields.items():
+            if field == 'last_seen':
+                value = to_timestamp(value)
+            self.records[field][slot] = value
+
+    def update(self, username, driver=None, **fields):
+        """Sets the given fields of the record of a driver"""
+        if numpy is None:
+            return
+        self.ensure_open()
+        slot = self.slot_of(username, driver)
+        if slot is not None:
+            self.write(slot, **fields)
+
+    def nearest(self, location, limit, seen_since, excluded=()):
+        """Gets the slots of the (at most limit) closer drivers that are available and were seen
+        since the given time, sorted from the closer to the farther one"""
+        self.ensure_open()
+        records = self.records
+        slots = numpy.flatnonzero((records['duty'] == 1) & (records['trip'] == 0) &
+                                  (records['last_seen'] >= to_timestamp(seen_since)))
+        if len(excluded):
+            slots = numpy.setdiff1d(slots, list(excluded), assume_unique=True)
+        if not len(slots):
+            return []
+        lat1, lon1 = numpy.radians(location[0]), numpy.radians(location[1])
+        lat2, lon2 = numpy.radians(records['latitude'][slots]), numpy.radians(records['longitude'][slots])
+        # Haversine sin escalar, alcanza para ordenar
+        aux = numpy.sin((lat2 - lat1) / 2) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) \
+                                                  * numpy.sin((lon2 - lon1) / 2) ** 2
+        if len(slots) > limit:
+            closer = numpy.argpartition(aux, limit - 1)[:limit]
+            slots, aux = slots[closer], aux[closer]
+        return slots[numpy.argsort(aux, kind='mergesort')].tolist()
+
+    def usernames_of(self, slots):
+        """Gets the username of the driver in each slot (None for the unknown ones)"""
+        missing = [slot for slot in slots if slot not in self.usernames]
+        if missing:
+            drivers = db.drivers.find({'slot': {'$in': missing}}, {'username': 1, 'slot': 1, '_id': 0})
+            with self.lock:
+                for driver in drivers:
+                    self.slots[driver['username']] = driver['slot']
+                    self.usernames[driver['slot']] = driver['username']
+        return [self.usernames.get(slot) for slot in slots]
+
+
+SHARED_POSITIONS = SharedPositions()
@@ -0,0 +1,148 @@
+"""In-memory filter of the blacklisted tokens"""
+import datetime
+import hashlib
+import os
+import struct
+import threading
+import time
+
+from bson import ObjectId
+
+from app import db
+
+BLACKLIST_REFRESH_INTERVAL = float(os.environ.get('BLACKLIST_REFRESH_INTERVAL', 1))  # seconds
+BLACKLIST_RELOAD_INTERVAL = float(os.environ.get('BLACKLIST_RELOAD_INTERVAL', 3600))  # seconds
+BLACKLIST_BLOOM_BITS = int(os.environ.get('BLACKLIST_BLOOM_BITS', 2 ** 20))
+BLACKLIST_BLOOM_HASHES = int(os.environ.get('BLACKLIST_BLOOM_HASHES', 7))
+# Los _id los generan los workers con sus relojes, asi que no llegan estrictamente en orden
+BLACKLIST_REFRESH_OVERLAP = 10  # seconds
+# Mientras las revocaciones lleguen por db.revocations no hace falta consultar la db tan seguido
+BLACKLIST_FOLLOW_TIMEOUT = float(os.environ.get('BLACKLIST_FOLLOW_TIMEOUT', 10))  # seconds
+BLACKLIST_FOLLOWED_REFRESH_INTERVAL = float(os.environ.get('BLACKLIST_FOLLOWED_REFRESH_INTERVAL', 60))  # seconds
+
+
+class BloomFilter(object):
+    """Set of strings that may answer that it contains one it doesn't, but never the opposite"""
+
+    def __init__(self, bits=BLACKLIST_BLOOM_BITS, hashes=BLACKLIST_BLOOM_HASHES):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray((bits + 7) // 8)
+
+    def positions(self, key):
+        """Gets the bits of the key, derived from two halves of its sha256 (double hashing)"""
+        first, second = struct.unpack('<QQ', hashlib.sha256(key.encode('utf-8')).digest()[:16])
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        """Adds the key to the set"""
+        for position in self.positions(key):
+            self.array[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, key):
+        return all(self.array[position // 8] & (1 << (position % 8)) for position in self.positions(key))
+
+
+class TokenBlacklist(object):
+    """Per worker copy of db.blacklistedTokens: a bloom filter with the digests of all the revoked
+    tokens plus the exact set of the ones revoked since the last full load.
+
+    Every refresh_interval seconds the revocations inserted since the previous refresh are read,
+    and every reload_interval seconds everything is read again so the filter doesn't fill up.
+    Only the digests that may be in the filter but aren't in the exact set are looked up in the db.
+    The revision changes whenever revocations are found, so others can tell when to check again.
+    While the revocations are being followed as they're made (see RevocationsFeed) the refreshes
+    are made only every followed_refresh_interval seconds, for the ones that never reach the feed
+    (e.g. the worker failed to publish them or they were migrated).
+    """
+
+    def __init__(self, refresh_interval=BLACKLIST_REFRESH_INTERVAL, reload_interval=BLACKLIST_RELOAD_INTERVAL,
+                 followed_refresh_interval=BLACKLIST_FOLLOWED_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.reload_interval = reload_interval
+        self.followed_refresh_interval = followed_refresh_interval
+        self.lock = threading.Lock()
+        self.revision = 0
+        self.clear()
+
+    def clear(self):
+        """Forgets every revocation, they'll be read again from the db"""
+        with self.lock:
+            self.bloom = BloomFilter()
+            self.recent = set()
+            self.last_id = None
+            self.refreshed_at = None
+            self.loaded_at = None
+            self.followed_at = None
+            self.revision += 1
+
+    def add(self, digest):
+        """Records a revocation made by this worker"""
+        with self.lock:
+            self.bloom.add(digest)
+            self.recent.add(digest)
+            self.revision += 1
+
+    def follow(self, digest=None):
+        """Records a revocation received from the feed, or just that the feed is alive"""
+        with self.lock:
+            if digest and digest not in self.recent:
+                self.bloom.add(digest)
+                self.recent.add(digest)
+                self.revision += 1
+            self.followed_at = time.time()
+
+    def load(self):
+        """Reads every revocation from the db"""
+        bloom = BloomFilter(self.bloom.bits, self.bloom.hashes)
+        last_id = None
+        for revoked in db.blacklistedTokens.find({}, {'digest': 1}):
+            bloom.add(revoked['digest'])
+            last_id = max(last_id, revoked['_id']) if last_id else revoked['_id']
+        with self.lock:
+            self.bloom = bloom
+            self.recent = set()
+            self.last_id = last_id
+            self.loaded_at = self.refreshed_at = time.time()
+            self.revision += 1
+
+    def refresh(self):
+        """Reads the revocations inserted since the last refresh (with some margin)"""
+        query = {}
+        if self.last_id:
+            since = self.last_id.generation_time - datetime.timedelta(seconds=BLACKLIST_REFRESH_OVERLAP)
+            query = {'_id': {'$gte': ObjectId.from_datetime(since)}}
+        revocations = list(db.blacklistedTokens.find(query, {'digest': 1}))
+        with self.lock:
+            for revoked in revocations:
+                if revoked['digest'] not in self.recent:
+                    self.revision += 1
+                self.bloom.add(revoked['digest'])
+                self.recent.add(revoked['digest'])
+                self.last_id = max(self.last_id, revoked['_id']) if self.last_id else revoked['_id']
+            self.refreshed_at = time.time()
+
+    def ensure_refreshed(self):
+        """Loads or refreshes the revocations if it's time to"""
+        now = time.time()
+        if self.loaded_at is None or now - self.loaded_at > self.reload_interval:
+            self.load()
+        elif now - self.refreshed_at > (self.followed_refresh_interval if self.followed(now)
+                                        else self.refresh_interval):
+            self.refresh()
+
+    def followed(self, now):
+        """Returns true if the feed of revocations was heard from lately"""
+        return self.followed_at is not None and now - self.followed_at < BLACKLIST_FOLLOW_TIMEOUT
+
+    def contains(self, digest):
+        """Returns true if the token with the given digest was revoked"""
+        self.ensure_refreshed()
+        if digest in self.recent:
+            return True
+        if digest not in self.bloom:
+            return False
+        return db.blacklistedTokens.find_one({'digest': digest}, {'_id': 1}) is not None
+
+
+TOKEN_BLACKLIST = TokenBlacklist()
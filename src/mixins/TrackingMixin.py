@@ -10,11 +10,12 @@ class TrackingTripsMixin(object):
     def check_positions_with_location(usernames,location):
         """Checks if all the users specified in usernames are near enough the desired location"""
         positions = DriversMixin.get_positions(usernames)
-        if positions.count() < len(usernames):
+        if len(positions) < len(usernames):
             application.logger.info("There is an unknown position")
             return False
-        for position in positions:
-            distance = DriversMixin.distance((position['latitude'],position['longitude']),location)
+        distances = DriversMixin.distances(location, [(position['latitude'], position['longitude'])
+                                                      for position in positions])
+        for distance in distances:
             application.logger.info("Distance between user and location is: {}".format(distance))
             if  distance > MAX_DISTANCE:
                 return False
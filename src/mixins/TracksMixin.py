@@ -0,0 +1,183 @@
+"""Mixins for storing the route actually driven in each trip"""
+import os
+import threading
+import time
+
+from app import db, application
+from src.mixins.DriversMixin import DriversMixin
+
+TRACK_CHUNK_SIZE = int(os.environ.get('TRACK_CHUNK_SIZE', 100))  # points per document
+TRACK_FLUSH_INTERVAL = float(os.environ.get('TRACK_FLUSH_INTERVAL', 30))  # seconds
+
+
+def encode_values(values):
+    """Encodes the integers with the algorithm of the google polylines"""
+    chunks = []
+    for value in values:
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def decode_values(encoded):
+    """Decodes the integers encoded by encode_values"""
+    values = []
+    value = shift = 0
+    for char in encoded:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    return values
+
+
+def encode_polyline(points):
+    """Encodes the (latitude, longitude) as a google polyline (1e-5 degrees of precision)"""
+    values = []
+    last_latitude = last_longitude = 0
+    for latitude, longitude in points:
+        latitude, longitude = int(round(latitude * 1e5)), int(round(longitude * 1e5))
+        values += [latitude - last_latitude, longitude - last_longitude]
+        last_latitude, last_longitude = latitude, longitude
+    return encode_values(values)
+
+
+def decode_polyline(encoded):
+    """Decodes a google polyline into (latitude, longitude)"""
+    values = decode_values(encoded)
+    points = []
+    latitude = longitude = 0
+    for index in range(0, len(values) - 1, 2):
+        latitude += values[index]
+        longitude += values[index + 1]
+        points.append((latitude / 1e5, longitude / 1e5))
+    return points
+
+
+def encode_times(times):
+    """Encodes the timestamps (in seconds) as the milliseconds elapsed since the previous one"""
+    milliseconds = [int(round(timestamp * 1000)) for timestamp in times]
+    return encode_values([current - previous for previous, current
+                          in zip([milliseconds[0]] + milliseconds, milliseconds)])
+
+
+def decode_times(encoded, start_time):
+    """Decodes the timestamps encoded by encode_times"""
+    times = []
+    elapsed = 0
+    for delta in decode_values(encoded):
+        elapsed += delta
+        times.append(start_time + elapsed / 1000.0)
+    return times
+
+
+class TrackRecorder(object):
+    """Fixes of the ongoing trips waiting to be written, one document every chunk_size of them.
+
+    Each worker writes the fixes it received, the chunks that aren't full are written by
+    a background thread after flush_interval seconds, when the odometer persists (so the
+    fixes it counts are in the track) or when the trip finishes in this worker.
+    """
+
+    def __init__(self, chunk_size=TRACK_CHUNK_SIZE, flush_interval=TRACK_FLUSH_INTERVAL):
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.buffers = {}
+        self.lock = threading.Lock()
+        self.flusher = None
+
+    def record(self, trip_id, driver, fixes):
+        """Adds the (timestamp, latitude, longitude) fixes to the track of the trip"""
+        chunks = []
+        now = time.time()
+        with self.lock:
+            buffer = self.buffers.setdefault(trip_id, {'driver': driver, 'fixes': [], 'since': now})
+            buffer['fixes'] += fixes
+            while len(buffer['fixes']) >= self.chunk_size:
+                chunks.append((trip_id, driver, buffer['fixes'][:self.chunk_size]))
+                buffer['fixes'] = buffer['fixes'][self.chunk_size:]
+                buffer['since'] = now
+            if not self.flusher:
+                self.start()
+        self.write(chunks)
+
+    def flush(self, trip_id):
+        """Writes the fixes of the trip that weren't written yet"""
+        with self.lock:
+            buffer = self.buffers.pop(trip_id, None)
+        if buffer:
+            self.write([(trip_id, buffer['driver'], buffer['fixes'])])
+
+    def flush_stale(self):
+        """Writes the fixes that have been waiting for more than flush_interval seconds"""
+        now = time.time()
+        with self.lock:
+            stale = [trip_id for trip_id, buffer in self.buffers.items()
+                     if now - buffer['since'] > self.flush_interval]
+            buffers = [(trip_id, self.buffers.pop(trip_id)) for trip_id in stale]
+        self.write([(trip_id, buffer['driver'], buffer['fixes']) for trip_id, buffer in buffers])
+
+    def flush_all(self):
+        """Writes every fix that wasn't written yet"""
+        with self.lock:
+            buffers, self.buffers = self.buffers, {}
+        self.write([(trip_id, buffer['driver'], buffer['fixes']) for trip_id, buffer in buffers.items()])
+
+    def start(self):
+        """Starts writing the stale fixes in background"""
+        self.flusher = threading.Thread(target=self.run)
+        self.flusher.daemon = True
+        self.flusher.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush_stale()
+            except Exception as exc:  # pragma: no cover
+                application.logger.error("Couldn't write the tracks: {}".format(exc.message))
+
+    @staticmethod
+    def write(chunks):
+        documents = []
+        for trip_id, driver, fixes in chunks:
+            if fixes:
+                times = [fix[0] for fix in fixes]
+                documents.append({'trip_id': trip_id, 'driver': driver, 'start_time': times[0],
+                                  'count': len(fixes), 'times': encode_times(times),
+                                  'points': encode_polyline([fix[1:] for fix in fixes])})
+        if documents:
+            db.tracks.insert_many(documents, ordered=False)
+
+
+TRACKS = TrackRecorder()
+
+
+class TracksMixin(object):
+    """Utility class for anything related with the tracks of the trips"""
+
+    @staticmethod
+    def get_track(trip_id):
+        """Gets the (timestamp, latitude, longitude) recorded in the trip, in order"""
+        fixes = []
+        for chunk in db.tracks.find({'trip_id': trip_id}):
+            fixes += [(timestamp, latitude, longitude) for timestamp, (latitude, longitude) in
+                      zip(decode_times(chunk['times'], chunk['start_time']),
+                          decode_polyline(chunk['points']))]
+        # Los fragmentos escritos por distintos workers se pueden solapar en el tiempo
+        return sorted(fixes, key=lambda fix: fix[0])
+
+    @staticmethod
+    def track_distance(trip_id, fixes=None):
+        """Gets the distance (in km) driven in the trip according to its track, None if the
+        track doesn't have at least two fixes or, if given, exactly that many of them"""
+        track = TracksMixin.get_track(trip_id)
+        if len(track) < 2 or (fixes is not None and len(track) != fixes):
+            return None
+        return sum(DriversMixin.distance(origin[1:], destination[1:])
+                   for origin, destination in zip(track, track[1:]))
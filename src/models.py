@@ -1,12 +1,15 @@
 """Entitys saved in the db"""
 import datetime
+import hashlib
 import os
 
 import python_jwt as jwt
+from pymongo.errors import DuplicateKeyError
 
 from app import db, application, TOKEN_DURATION
 from src.exceptions import BlacklistedTokenException, SignatureException, ExpiredTokenException, \
     InvalidTokenException
+from src.mixins.TokenBlacklistMixin import TOKEN_BLACKLIST
 
 SECRET_KEY = os.environ.get("SECRET_KEY", "key")
 
@@ -88,17 +91,55 @@ class User(object):
 
 class BlacklistToken(object):
     """
-    Token Model for storing invalid JWT
+    Token Model for storing invalid JWT, by their digest and only until they expire
     """
 
     def __init__(self, token):
-        self.token = token
+        self.digest = BlacklistToken.digest_of(token)
         self.blacklisted_on = datetime.datetime.now()
+        self.expires_at = BlacklistToken.expiration_of(token)
 
     def __repr__(self):
-        return '<id: token: {}'.format(self.token)
+        return '<id: digest: {}'.format(self.digest)
+
+    def save(self):
+        """Stores the revocation (only once, even if it's asked twice at the same time)"""
+        try:
+            db.blacklistedTokens.update_one({'digest': self.digest},
+                                            {'$setOnInsert': {'blacklisted_on': self.blacklisted_on,
+                                                              'expires_at': self.expires_at}},
+                                            upsert=True)
+        except DuplicateKeyError:
+            # Otro upsert simultaneo ya la guardo
+            pass
+
+    @staticmethod
+    def digest_of(token):
+        """Gets the key the token is blacklisted with"""
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def expiration_of(token):
+        """Gets when the token expires, after that there's no need to keep it blacklisted"""
+        _, claims = jwt.process_jwt(token)
+        return datetime.datetime.utcfromtimestamp(claims['exp'])
+
+    @staticmethod
+    def migrate():
+        """Keys by their digest the tokens that were blacklisted whole, returns how many there were.
+        It's run by manage.py migrate, after the indexes exist"""
+        migrated = 0
+        for legacy in db.blacklistedTokens.find({'digest': {'$exists': False}}):
+            # Primero se guarda por digest, si se corta a la mitad no se pierde la revocacion
+            try:
+                BlacklistToken(legacy['token']).save()
+            except Exception:
+                application.logger.info("Dropping malformed blacklisted token {}".format(legacy['_id']))
+            db.blacklistedTokens.delete_one({'_id': legacy['_id']})
+            migrated += 1
+        return migrated
 
     @staticmethod
     def is_blacklisted(token):
         """Returns true if a user has logged out using this token"""
-        return db.blacklistedTokens.count({'token': token}) > 0
+        return TOKEN_BLACKLIST.contains(BlacklistToken.digest_of(token))
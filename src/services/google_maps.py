@@ -11,3 +11,12 @@ def get_directions(data):
         "key": GOOGLE_KEY
     }
     return requests.get("https://maps.googleapis.com/maps/api/directions/json", params=parameters)
+
+
+def get_travel_times(origins, destination):
+    parameters = {
+        "origins": "|".join(str(latitude) + ", " + str(longitude) for latitude, longitude in origins),
+        "destinations": str(destination[0]) + ", " + str(destination[1]),
+        "key": GOOGLE_KEY
+    }
+    return requests.get("https://maps.googleapis.com/maps/api/distancematrix/json", params=parameters)
@@ -1,5 +1,11 @@
 from flask_testing import TestCase
 from app import application, db
+from src.indexes import ensure_indexes
+from src.mixins.PositionsMixin import ROLES_CACHE, DEADBAND
+from src.mixins.OdometerMixin import ODOMETER
+from src.mixins.TracksMixin import TRACKS
+from src.mixins.TokenBlacklistMixin import TOKEN_BLACKLIST
+from src.mixins.AuthenticationMixin import VERIFIED_TOKENS
 
 
 class BaseTestCase(TestCase):
@@ -44,6 +50,30 @@ class BaseTestCase(TestCase):
         except Exception:
             pass
         db.create_collection('requests')
+        try:
+            db.tracks.drop()
+        except Exception:
+            pass
+        db.create_collection('tracks')
+        try:
+            db.counters.drop()
+        except Exception:
+            pass
+        db.create_collection('counters')
+        try:
+            db.revocations.drop()
+        except Exception:
+            pass
+        ensure_indexes()
+        ROLES_CACHE.clear()
+        DEADBAND.last.clear()
+        ODOMETER.pending = {}
+        ODOMETER.pending_fixes = {}
+        ODOMETER.trips = {}
+        TRACKS.buffers = {}
+        ODOMETER.persisted_at = None
+        TOKEN_BLACKLIST.clear()
+        VERIFIED_TOKENS.clear()
 
     def tearDown(self):
         db.drop_collection('users')
@@ -53,3 +83,6 @@ class BaseTestCase(TestCase):
         db.drop_collection('positions')
         db.drop_collection('trips')
         db.drop_collection('requests')
+        db.drop_collection('tracks')
+        db.drop_collection('counters')
+        db.drop_collection('revocations')
@@ -0,0 +1,28 @@
+import unittest
+from tests.base import BaseTestCase
+from benchmarks.city import generate_city, CITY_CENTER
+from benchmarks.matching import percentile
+from src.mixins.DriversMixin import DriversMixin
+from app import db
+
+
+class TestBenchmarks(BaseTestCase):
+
+    def test_percentile(self):
+        samples = range(100, 0, -1)
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile([3], 95), 3)
+
+    def test_generate_city(self):
+        riders = generate_city(50, 5, on_duty_ratio=1, on_trip_ratio=0)
+        self.assertEqual(len(riders), 5)
+        self.assertEqual(db.users.count(), 55)
+        self.assertEqual(db.riders.count(), 5)
+        self.assertEqual(db.positions.count(), 55)
+        self.assertEqual(len(DriversMixin.get_available_drivers()), 50)
+        self.assertEqual(len(DriversMixin.get_closer_drivers(CITY_CENTER, 3)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
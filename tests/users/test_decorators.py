@@ -0,0 +1,80 @@
+import unittest
+import json
+from mock import patch
+from tests.base import BaseTestCase
+from src.models import User
+from app import db
+
+
+class TestAuthenticatedEndpoints(BaseTestCase):
+
+    def setUp(self):
+        super(TestAuthenticatedEndpoints, self).setUp()
+        db.users.insert_one(User(username='pedro_gomez', uid='1').__dict__)
+        db.drivers.insert_one({'username': 'pedro_gomez', 'duty': False, 'trip': False, 'uid': '1'})
+        db.users.insert_one(User(username='juan_perez', uid='2').__dict__)
+        self.auth_token = User.get_user_by_username('pedro_gomez').encode_auth_token()
+
+    def set_duty(self, username, duty=True, auth_token=None):
+        return self.client.patch(
+            '/drivers/' + username,
+            headers=dict(
+                Authorization='Bearer ' + (auth_token or self.auth_token)
+            ),
+            data=json.dumps(dict(
+                duty=duty
+            )),
+            content_type='application/json'
+        )
+
+    def test_body_is_validated_first(self):
+        with self.client:
+            response = self.set_duty('nobody', duty='yes', auth_token='token')
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['message'], 'missing_duty_status')
+            self.assertEqual(response.status_code, 400)
+
+    def test_missing_driver_is_reported_before_the_token(self):
+        with self.client:
+            response = self.set_duty('nobody', auth_token='token')
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['message'], 'driver_not_found')
+            self.assertEqual(response.status_code, 404)
+
+    def test_token_of_another_user_is_unauthorized(self):
+        db.drivers.insert_one({'username': 'juan_perez', 'duty': False, 'trip': False, 'uid': '2'})
+        with self.client:
+            response = self.set_duty('juan_perez')
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['message'], 'unauthorized_update')
+            self.assertEqual(response.status_code, 401)
+
+    def test_user_is_loaded_once_per_request(self):
+        with self.client:
+            with patch('src.decorators.User.get_user_by_username',
+                       wraps=User.get_user_by_username) as mock_get_user:
+                with patch('requests.get') as mock_get:
+                    mock_get.return_value.ok = True
+                    mock_get.return_value.json.return_value = []
+                    response = self.client.get(
+                        '/users/pedro_gomez/trip',
+                        headers=dict(
+                            Authorization='Bearer ' + self.auth_token
+                        ),
+                        content_type='application/json'
+                    )
+                data = json.loads(response.data.decode())
+                self.assertEqual(data['message'], 'trips_retrieved')
+                self.assertEqual(mock_get_user.call_count, 1)
+
+    def test_drivers_are_built_from_their_document(self):
+        with self.client:
+            with patch('src.decorators.User.get_user_by_username') as mock_get_user:
+                response = self.set_duty('pedro_gomez')
+                data = json.loads(response.data.decode())
+                self.assertEqual(data['message'], 'updated_duty_status')
+                self.assertFalse(mock_get_user.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import unittest
+import json
+import time
+from tests.base import BaseTestCase
+from tests.users.test_requests import directions_return_example
+from mock import patch, Mock
+from src.models import User
+from src.mixins.DriversMixin import DriversMixin
+from src.mixins.DispatchMixin import Dispatcher, solve_assignment
+from app import db
+
+mock_direction = Mock()
+mock_direction.ok = True
+mock_direction.status_code = 200
+mock_direction.json = Mock()
+mock_direction.json.return_value = dict(directions_return_example)
+
+mock_cost = Mock()
+mock_cost.ok = True
+mock_cost.status_code = 200
+mock_cost.json = Mock()
+mock_cost.json.return_value = {'value': 25}
+
+
+class TestDispatch(BaseTestCase):
+
+    @staticmethod
+    def add_user(username, uid):
+        db.users.insert_one(User(username=username, uid=uid).__dict__)
+
+    @staticmethod
+    def add_available_driver(username, uid, latitude, longitude):
+        TestDispatch.add_user(username, uid)
+        db.drivers.insert_one({'username': username, 'duty': True, 'trip': False, 'uid': uid})
+        DriversMixin.update_position(username, latitude, longitude)
+
+    @staticmethod
+    def add_pending_request(rider, uid, latitude, longitude, request_time=None):
+        TestDispatch.add_user(rider, uid)
+        db.riders.insert_one({'username': rider})
+        coordinates = {'latitude_initial': latitude, 'longitude_initial': longitude,
+                       'latitude_final': latitude + 0.1, 'longitude_final': longitude + 0.1}
+        return db.requests.insert_one({'rider': rider, 'driver': None, 'coordinates': coordinates,
+                                       'request_time': request_time or time.time(),
+                                       'status': 'pending'}).inserted_id
+
+    def test_solve_assignment_minimizes_total_cost(self):
+        assignment = solve_assignment([[1, 2], [1, 10]])
+        self.assertEqual(assignment, [(0, 1), (1, 0)])
+
+    def test_solve_assignment_with_more_rows_than_columns(self):
+        assignment = solve_assignment([[5], [1], [3]])
+        self.assertEqual(assignment, [(1, 0)])
+
+    def test_solve_assignment_with_more_columns_than_rows(self):
+        assignment = solve_assignment([[4, 1, 3]])
+        self.assertEqual(assignment, [(0, 1)])
+
+    def test_solve_assignment_without_candidates(self):
+        self.assertEqual(solve_assignment([]), [])
+        self.assertEqual(solve_assignment([[]]), [])
+
+    @patch('requests.get', return_value=mock_direction)
+    @patch('requests.post', return_value=mock_cost)
+    def test_dispatch_minimizes_total_pickup_distance(self, mock_post, mocked_google_response):
+        self.add_available_driver('driver_a', '1', 45.0, 40.0)
+        self.add_available_driver('driver_b', '2', 45.0, 40.3)
+        # Asignando de a uno, el primer pedido se llevaria a driver_a dejando al segundo lejos
+        first = self.add_pending_request('rider_1', '3', 45.0, 40.1, time.time() - 1)
+        second = self.add_pending_request('rider_2', '4', 45.0, 39.9)
+        assigned = Dispatcher.dispatch_pending_requests()
+        self.assertEqual(assigned, 2)
+        self.assertEqual(db.requests.find_one({'_id': first})['driver'], 'driver_b')
+        self.assertEqual(db.requests.find_one({'_id': second})['driver'], 'driver_a')
+        self.assertEqual(db.requests.count({'status': 'assigned'}), 2)
+        self.assertEqual(db.drivers.count({'trip': True}), 2)
+
+    @patch('requests.get', return_value=mock_direction)
+    @patch('requests.post', return_value=mock_cost)
+    def test_dispatch_leaves_pending_requests_without_drivers(self, mock_post, mocked_google_response):
+        self.add_available_driver('driver_a', '1', 45.0, 40.0)
+        self.add_pending_request('rider_1', '3', 45.0, 40.1)
+        self.add_pending_request('rider_2', '4', 45.0, 39.9)
+        assigned = Dispatcher.dispatch_pending_requests()
+        self.assertEqual(assigned, 1)
+        self.assertEqual(db.requests.count({'status': 'pending'}), 1)
+
+    def test_dispatch_drops_requests_that_waited_too_long(self):
+        self.add_pending_request('rider_1', '3', 45.0, 40.1, time.time() - 3600)
+        assigned = Dispatcher.dispatch_pending_requests()
+        self.assertEqual(assigned, 0)
+        self.assertEqual(db.requests.count(), 0)
+
+    @patch('src.handlers.RequestHandler.DISPATCH_MODE', 'batch')
+    def test_batch_request_submission_is_queued(self):
+        self.add_user('rider_1', '3')
+        db.riders.insert_one({'username': 'rider_1'})
+        auth_token = User.get_user_by_username('rider_1').encode_auth_token()
+        with self.client:
+            response = self.client.post(
+                '/riders/rider_1/request',
+                data=json.dumps(dict(
+                    latitude_initial=30.00,
+                    latitude_final=31.32,
+                    longitude_initial=42,
+                    longitude_final=43.21
+                )),
+                headers=dict(
+                    Authorization='Bearer ' + auth_token
+                ),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['status'], 'success')
+            self.assertEqual(data['message'], 'request_queued')
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(db.requests.count({'rider': 'rider_1', 'status': 'pending'}), 1)
+
+            response = self.client.get(
+                '/requests/' + data['id'],
+                headers=dict(
+                    Authorization='Bearer ' + auth_token
+                )
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['message'], 'request_pending')
+            self.assertIs(data['driver'], None)
+            self.assertEqual(response.status_code, 200)
+
+    @patch('requests.get', return_value=mock_direction)
+    @patch('requests.post', return_value=mock_cost)
+    def test_poll_assigned_request(self, mock_post, mocked_google_response):
+        self.add_available_driver('driver_a', '1', 45.0, 40.0)
+        request_id = self.add_pending_request('rider_1', '3', 45.0, 40.1)
+        Dispatcher.dispatch_pending_requests()
+        auth_token = User.get_user_by_username('rider_1').encode_auth_token()
+        with self.client:
+            response = self.client.get(
+                '/requests/' + str(request_id),
+                headers=dict(
+                    Authorization='Bearer ' + auth_token
+                )
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['status'], 'success')
+            self.assertEqual(data['message'], 'request_assigned')
+            self.assertEqual(data['driver'], 'driver_a')
+            self.assertEqual(data['estimated_cost'], 25)
+            self.assertEqual(response.status_code, 200)
+
+    def test_poll_request_of_another_user(self):
+        request_id = self.add_pending_request('rider_1', '3', 45.0, 40.1)
+        self.add_user('rider_2', '4')
+        auth_token = User.get_user_by_username('rider_2').encode_auth_token()
+        with self.client:
+            response = self.client.get(
+                '/requests/' + str(request_id),
+                headers=dict(
+                    Authorization='Bearer ' + auth_token
+                )
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['message'], 'unauthorized_action')
+            self.assertEqual(response.status_code, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
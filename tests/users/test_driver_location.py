@@ -0,0 +1,87 @@
+import unittest
+import json
+from tests.base import BaseTestCase
+from mock import patch
+from src.models import User
+from src.mixins.DriversMixin import DriversMixin
+from src.mixins.LocationHubMixin import LocationHub
+from src.mixins.PositionsMixin import PositionsMixin
+from app import db
+
+
+class TestDriverLocation(BaseTestCase):
+
+    def setUp(self):
+        super(TestDriverLocation, self).setUp()
+        for username, uid in [('driver', '1'), ('rider', '2'), ('other_rider', '3')]:
+            db.users.insert_one(User(username=username, uid=uid).__dict__)
+        db.drivers.insert_one({'username': 'driver', 'duty': True, 'trip': True})
+        DriversMixin.update_position('driver', 45.0, 40.0)
+        self.request_id = str(db.requests.insert_one({'rider': 'rider', 'driver': 'driver',
+                                                      'status': 'assigned'}).inserted_id)
+
+    def get_location_stream(self, username, request_id):
+        return self.client.get(
+            '/requests/{}/driver/location'.format(request_id),
+            headers=dict(
+                Authorization='Bearer ' + User.get_user_by_username(username).encode_auth_token()
+            ),
+            buffered=False
+        )
+
+    def test_follow_driver_location(self):
+        hub = LocationHub(poll_interval=3600)
+        with patch('src.handlers.RequestHandler.LOCATION_HUB', hub), \
+                patch('src.mixins.PositionsMixin.LOCATION_HUB', hub):
+            response = self.get_location_stream('rider', self.request_id)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'text/event-stream')
+            events = iter(response.response)
+            event = next(events)
+            self.assertTrue(event.startswith('event: position\n'))
+            self.assertEqual(json.loads(event.split('data: ')[1]),
+                             {'driver': 'driver', 'latitude': 45.0, 'longitude': 40.0})
+            PositionsMixin.store_positions('driver', [{'latitude': 45.1, 'longitude': 40.1}])
+            event = next(events)
+            self.assertEqual(json.loads(event.split('data: ')[1]),
+                             {'driver': 'driver', 'latitude': 45.1, 'longitude': 40.1})
+            response.close()
+            self.assertEqual(hub.subscriptions, {})
+
+    def test_follow_driver_location_stops_when_the_token_is_revoked(self):
+        hub = LocationHub(poll_interval=3600)
+        with patch('src.handlers.RequestHandler.LOCATION_HUB', hub), \
+                patch('src.handlers.RequestHandler.LOCATION_STREAM_KEEPALIVE', 0.01), \
+                patch('src.handlers.RequestHandler.Authenticator.authenticate',
+                      side_effect=[('rider', ''), ('rider', ''), ('', 'invalid_token')]):
+            response = self.get_location_stream('rider', self.request_id)
+            events = list(response.response)
+            self.assertTrue(events[0].startswith('event: position\n'))
+            self.assertTrue(events[-1].startswith('event: error\n'))
+            self.assertEqual(json.loads(events[-1].split('data: ')[1])['message'], 'invalid_token')
+            self.assertEqual(hub.subscriptions, {})
+
+    def test_hub_polls_positions_stored_by_other_workers(self):
+        hub = LocationHub(poll_interval=3600)
+        subscription = hub.subscribe('driver')
+        hub.poll()
+        self.assertEqual(subscription.get_nowait(), (45.0, 40.0))
+        hub.poll()
+        self.assertTrue(subscription.empty())
+        hub.unsubscribe('driver', subscription)
+
+    def test_follow_driver_location_of_another_rider(self):
+        response = self.get_location_stream('other_rider', self.request_id)
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['message'], 'unauthorized_action')
+        self.assertEqual(response.status_code, 401)
+
+    def test_follow_driver_location_of_unknown_request(self):
+        response = self.get_location_stream('rider', '5a1b2c3d4e5f6a7b8c9d0e1f')
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['message'], 'no_request_found')
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
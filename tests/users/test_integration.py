@@ -105,8 +105,8 @@ class TestRequestMatching(BaseTestCase):
 
     def test_two_trips_assigned_correctly_one_missing_driver(self):
         with self.client:
-            with patch('src.handlers.RequestHandler.get_directions') as mock_directions:
-                with patch('src.handlers.RequestHandler.estimate_trip_cost') as mock_cost:
+            with patch('src.mixins.RequestsMixin.get_directions') as mock_directions:
+                with patch('src.mixins.RequestsMixin.estimate_trip_cost') as mock_cost:
                     mock_cost.return_value = Mock()
                     mock_cost.return_value.ok = True
                     mock_cost.return_value.json.return_value = {'value': 20}
@@ -176,8 +176,8 @@ class TestRequestMatching(BaseTestCase):
     def test_driver_assigned_two_times(self):
         """One driver is assigned to a trip, the trip is cancelled, that driver is assigned again"""
         with self.client:
-            with patch('src.handlers.RequestHandler.get_directions') as mock_directions:
-                with patch('src.handlers.RequestHandler.estimate_trip_cost') as mock_cost:
+            with patch('src.mixins.RequestsMixin.get_directions') as mock_directions:
+                with patch('src.mixins.RequestsMixin.estimate_trip_cost') as mock_cost:
                     mock_cost.return_value = Mock()
                     mock_cost.return_value.ok = True
                     mock_cost.return_value.json.return_value = {'value': 20}
@@ -244,8 +244,8 @@ class TestRequestMatching(BaseTestCase):
         """One driver is assigned to a trip, the trip is closed, that driver is assigned again,
         the trip is closed, the driver is available again"""
         with self.client:
-            with patch('src.handlers.RequestHandler.get_directions') as mock_directions:
-                with patch('src.handlers.RequestHandler.estimate_trip_cost') as mock_cost:
+            with patch('src.mixins.RequestsMixin.get_directions') as mock_directions:
+                with patch('src.mixins.RequestsMixin.estimate_trip_cost') as mock_cost:
                     mock_cost.return_value = Mock()
                     mock_cost.return_value.ok = True
                     mock_cost.return_value.json.return_value = {'value': 20}
@@ -0,0 +1,78 @@
+import unittest
+from mock import patch
+from pymongo.collection import Collection
+from tests.base import BaseTestCase
+from src.mixins.OdometerMixin import Odometer
+from app import db
+
+
+class TestOdometer(BaseTestCase):
+
+    def test_distance_is_added_to_the_trip_when_it_finishes(self):
+        odometer = Odometer(persist_interval=3600)
+        odometer.persist()
+        trip_id = db.trips.insert_one({'driver': 'driver', 'rider': 'rider', 'distance': 0.0}).inserted_id
+        odometer.start('driver', trip_id)
+        odometer.add('driver', 1.5)
+        odometer.add('driver', 2.0)
+        odometer.add('other_driver', 5.0)
+        self.assertEqual(db.trips.find_one({'driver': 'driver'})['distance'], 0.0)
+        self.assertEqual(odometer.finish('driver', trip_id)['distance'], 3.5)
+        self.assertEqual(db.trips.find_one({'driver': 'driver'})['distance'], 3.5)
+        self.assertIsNone(odometer.trip_of('driver'))
+
+    def test_persist_adds_pending_distances_and_reloads_trips(self):
+        odometer = Odometer(persist_interval=3600)
+        trip_id = db.trips.insert_one({'driver': 'driver', 'rider': 'rider', 'distance': 1.0}).inserted_id
+        odometer.start('driver', trip_id)
+        db.trips.insert_one({'driver': 'started_elsewhere', 'rider': 'rider_2', 'distance': 0.0})
+        odometer.add('driver', 2.5)
+        odometer.persist()
+        self.assertEqual(db.trips.find_one({'driver': 'driver'})['distance'], 3.5)
+        self.assertIsNotNone(odometer.trip_of('started_elsewhere'))
+        db.trips.delete_one({'driver': 'driver'})
+        odometer.persist()
+        self.assertIsNone(odometer.trip_of('driver'))
+
+    def test_distance_being_persisted_is_not_added_again_when_the_trip_finishes(self):
+        odometer = Odometer(persist_interval=3600)
+        odometer.persist()
+        trip_id = db.trips.insert_one({'driver': 'driver', 'rider': 'rider', 'distance': 0.0}).inserted_id
+        odometer.start('driver', trip_id)
+        odometer.add('driver', 1.5)
+        bulk_write = Collection.bulk_write
+
+        def write_while_adding(collection, requests, **kwargs):
+            self.assertEqual(odometer.pending['driver'], 0.0)
+            odometer.add('driver', 2.0)
+            return bulk_write(collection, requests, **kwargs)
+
+        with patch.object(Collection, 'bulk_write', autospec=True, side_effect=write_while_adding):
+            odometer.persist()
+        self.assertEqual(odometer.finish('driver', trip_id)['distance'], 3.5)
+        self.assertEqual(db.trips.find_one({'driver': 'driver'})['distance'], 3.5)
+
+    def test_distance_of_a_closed_trip_is_not_added_to_the_next_one(self):
+        odometer = Odometer(persist_interval=3600)
+        odometer.persist()
+        trip_id = db.trips.insert_one({'driver': 'driver', 'rider': 'rider', 'distance': 0.0}).inserted_id
+        odometer.start('driver', trip_id)
+        odometer.add('driver', 1.5)
+        # Otro worker cierra el viaje y el driver empieza el siguiente
+        db.trips.delete_one({'_id': trip_id})
+        next_trip_id = db.trips.insert_one({'driver': 'driver', 'rider': 'rider', 'distance': 0.0}).inserted_id
+        odometer.persist()
+        self.assertEqual(db.trips.find_one({'_id': next_trip_id})['distance'], 0.0)
+        self.assertEqual(odometer.trip_of('driver'), next_trip_id)
+        odometer.add('driver', 2.0)
+        self.assertEqual(odometer.finish('driver', next_trip_id)['distance'], 2.0)
+
+    def test_trips_are_reloaded_every_persist_interval(self):
+        odometer = Odometer(persist_interval=-1)
+        self.assertIsNone(odometer.trip_of('driver'))
+        trip_id = db.trips.insert_one({'driver': 'driver', 'rider': 'rider', 'distance': 0.0}).inserted_id
+        self.assertEqual(odometer.trip_of('driver'), trip_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
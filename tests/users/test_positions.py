@@ -1,9 +1,18 @@
 import unittest
+import datetime
 import json
 import time
 from tests.base import BaseTestCase
 from mock import patch, Mock
-from app import TOKEN_DURATION
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError
+from app import TOKEN_DURATION, db
+from src.mixins.DriversMixin import DriversMixin
+from src.mixins.PositionsMixin import PositionsMixin, Deadband
+from src.mixins.PositionsBufferMixin import PositionsBuffer
+from src.mixins.OdometerMixin import ODOMETER
+from src.mixins.TracksMixin import TracksMixin
+from src.models import User
 
 
 class TestPosition(BaseTestCase):
@@ -352,6 +361,386 @@ class TestPosition(BaseTestCase):
             self.assertEqual(response.content_type, 'application/json')
             self.assertEqual(response.status_code, 401)
 
+    def test_update_position_stores_geojson_location(self):
+        with self.client:
+            with patch('requests.post') as mock_post:
+                mock_post.return_value = Mock()
+                mock_post.return_value.json.return_value = {'id': "1"}
+                mock_post.return_value.ok = True
+                mock_post.return_value.status_code = 201
+                response = self.client.post(
+                    '/users',
+                    data=json.dumps(dict(
+                        username='joe_smith',
+                        password='123456',
+                        type='driver'
+                    )),
+                    content_type='application/json'
+                )
+                data = json.loads(response.data.decode())
+                auth_token = data['auth_token']
+            for latitude, longitude in [('43.232', '125.334'), ('54.232', '176.324')]:
+                self.client.put(
+                    '/users/joe_smith/coordinates',
+                    headers=dict(
+                        Authorization='Bearer ' + auth_token
+                    ),
+                    data=json.dumps(dict(
+                        latitude=latitude,
+                        longitude=longitude
+                    )),
+                    content_type='application/json'
+                )
+            position = db.positions.find_one({'username': 'joe_smith'})
+            self.assertNotIn('location', position)
+            self.assertTrue(position['last_seen'] > datetime.datetime.utcnow() - datetime.timedelta(minutes=1))
+            driver = db.drivers.find_one({'username': 'joe_smith'})
+            self.assertEqual(driver['uid'], '1')
+            self.assertEqual(driver['location'], {'type': 'Point', 'coordinates': [176.324, 54.232]})
+            self.assertEqual((driver['latitude'], driver['longitude']), (54.232, 176.324))
+
+    def test_upload_positions_batch(self):
+        with self.client:
+            with patch('requests.post') as mock_post:
+                mock_post.return_value = Mock()
+                mock_post.return_value.json.return_value = {'id': "1"}
+                mock_post.return_value.ok = True
+                mock_post.return_value.status_code = 201
+                response = self.client.post(
+                    '/users',
+                    data=json.dumps(dict(
+                        username='joe_smith',
+                        password='123456',
+                        type='driver'
+                    )),
+                    content_type='application/json'
+                )
+                data = json.loads(response.data.decode())
+                auth_token = data['auth_token']
+            self.client.put(
+                '/users/joe_smith/coordinates',
+                headers=dict(
+                    Authorization='Bearer ' + auth_token
+                ),
+                data=json.dumps(dict(
+                    latitude='45.0',
+                    longitude='40.0'
+                )),
+                content_type='application/json'
+            )
+            db.trips.insert_one({'driver': 'joe_smith', 'rider': 'rider', 'distance': 0.0})
+            now = time.time()
+            response = self.client.post(
+                '/users/joe_smith/coordinates/batch',
+                headers=dict(
+                    Authorization='Bearer ' + auth_token
+                ),
+                data=json.dumps(dict(positions=[
+                    dict(latitude=45.02, longitude=40.0, timestamp=now - 1),
+                    dict(latitude=45.01, longitude=40.0, timestamp=now - 2),
+                    dict(latitude=45.03, longitude=40.0, timestamp=now)
+                ])),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['status'], 'success')
+            self.assertEqual(data['message'], 'positions_updated')
+            self.assertEqual(data['count'], 3)
+            self.assertEqual(response.status_code, 200)
+            position = db.positions.find_one({'username': 'joe_smith'})
+            self.assertEqual((position['latitude'], position['longitude']), (45.03, 40.0))
+            self.assertEqual(db.drivers.find_one({'username': 'joe_smith'})['latitude'], 45.03)
+            ODOMETER.persist()
+            trip = db.trips.find_one({'driver': 'joe_smith'})
+            self.assertAlmostEqual(trip['distance'], 3.336, delta=0.01)
+            # El track tiene todos los fixes que midio el odometro
+            self.assertEqual(trip['fixes'], 3)
+            self.assertEqual(len(TracksMixin.get_track(trip['_id'])), 3)
+
+    def test_upload_positions_batch_bad_request_milliseconds(self):
+        with self.client:
+            response = self.client.post(
+                '/users/joe_smith/coordinates/batch',
+                headers=dict(
+                    Authorization='Bearer token'
+                ),
+                data=json.dumps(dict(positions=[
+                    dict(latitude=45.02, longitude=40.0, timestamp=time.time() * 1000)
+                ])),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['message'], 'bad_request_data')
+            self.assertEqual(response.status_code, 400)
+
+    def test_delayed_fixes_dont_move_the_position_back(self):
+        db.drivers.insert_one({'username': 'driver', 'duty': True, 'trip': False})
+        db.trips.insert_one({'driver': 'driver', 'rider': 'rider', 'distance': 0.0})
+        now = time.time()
+        self.assertTrue(PositionsMixin.store_positions('driver', [
+            dict(latitude=45.0, longitude=40.0, timestamp=now)]))
+        self.assertFalse(PositionsMixin.store_positions('driver', [
+            dict(latitude=45.1, longitude=40.0, timestamp=now - 60),
+            dict(latitude=45.2, longitude=40.0, timestamp=now - 30)]))
+        self.assertEqual(db.positions.find_one({'username': 'driver'})['latitude'], 45.0)
+        self.assertEqual(db.positions.count({'username': 'driver'}), 1)
+        self.assertEqual(db.drivers.find_one({'username': 'driver'})['latitude'], 45.0)
+        # Solo cuenta el tramo desde la posicion guardada
+        self.assertTrue(PositionsMixin.store_positions('driver', [
+            dict(latitude=45.3, longitude=40.0, timestamp=now - 10),
+            dict(latitude=45.01, longitude=40.0, timestamp=now + 1)]))
+        ODOMETER.persist()
+        self.assertAlmostEqual(db.trips.find_one({'driver': 'driver'})['distance'], 1.112, delta=0.01)
+
+    def test_first_position_stored_at_the_same_time_by_another_worker(self):
+        now = time.time()
+        find_one_and_update = Collection.find_one_and_update
+
+        def inserted_first_by_another_worker(collection, *args, **kwargs):
+            if kwargs.get('upsert'):
+                db.positions.insert_one({'username': 'rider', 'latitude': 44.0, 'longitude': 40.0,
+                                         'last_seen': datetime.datetime.utcfromtimestamp(now - 10)})
+                raise DuplicateKeyError('username_1')
+            return find_one_and_update(collection, *args, **kwargs)
+
+        with patch.object(Collection, 'find_one_and_update', autospec=True,
+                          side_effect=inserted_first_by_another_worker):
+            self.assertTrue(PositionsMixin.store_positions('rider', [
+                dict(latitude=45.0, longitude=40.0, timestamp=now)]))
+        self.assertEqual(db.positions.count({'username': 'rider'}), 1)
+        self.assertEqual(db.positions.find_one({'username': 'rider'})['latitude'], 45.0)
+
+    def test_upload_positions_batch_bad_request_empty(self):
+        with self.client:
+            response = self.client.post(
+                '/users/joe_smith/coordinates/batch',
+                headers=dict(
+                    Authorization='Bearer token'
+                ),
+                data=json.dumps(dict(positions=[])),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['status'], 'fail')
+            self.assertEqual(data['message'], 'bad_request_data')
+            self.assertEqual(response.status_code, 400)
+
+    def test_upload_positions_batch_of_another_user(self):
+        with self.client:
+            with patch('requests.post') as mock_post:
+                mock_post.return_value = Mock()
+                mock_post.return_value.json.return_value = {'id': "1"}
+                mock_post.return_value.ok = True
+                mock_post.return_value.status_code = 201
+                for username in ['joe_smith', 'jane_doe']:
+                    response = self.client.post(
+                        '/users',
+                        data=json.dumps(dict(
+                            username=username,
+                            password='123456',
+                            type='driver'
+                        )),
+                        content_type='application/json'
+                    )
+                    data = json.loads(response.data.decode())
+                    auth_token = data['auth_token']
+            response = self.client.post(
+                '/users/joe_smith/coordinates/batch',
+                headers=dict(
+                    Authorization='Bearer ' + auth_token
+                ),
+                data=json.dumps(dict(positions=[
+                    dict(latitude=45.02, longitude=40.0, timestamp=time.time())
+                ])),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['message'], 'unauthorized_update')
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(db.positions.count(), 0)
+
+    def test_buffered_positions_are_written_in_bulk(self):
+        buffer = PositionsBuffer(flush_interval=3600 * 1000)
+        with patch('src.mixins.PositionsMixin.POSITIONS_WRITE_MODE', 'buffered'), \
+                patch('src.mixins.PositionsMixin.POSITIONS_BUFFER', buffer), \
+                patch('src.mixins.DriversMixin.POSITIONS_BUFFER', buffer):
+            PositionsMixin.store_positions('rider', [{'latitude': 45.0, 'longitude': 40.0}])
+            PositionsMixin.store_positions('rider', [{'latitude': 45.1, 'longitude': 40.1}])
+            PositionsMixin.store_positions('other_rider', [{'latitude': 46.0, 'longitude': 41.0}])
+            self.assertEqual(db.positions.count(), 0)
+            self.assertEqual(DriversMixin.get_positions(['rider']),
+                             [{'username': 'rider', 'latitude': 45.1, 'longitude': 40.1}])
+            self.assertEqual(buffer.flush(), 2)
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(db.positions.count(), 2)
+        self.assertEqual(db.positions.find_one({'username': 'rider'})['latitude'], 45.1)
+
+    def test_buffered_mode_writes_the_drivers_right_away(self):
+        buffer = PositionsBuffer(flush_interval=3600 * 1000)
+        db.drivers.insert_one({'username': 'driver', 'duty': True, 'trip': False})
+        with patch('src.mixins.PositionsMixin.POSITIONS_WRITE_MODE', 'buffered'), \
+                patch('src.mixins.PositionsMixin.POSITIONS_BUFFER', buffer), \
+                patch('src.mixins.DriversMixin.POSITIONS_BUFFER', buffer):
+            PositionsMixin.store_positions('driver', [{'latitude': 45.1, 'longitude': 40.1}])
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(db.positions.find_one({'username': 'driver'})['latitude'], 45.1)
+        driver = db.drivers.find_one({'username': 'driver'})
+        self.assertEqual(driver['location'], {'type': 'Point', 'coordinates': [40.1, 45.1]})
+        self.assertEqual(DriversMixin.get_drivers_positions(['driver']), {'driver': (45.1, 40.1)})
+
+    def test_redundant_positions_are_skipped(self):
+        deadband = Deadband(distance=10, interval=3600)
+        with patch('src.mixins.PositionsMixin.DEADBAND', deadband), \
+                patch('src.handlers.PositionHandler.DEADBAND', deadband):
+            self.assertTrue(PositionsMixin.store_positions('rider', [{'latitude': 45.0, 'longitude': 40.0}]))
+            self.assertFalse(PositionsMixin.store_positions('rider', [{'latitude': 45.00005,
+                                                                        'longitude': 40.0}]))
+            self.assertEqual(db.positions.find_one({'username': 'rider'})['latitude'], 45.0)
+            self.assertTrue(PositionsMixin.store_positions('rider', [{'latitude': 45.001,
+                                                                       'longitude': 40.0}]))
+            self.assertEqual(db.positions.find_one({'username': 'rider'})['latitude'], 45.001)
+            response = self.client.get('/positions/stats')
+            self.assertEqual(response.status_code, 401)
+            db.users.insert_one(User(username='rider', uid='1').__dict__)
+            response = self.client.get(
+                '/positions/stats',
+                headers=dict(
+                    Authorization='Bearer ' + User.get_user_by_username('rider').encode_auth_token()
+                )
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['position_updates'], {'received': 3, 'suppressed': 1, 'written': 2})
+            self.assertEqual(response.status_code, 200)
+
+    def test_deadband_checks_the_position_written_by_other_workers(self):
+        deadband = Deadband(distance=10, interval=3600)
+        with patch('src.mixins.PositionsMixin.DEADBAND', deadband):
+            self.assertTrue(PositionsMixin.store_positions('rider', [{'latitude': 45.0, 'longitude': 40.0}]))
+            # Otro worker guardo una posicion lejana
+            db.positions.update_one({'username': 'rider'}, {'$set': {'latitude': 46.0}})
+            self.assertTrue(PositionsMixin.store_positions('rider', [{'latitude': 45.00005,
+                                                                       'longitude': 40.0}]))
+            self.assertEqual(db.positions.find_one({'username': 'rider'})['latitude'], 45.00005)
+
+    def test_deadband_forgets_the_least_recent_users(self):
+        deadband = Deadband(distance=10, interval=3600, max_users=2)
+        deadband.is_redundant('first', 45.0, 40.0)
+        deadband.is_redundant('second', 45.0, 40.0)
+        deadband.is_redundant('first', 45.1, 40.0)
+        deadband.is_redundant('third', 45.0, 40.0)
+        self.assertEqual(list(deadband.last), ['first', 'third'])
+
+    def test_stream_positions(self):
+        with self.client:
+            with patch('requests.post') as mock_post:
+                mock_post.return_value = Mock()
+                mock_post.return_value.json.return_value = {'id': "1"}
+                mock_post.return_value.ok = True
+                mock_post.return_value.status_code = 201
+                response = self.client.post(
+                    '/users',
+                    data=json.dumps(dict(
+                        username='joe_smith',
+                        password='123456',
+                        type='driver'
+                    )),
+                    content_type='application/json'
+                )
+                data = json.loads(response.data.decode())
+                auth_token = data['auth_token']
+            lines = [json.dumps(dict(latitude=45.0, longitude=40.0)),
+                     'not a fix',
+                     '',
+                     json.dumps(dict(latitude=100, longitude=40.0)),
+                     json.dumps(dict(latitude=45.1, longitude=40.1, timestamp=time.time()))]
+            response = self.client.post(
+                '/users/joe_smith/coordinates/stream',
+                headers=dict(
+                    Authorization='Bearer ' + auth_token
+                ),
+                data='\n'.join(lines) + '\n',
+                content_type='application/x-ndjson'
+            )
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['status'], 'success')
+            self.assertEqual(data['message'], 'positions_stream_closed')
+            self.assertEqual((data['stored'], data['skipped'], data['rejected']), (2, 0, 2))
+            position = db.positions.find_one({'username': 'joe_smith'})
+            self.assertEqual((position['latitude'], position['longitude']), (45.1, 40.1))
+
+    def test_stream_positions_stops_when_the_token_is_revoked(self):
+        db.users.insert_one(User(username='joe_smith', uid='1').__dict__)
+        auth_token = User.get_user_by_username('joe_smith').encode_auth_token()
+        lines = [json.dumps(dict(latitude=45.0, longitude=40.0)),
+                 json.dumps(dict(latitude=45.1, longitude=40.1))]
+        with self.client:
+            # Lo revocan despues de guardar el primer fix
+            with patch('src.handlers.PositionHandler.Authenticator.authenticate',
+                       side_effect=[('joe_smith', ''), ('joe_smith', ''), ('', 'invalid_token')]):
+                response = self.client.post(
+                    '/users/joe_smith/coordinates/stream',
+                    headers=dict(
+                        Authorization='Bearer ' + auth_token
+                    ),
+                    data='\n'.join(lines) + '\n',
+                    content_type='application/x-ndjson'
+                )
+                data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(data['status'], 'fail')
+            self.assertEqual(data['message'], 'invalid_token')
+            self.assertEqual(data['stored'], 1)
+            self.assertEqual(db.positions.find_one({'username': 'joe_smith'})['latitude'], 45.0)
+
+    def test_stream_positions_ends_when_the_token_expires(self):
+        db.users.insert_one(User(username='joe_smith', uid='1').__dict__)
+        auth_token = User.get_user_by_username('joe_smith').encode_auth_token()
+        with self.client:
+            with patch('src.handlers.PositionHandler.Authenticator.expiration_of',
+                       return_value=time.time() - 1):
+                response = self.client.post(
+                    '/users/joe_smith/coordinates/stream',
+                    headers=dict(
+                        Authorization='Bearer ' + auth_token
+                    ),
+                    data=json.dumps(dict(latitude=45.0, longitude=40.0)) + '\n',
+                    content_type='application/x-ndjson'
+                )
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['message'], 'positions_stream_closed')
+            self.assertEqual(data['stored'], 0)
+            self.assertEqual(db.positions.count(), 0)
+
+    def test_stream_positions_invalid_token(self):
+        with self.client:
+            with patch('requests.post') as mock_post:
+                mock_post.return_value = Mock()
+                mock_post.return_value.json.return_value = {'id': "1"}
+                mock_post.return_value.ok = True
+                mock_post.return_value.status_code = 201
+                self.client.post(
+                    '/users',
+                    data=json.dumps(dict(
+                        username='joe_smith',
+                        password='123456',
+                        type='driver'
+                    )),
+                    content_type='application/json'
+                )
+            response = self.client.post(
+                '/users/joe_smith/coordinates/stream',
+                headers=dict(
+                    Authorization='Bearer invalid_token'
+                ),
+                data=json.dumps(dict(latitude=45.0, longitude=40.0)),
+                content_type='application/x-ndjson'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['status'], 'fail')
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(db.positions.count(), 0)
+
 
 if __name__ == '__main__':
     unittest.main()
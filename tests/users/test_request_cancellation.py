@@ -196,10 +196,11 @@ class TestRequestMatching(BaseTestCase):
                 )
 
                 with patch('src.handlers.RequestHandler.DriversMixin') as mock_mixin:
-                    with patch('src.handlers.RequestHandler.get_directions') as mock_directions:
+                    with patch('src.mixins.RequestsMixin.get_directions') as mock_directions:
 
-                        mock_mixin.get_closer_driver = Mock()
-                        mock_mixin.get_closer_driver.return_value = 'johny'
+                        # El driver queda reservado de verdad para que el viaje pueda empezar
+                        mock_mixin.claim_closer_driver.side_effect = \
+                            lambda location: ('johny', DriversMixin.claim_driver('johny'))
 
                         mock_directions.return_value = Mock()
                         mock_directions.return_value.ok = True
@@ -1,11 +1,26 @@
 import unittest
 import json
+import datetime
+import os
+import shutil
+import tempfile
+import time
 from tests.base import BaseTestCase
-from mock import patch, Mock
+from mock import patch, Mock, ANY
 from src.mixins.DriversMixin import DriversMixin
+from src.mixins.PositionsMixin import PositionsMixin
+from src.mixins.RequestsMixin import RequestsMixin
+from src.models import User
+from src.mixins.DriversGridMixin import DRIVERS_GRID, DriversGrid
+from src.mixins.SharedPositionsMixin import SharedPositions
 from app import db
 
 
+def add_drivers_positions(positions):
+    for position in positions:
+        DriversMixin.update_position(position['username'], position['latitude'], position['longitude'])
+
+
 class TestRequestMatching(BaseTestCase):
 
     def test_gets_available_drivers(self):
@@ -23,8 +38,8 @@ class TestRequestMatching(BaseTestCase):
         self.assertEqual(len(available_drivers), 0)
 
     def test_get_correct_positions(self):
-        positions = [{'username': 'x'*x, 'latitude': x+45, 'longitude': 2*x+40}
-                    for x in range(1, 5)]
+        positions = [{'username': 'x'*x, 'latitude': x+45, 'longitude': 2*x+40,
+                      'last_seen': datetime.datetime.utcnow()} for x in range(1, 5)]
         usernames = ['x', 'xxxx']
         db.positions.insert_many(positions)
         drivers_position = list(DriversMixin.get_positions(usernames))
@@ -35,13 +50,22 @@ class TestRequestMatching(BaseTestCase):
                         in drivers_position)
 
     def test_get_correct_positions_without_usernames_returns_empty_list(self):
-        positions = [{'username': 'x' * x, 'latitude': x + 45, 'longitude': 2 * x + 40}
-                     for x in range(1, 5)]
+        positions = [{'username': 'x' * x, 'latitude': x + 45, 'longitude': 2 * x + 40,
+                      'last_seen': datetime.datetime.utcnow()} for x in range(1, 5)]
         usernames = []
         db.positions.insert_many(positions)
         drivers_position = list(DriversMixin.get_positions(usernames))
         self.assertEqual(len(drivers_position), 0)
 
+    def test_get_positions_leaves_out_stale_ones(self):
+        stale = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        db.positions.insert_many([
+            {'username': 'x', 'latitude': 46, 'longitude': 42, 'last_seen': stale},
+            {'username': 'xx', 'latitude': 47, 'longitude': 44, 'last_seen': datetime.datetime.utcnow()}
+        ])
+        drivers_position = list(DriversMixin.get_positions(['x', 'xx']))
+        self.assertEqual(drivers_position, [{'username': 'xx', 'latitude': 47, 'longitude': 44}])
+
     def test_calculate_right_distance(self):
 
         latitude_initial = 40.654
@@ -61,12 +85,31 @@ class TestRequestMatching(BaseTestCase):
         self.assertAlmostEquals(distance, 0, delta=0.0001)
 
 
+    def test_calculate_distances_in_batch(self):
+        origin = (40.654, -35)
+        destinations = [(40.654, -36), (40.654, -35), (-34.6, -58.4)]
+        distances = DriversMixin.distances(origin, destinations)
+        self.assertEqual(len(distances), 3)
+        for destination, distance in zip(destinations, distances):
+            self.assertAlmostEquals(distance, DriversMixin.distance(origin, destination), delta=0.0001)
+
+    def test_calculate_distances_in_batch_without_numpy(self):
+        origin = (40.654, -35)
+        destinations = [(40.654, -36), (40.654, -35)]
+        with patch('src.mixins.DriversMixin.numpy', None):
+            distances = DriversMixin.distances(origin, destinations)
+        self.assertAlmostEquals(distances[0], 84.36, delta=0.01)
+        self.assertAlmostEquals(distances[1], 0, delta=0.0001)
+
+    def test_calculate_distances_in_batch_without_destinations(self):
+        self.assertEqual(DriversMixin.distances((40.654, -35), []), [])
+
     def test_get_closest_driver(self):
         drivers = [{'username': 'x' * x, 'duty': x % 2 == 0, 'trip':False} for x in range(1, 5)]
         db.drivers.insert_many(drivers)
         positions = [{'username': 'x' * x, 'latitude': x + 45, 'longitude': 2 * x + 40}
                      for x in range(1, 5)]
-        db.positions.insert_many(positions)
+        add_drivers_positions(positions)
         latitude = 47
         longitude = 45
         closer_driver = DriversMixin.get_closer_driver((latitude, longitude))
@@ -77,7 +120,7 @@ class TestRequestMatching(BaseTestCase):
         db.drivers.insert_many(drivers)
         positions = [{'username': 'x' * x, 'latitude': x + 45, 'longitude': 2 * x + 40}
                      for x in range(1, 5)]
-        db.positions.insert_many(positions)
+        add_drivers_positions(positions)
         latitude = 47
         longitude = 45
         closer_driver = DriversMixin.get_closer_driver((latitude, longitude))
@@ -88,8 +131,376 @@ class TestRequestMatching(BaseTestCase):
         db.drivers.insert_many(drivers)
         positions = [{'username': 'x' * x, 'latitude': x + 45, 'longitude': 2 * x + 40}
                      for x in range(1, 5)]
-        db.positions.insert_many(positions)
+        add_drivers_positions(positions)
         latitude = 47
         longitude = 45
         closer_driver = DriversMixin.get_closer_driver((latitude, longitude))
         self.assertIs(closer_driver, None)
+
+    def test_get_closest_driver_skips_many_closer_unavailable_drivers(self):
+        drivers = [{'username': 'x' * x, 'duty': x == 30, 'trip': False} for x in range(1, 31)]
+        db.drivers.insert_many(drivers)
+        positions = [{'username': 'x' * x, 'latitude': 45 + x * 0.01, 'longitude': 40}
+                     for x in range(1, 31)]
+        add_drivers_positions(positions)
+        closer_driver = DriversMixin.get_closer_driver((45, 40))
+        self.assertEqual(closer_driver, 'x' * 30)
+
+    def test_get_closest_driver_ignores_riders_positions(self):
+        db.drivers.insert_one({'username': 'driver', 'duty': True, 'trip': False})
+        db.riders.insert_one({'username': 'rider'})
+        PositionsMixin.store_positions('rider', [{'latitude': 45, 'longitude': 40}])
+        PositionsMixin.store_positions('driver', [{'latitude': 46, 'longitude': 41}])
+        self.assertEqual(db.positions.count(), 2)
+        self.assertEqual(db.drivers.count({'location': {'$exists': True}}), 1)
+        closer_driver = DriversMixin.get_closer_driver((45, 40))
+        self.assertEqual(closer_driver, 'driver')
+
+    def test_backfill_drivers_stored_by_older_versions(self):
+        db.users.insert_one(User(username='driver', uid='1', push_token='push').__dict__)
+        db.drivers.insert_one({'username': 'driver', 'duty': True, 'trip': False})
+        db.positions.insert_one({'username': 'driver', 'latitude': 45.01, 'longitude': 40,
+                                 'last_seen': datetime.datetime.utcnow()})
+        self.assertIsNone(DriversMixin.get_closer_driver((45, 40)))
+        self.assertEqual(DriversMixin.backfill_drivers(), 1)
+        self.assertEqual(DriversMixin.backfill_drivers(), 0)
+        driver = db.drivers.find_one({'username': 'driver'})
+        self.assertEqual((driver['uid'], driver['push_token']), ('1', 'push'))
+        self.assertEqual(DriversMixin.get_closer_driver((45, 40)), 'driver')
+
+    def test_get_closest_driver_skips_drivers_with_stale_positions(self):
+        drivers = [{'username': 'x' * x, 'duty': True, 'trip': False} for x in range(1, 3)]
+        db.drivers.insert_many(drivers)
+        positions = [{'username': 'x' * x, 'latitude': 45 + x * 0.01, 'longitude': 40}
+                     for x in range(1, 3)]
+        add_drivers_positions(positions)
+        stale = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        db.drivers.update_one({'username': 'x'}, {'$set': {'last_seen': stale}})
+        closer_driver = DriversMixin.get_closer_driver((45, 40))
+        self.assertEqual(closer_driver, 'xx')
+
+    def test_get_closest_drivers_shortlist(self):
+        drivers = [{'username': 'x' * x, 'duty': x != 2, 'trip': False} for x in range(1, 6)]
+        db.drivers.insert_many(drivers)
+        positions = [{'username': 'x' * x, 'latitude': 45 + x * 0.01, 'longitude': 40}
+                     for x in range(1, 6)]
+        add_drivers_positions(positions)
+        closer_drivers = DriversMixin.get_closer_drivers((45, 40), 3)
+        self.assertEqual(closer_drivers, ['x', 'xxx', 'xxxx'])
+
+    @patch('requests.get')
+    def test_get_fastest_driver_by_road(self, mocked_google_response):
+        drivers = [{'username': 'x' * x, 'duty': True, 'trip': False, 'latitude': 45 + x * 0.01,
+                    'longitude': 40} for x in range(1, 3)]
+        db.drivers.insert_many(drivers)
+        mocked_google_response.return_value = Mock()
+        mocked_google_response.return_value.ok = True
+        mocked_google_response.return_value.json.return_value = {
+            'rows': [{'elements': [{'status': 'OK', 'duration': {'value': 900}}]},
+                     {'elements': [{'status': 'OK', 'duration': {'value': 300}}]}]
+        }
+        fastest_driver = DriversMixin.get_fastest_driver(['x', 'xx'], (45, 40))
+        self.assertEqual(fastest_driver, 'xx')
+        self.assertEqual(mocked_google_response.call_count, 1)
+
+    @patch('requests.get')
+    def test_get_fastest_driver_keeps_distance_order_if_google_fails(self, mocked_google_response):
+        drivers = [{'username': 'x' * x, 'duty': True, 'trip': False, 'latitude': 45 + x * 0.01,
+                    'longitude': 40} for x in range(1, 3)]
+        db.drivers.insert_many(drivers)
+        mocked_google_response.return_value = Mock()
+        mocked_google_response.return_value.ok = False
+        fastest_driver = DriversMixin.get_fastest_driver(['x', 'xx'], (45, 40))
+        self.assertEqual(fastest_driver, 'x')
+
+    @patch('requests.get')
+    def test_get_fastest_driver_with_one_candidate_does_not_call_google(self, mocked_google_response):
+        fastest_driver = DriversMixin.get_fastest_driver(['x'], (45, 40))
+        self.assertEqual(fastest_driver, 'x')
+        self.assertEqual(mocked_google_response.call_count, 0)
+
+    def test_claim_driver_only_once(self):
+        db.drivers.insert_one({'username': 'driver', 'duty': True, 'trip': False})
+        self.assertTrue(DriversMixin.claim_driver('driver'))
+        self.assertFalse(DriversMixin.claim_driver('driver'))
+        self.assertTrue(db.drivers.find_one({'username': 'driver'})['trip'])
+
+    def test_claim_driver_off_duty(self):
+        db.drivers.insert_one({'username': 'driver', 'duty': False, 'trip': False})
+        self.assertFalse(DriversMixin.claim_driver('driver'))
+
+    @patch('requests.get')
+    def test_claim_closer_driver_falls_back_to_next_candidate(self, mocked_google_response):
+        mocked_google_response.return_value = Mock()
+        mocked_google_response.return_value.ok = False
+        drivers = [{'username': 'x' * x, 'duty': True, 'trip': False} for x in range(1, 3)]
+        db.drivers.insert_many(drivers)
+        positions = [{'username': 'x' * x, 'latitude': 45 + x * 0.01, 'longitude': 40}
+                     for x in range(1, 3)]
+        add_drivers_positions(positions)
+        with patch.object(DriversMixin, 'get_closer_drivers', return_value=['x', 'xx']):
+            db.drivers.update_one({'username': 'x'}, {'$set': {'trip': True}})
+            driver, lease_expires_at = DriversMixin.claim_closer_driver((45, 40))
+            self.assertEqual(driver, 'xx')
+            self.assertIsNotNone(lease_expires_at)
+            self.assertEqual(DriversMixin.claim_closer_driver((45, 40)), (None, None))
+
+    @patch('requests.get')
+    def test_claim_closer_driver_claims_the_closer_by_road(self, mocked_google_response):
+        mocked_google_response.return_value = Mock()
+        mocked_google_response.return_value.ok = True
+        mocked_google_response.return_value.json.return_value = {
+            'rows': [{'elements': [{'status': 'OK', 'duration': {'value': 900}}]},
+                     {'elements': [{'status': 'OK', 'duration': {'value': 300}}]}]
+        }
+        db.drivers.insert_many([{'username': 'x' * x, 'duty': True, 'trip': False} for x in range(1, 3)])
+        add_drivers_positions([{'username': 'x' * x, 'latitude': 45 + x * 0.01, 'longitude': 40}
+                               for x in range(1, 3)])
+        with patch.object(DriversMixin, 'get_closer_drivers', return_value=['x', 'xx']):
+            driver, _ = DriversMixin.claim_closer_driver((45, 40))
+        self.assertEqual(driver, 'xx')
+
+    def test_estimation_sends_the_directions_to_the_passenger(self):
+        db.users.insert_many([User(username='rider', uid='1').__dict__, User(username='driver', uid='2').__dict__])
+        db.drivers.insert_one({'username': 'driver', 'uid': '2', 'latitude': 45.01, 'longitude': 40})
+        directions = Mock(ok=True)
+        directions.json.return_value = {'routes': [{'overview_polyline': {'points': 'abc'},
+                                                    'legs': [{'distance': {'value': 3000},
+                                                              'duration': {'value': 600}}]}]}
+        cost = Mock(ok=True)
+        cost.json.return_value = {'value': 20}
+        coordinates = {'latitude_initial': 45, 'longitude_initial': 40,
+                       'latitude_final': 45.1, 'longitude_final': 40.1}
+        with patch('src.mixins.RequestsMixin.get_directions', return_value=directions) as mock_directions, \
+                patch('src.mixins.RequestsMixin.estimate_trip_cost', return_value=cost):
+            estimation = RequestsMixin.estimate_trip('rider', 'driver', coordinates)
+        self.assertEqual(mock_directions.call_count, 2)
+        self.assertEqual(estimation['directions_to_passenger'], 'abc')
+        self.assertEqual(estimation['time_pickup'], 10)
+
+    def test_release_expired_leases(self):
+        db.drivers.insert_many([{'username': 'x' * x, 'duty': True, 'trip': False} for x in range(1, 4)])
+        DriversMixin.claim_driver('x')
+        DriversMixin.claim_driver('xx')
+        DriversMixin.claim_driver('xxx')
+        self.assertTrue(DriversMixin.confirm_trip('xxx'))
+        expired = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        db.requests.insert_one({'rider': 'rider', 'driver': 'x', 'expires_at': expired})
+        db.drivers.update_one({'username': 'x'}, {'$set': {'lease_expires_at': expired}})
+        with patch('src.mixins.DriversMixin.send_push_notifications') as mock_push:
+            self.assertEqual(DriversMixin.release_expired_leases(), 1)
+            mock_push.assert_called_once_with('rider', 'request_expired', {'id': ANY})
+        self.assertEqual(db.requests.count({'driver': 'x'}), 0)
+        self.assertEqual(sorted(DriversMixin.get_available_drivers()), ['x'])
+
+    def test_confirm_trip_needs_the_lease_of_the_request(self):
+        db.drivers.insert_one({'username': 'x', 'duty': True, 'trip': False})
+        DriversMixin.claim_driver('x')
+        lease_expires_at = db.drivers.find_one({'username': 'x'})['lease_expires_at']
+        expired = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        db.drivers.update_one({'username': 'x'}, {'$set': {'lease_expires_at': expired}})
+        DriversMixin.release_expired_leases()
+        self.assertFalse(DriversMixin.confirm_trip('x', expired))
+        # Otro pedido reservo al driver, el lease viejo ya no sirve
+        DriversMixin.claim_driver('x')
+        self.assertFalse(DriversMixin.confirm_trip('x', lease_expires_at))
+        lease_expires_at = db.drivers.find_one({'username': 'x'})['lease_expires_at']
+        self.assertTrue(DriversMixin.confirm_trip('x', lease_expires_at))
+        self.assertNotIn('lease_expires_at', db.drivers.find_one({'username': 'x'}))
+
+    def test_release_expired_leases_keeps_started_trips_and_new_requests(self):
+        db.drivers.insert_many([{'username': 'x' * x, 'duty': True, 'trip': False} for x in range(1, 3)])
+        expired = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        DriversMixin.claim_driver('x')
+        db.requests.insert_one({'rider': 'rider', 'driver': 'x', 'expires_at': expired})
+        db.drivers.update_one({'username': 'x'}, {'$set': {'lease_expires_at': expired}})
+        # El viaje empieza mientras se buscan los leases vencidos
+        with patch('pymongo.collection.Collection.find', return_value=[{'username': 'x'}]):
+            DriversMixin.confirm_trip('x')
+            with patch('src.mixins.DriversMixin.send_push_notifications') as mock_push:
+                self.assertEqual(DriversMixin.release_expired_leases(), 0)
+                self.assertFalse(mock_push.called)
+        self.assertEqual(db.requests.count({'driver': 'x'}), 1)
+        lease_expires_at = DriversMixin.claim_driver('xx')
+        db.requests.insert_one({'rider': 'another_rider', 'driver': 'xx', 'expires_at': lease_expires_at})
+        db.drivers.update_one({'username': 'xx'}, {'$set': {'lease_expires_at': expired}})
+        self.assertEqual(DriversMixin.release_expired_leases(), 1)
+        self.assertEqual(db.requests.count({'driver': 'xx'}), 1)
+
+@patch('src.mixins.DriversMixin.MATCHING_INDEX', 'grid')
+class TestRequestMatchingWithGrid(BaseTestCase):
+
+    def setUp(self):
+        super(TestRequestMatchingWithGrid, self).setUp()
+        DRIVERS_GRID.loaded_at = None
+
+    def test_get_closest_driver(self):
+        drivers = [{'username': 'x' * x, 'duty': x % 2 == 0, 'trip': False} for x in range(1, 5)]
+        db.drivers.insert_many(drivers)
+        positions = [{'username': 'x' * x, 'latitude': x + 45, 'longitude': 2 * x + 40}
+                     for x in range(1, 5)]
+        add_drivers_positions(positions)
+        closer_driver = DriversMixin.get_closer_driver((47, 45))
+        self.assertEqual(closer_driver, 'xx')
+
+    def test_get_closest_driver_only_zero_available(self):
+        drivers = [{'username': 'x' * x, 'duty': False, 'trip': False} for x in range(1, 5)]
+        db.drivers.insert_many(drivers)
+        positions = [{'username': 'x' * x, 'latitude': x + 45, 'longitude': 2 * x + 40}
+                     for x in range(1, 5)]
+        add_drivers_positions(positions)
+        closer_driver = DriversMixin.get_closer_driver((47, 45))
+        self.assertIs(closer_driver, None)
+
+    def test_grid_follows_duty_trip_and_position_changes(self):
+        db.drivers.insert_many([{'username': 'near', 'duty': True, 'trip': False},
+                                {'username': 'far', 'duty': True, 'trip': False}])
+        add_drivers_positions([{'username': 'near', 'latitude': 45.001, 'longitude': 40},
+                               {'username': 'far', 'latitude': 45.5, 'longitude': 40}])
+        self.assertEqual(DriversMixin.get_closer_driver((45, 40)), 'near')
+        DriversMixin.set_trip('near', True)
+        self.assertEqual(DriversMixin.get_closer_driver((45, 40)), 'far')
+        DriversMixin.set_trip('near', False)
+        DriversMixin.update_position('near', 46, 40)
+        self.assertEqual(DriversMixin.get_closer_driver((45, 40)), 'far')
+        DriversMixin.set_duty('far', False)
+        self.assertEqual(DriversMixin.get_closer_driver((45, 40)), 'near')
+
+    def test_grid_skips_drivers_with_stale_positions(self):
+        db.drivers.insert_many([{'username': 'near', 'duty': True, 'trip': False},
+                                {'username': 'far', 'duty': True, 'trip': False}])
+        add_drivers_positions([{'username': 'near', 'latitude': 45.001, 'longitude': 40},
+                               {'username': 'far', 'latitude': 45.5, 'longitude': 40}])
+        stale = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        db.drivers.update_one({'username': 'near'}, {'$set': {'last_seen': stale}})
+        self.assertEqual(DriversMixin.get_closer_driver((45, 40)), 'far')
+
+    def test_grid_discards_drivers_taken_by_other_workers(self):
+        db.drivers.insert_many([{'username': 'near', 'duty': True, 'trip': False},
+                                {'username': 'far', 'duty': True, 'trip': False}])
+        add_drivers_positions([{'username': 'near', 'latitude': 45.001, 'longitude': 40},
+                               {'username': 'far', 'latitude': 45.5, 'longitude': 40}])
+        DRIVERS_GRID.load()
+        db.drivers.update_one({'username': 'near'}, {'$set': {'trip': True}})
+        self.assertEqual(DriversMixin.get_closer_driver((45, 40)), 'far')
+
+    def test_grid_reuses_the_entries_of_removed_drivers(self):
+        grid = DriversGrid()
+        grid.loaded_at = time.time()
+        grid.add('a', 45.0, 40.0)
+        grid.add('b', 45.5, 40.0)
+        grid.remove('a')
+        grid.add('c', 45.2, 40.0)
+        grid.move('b', 45.1, 40.0)
+        self.assertEqual(len(grid.usernames), 2)
+        found = []
+        for (usernames, latitudes, longitudes), lower_bound in grid.rings((45, 40)):
+            found += zip(usernames, latitudes)
+        self.assertEqual(sorted(found), [('b', 45.1), ('c', 45.2)])
+
+
+@patch('src.mixins.DriversMixin.MATCHING_INDEX', 'shared')
+class TestRequestMatchingWithSharedTable(BaseTestCase):
+
+    def setUp(self):
+        super(TestRequestMatchingWithSharedTable, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'positions')
+        self.table = SharedPositions(self.path, 100)
+        self.patcher = patch('src.mixins.DriversMixin.SHARED_POSITIONS', self.table)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.directory)
+        super(TestRequestMatchingWithSharedTable, self).tearDown()
+
+    def test_get_closest_driver(self):
+        drivers = [{'username': 'x' * x, 'duty': x % 2 == 0, 'trip': False} for x in range(1, 5)]
+        db.drivers.insert_many(drivers)
+        positions = [{'username': 'x' * x, 'latitude': x + 45, 'longitude': 2 * x + 40}
+                     for x in range(1, 5)]
+        add_drivers_positions(positions)
+        closer_driver = DriversMixin.get_closer_driver((47, 45))
+        self.assertEqual(closer_driver, 'xx')
+        self.assertEqual(sorted(driver['slot'] for driver in db.drivers.find()), [0, 1, 2, 3])
+
+    def test_table_follows_duty_trip_and_position_changes(self):
+        db.drivers.insert_many([{'username': 'near', 'duty': True, 'trip': False},
+                                {'username': 'far', 'duty': True, 'trip': False}])
+        add_drivers_positions([{'username': 'near', 'latitude': 45.001, 'longitude': 40},
+                               {'username': 'far', 'latitude': 45.5, 'longitude': 40}])
+        self.assertEqual(DriversMixin.get_closer_driver((45, 40)), 'near')
+        DriversMixin.set_trip('near', True)
+        self.assertEqual(DriversMixin.get_closer_driver((45, 40)), 'far')
+        DriversMixin.set_trip('near', False)
+        DriversMixin.update_position('near', 46, 40)
+        self.assertEqual(DriversMixin.get_closer_driver((45, 40)), 'far')
+        DriversMixin.set_duty('far', False)
+        self.assertEqual(DriversMixin.get_closer_driver((45, 40)), 'near')
+
+    def test_table_skips_drivers_with_stale_positions(self):
+        db.drivers.insert_many([{'username': 'near', 'duty': True, 'trip': False},
+                                {'username': 'far', 'duty': True, 'trip': False}])
+        add_drivers_positions([{'username': 'far', 'latitude': 45.5, 'longitude': 40}])
+        stale = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        DriversMixin.update_position('near', 45.001, 40, stale)
+        self.assertEqual(DriversMixin.get_closer_driver((45, 40)), 'far')
+
+    def test_table_is_shared_by_the_workers(self):
+        db.drivers.insert_many([{'username': 'near', 'duty': True, 'trip': False},
+                                {'username': 'far', 'duty': True, 'trip': False}])
+        add_drivers_positions([{'username': 'near', 'latitude': 45.001, 'longitude': 40},
+                               {'username': 'far', 'latitude': 45.5, 'longitude': 40}])
+        # Otro worker del mismo host mapea el mismo archivo
+        other_worker = SharedPositions(self.path, 100)
+        self.assertEqual(other_worker.usernames_of(other_worker.nearest((45, 40), 2, DriversMixin.seen_since())),
+                         ['near', 'far'])
+        DriversMixin.claim_driver('near')
+        self.assertEqual(other_worker.usernames_of(other_worker.nearest((45, 40), 2, DriversMixin.seen_since())),
+                         ['far'])
+
+    def test_table_discards_drivers_changed_behind_its_back(self):
+        db.drivers.insert_many([{'username': 'near', 'duty': True, 'trip': False},
+                                {'username': 'far', 'duty': True, 'trip': False}])
+        add_drivers_positions([{'username': 'near', 'latitude': 45.001, 'longitude': 40},
+                               {'username': 'far', 'latitude': 45.5, 'longitude': 40}])
+        db.drivers.update_one({'username': 'near'}, {'$set': {'trip': True}})
+        self.assertEqual(DriversMixin.get_closer_driver((45, 40)), 'far')
+
+    def test_table_of_another_boot_is_filled_again(self):
+        db.drivers.insert_many([{'username': 'near', 'duty': True, 'trip': False},
+                                {'username': 'far', 'duty': True, 'trip': False}])
+        add_drivers_positions([{'username': 'near', 'latitude': 45.001, 'longitude': 40},
+                               {'username': 'far', 'latitude': 45.5, 'longitude': 40}])
+        previous_boot = SharedPositions(self.path, 100, stamp='previous')
+        self.assertEqual(previous_boot.usernames_of(previous_boot.nearest((45, 40), 2, DriversMixin.seen_since())),
+                         ['near', 'far'])
+        # Mientras no habia ningun worker
+        db.drivers.update_one({'username': 'near'}, {'$set': {'duty': False}})
+        table = SharedPositions(self.path, 100, stamp='current')
+        self.assertEqual(table.usernames_of(table.nearest((45, 40), 2, DriversMixin.seen_since())), ['far'])
+        # Los demas workers del mismo arranque no la vuelven a llenar
+        with patch.object(SharedPositions, 'load') as mock_load:
+            SharedPositions(self.path, 100, stamp='current').ensure_open()
+            SharedPositions(self.path, 100).ensure_open()
+            self.assertFalse(mock_load.called)
+
+    def test_incomplete_table_is_filled_again(self):
+        db.drivers.insert_one({'username': 'near', 'duty': True, 'trip': False})
+        add_drivers_positions([{'username': 'near', 'latitude': 45.001, 'longitude': 40}])
+        # Como si el worker que la llenaba se hubiera caido a la mitad
+        self.table.header['ready'] = 0
+        db.drivers.update_one({'username': 'near'}, {'$set': {'latitude': 45.002}})
+        table = SharedPositions(self.path, 100)
+        self.assertEqual(table.usernames_of(table.nearest((45, 40), 1, DriversMixin.seen_since())), ['near'])
+
+    def test_new_table_is_filled_from_the_db(self):
+        db.drivers.insert_many([{'username': 'near', 'duty': True, 'trip': False},
+                                {'username': 'far', 'duty': True, 'trip': False}])
+        add_drivers_positions([{'username': 'near', 'latitude': 45.001, 'longitude': 40},
+                               {'username': 'far', 'latitude': 45.5, 'longitude': 40}])
+        os.remove(self.path)
+        table = SharedPositions(self.path, 100)
+        with patch('src.mixins.DriversMixin.SHARED_POSITIONS', table):
+            self.assertEqual(DriversMixin.get_closer_drivers((45, 40), 2), ['near', 'far'])
@@ -0,0 +1,72 @@
+import unittest
+import time
+from mock import patch
+from tests.base import BaseTestCase
+from src.models import User, BlacklistToken
+from src.mixins.AuthenticationMixin import Authenticator, VERIFIED_TOKENS
+from src.mixins.RevocationsMixin import REVOCATIONS
+from src.mixins.TokenBlacklistMixin import TokenBlacklist, TOKEN_BLACKLIST
+from app import db
+
+
+class TestRevocationsFeed(BaseTestCase):
+
+    def setUp(self):
+        super(TestRevocationsFeed, self).setUp()
+        db.users.insert_one(User(username='pedro_gomez', uid='1').__dict__)
+        self.auth_token = User.get_user_by_username('pedro_gomez').encode_auth_token()
+
+    def test_revocations_collection_is_capped(self):
+        self.assertTrue(db.revocations.options().get('capped'))
+
+    def test_token_revoked_by_another_worker_is_evicted_without_polling(self):
+        TOKEN_BLACKLIST.refresh_interval = 3600
+        try:
+            self.assertEqual(Authenticator.authenticate('Bearer ' + self.auth_token), ('pedro_gomez', ''))
+            self.assertTrue(REVOCATIONS.tailer.is_alive())
+            # Otro worker hace el logout
+            revoked = BlacklistToken(token=self.auth_token)
+            revoked.save()
+            REVOCATIONS.publish(revoked.digest)
+            deadline = time.time() + 10
+            while revoked.digest not in TOKEN_BLACKLIST.recent and time.time() < deadline:
+                time.sleep(0.1)
+            self.assertEqual(Authenticator.authenticate('Bearer ' + self.auth_token), ('', 'invalid_token'))
+            self.assertNotIn(self.auth_token, VERIFIED_TOKENS.entries)
+        finally:
+            TOKEN_BLACKLIST.refresh_interval = 1
+
+    def test_followed_blacklist_is_refreshed_less_often(self):
+        blacklist = TokenBlacklist(refresh_interval=-1, followed_refresh_interval=3600)
+        self.assertFalse(blacklist.contains('revoked'))
+        blacklist.follow('revoked')
+        with patch('src.mixins.TokenBlacklistMixin.db') as mock_db:
+            mock_db.blacklistedTokens.find.return_value = []
+            self.assertTrue(blacklist.contains('revoked'))
+            self.assertFalse(blacklist.contains('not_revoked'))
+            self.assertFalse(mock_db.blacklistedTokens.find.called)
+            # Por las revocaciones que nunca llegan a db.revocations
+            blacklist.refreshed_at -= 7200
+            blacklist.contains('not_revoked')
+            self.assertTrue(mock_db.blacklistedTokens.find.called)
+
+    def test_dead_cursor_is_not_taken_as_following(self):
+        blacklist = TokenBlacklist()
+        with patch('src.mixins.RevocationsMixin.TOKEN_BLACKLIST', blacklist):
+            # db.revocations esta vacia, el cursor muere enseguida
+            REVOCATIONS.tail()
+        self.assertIsNone(blacklist.followed_at)
+
+    def test_silent_feed_falls_back_to_refreshing(self):
+        blacklist = TokenBlacklist(refresh_interval=-1)
+        blacklist.contains('revoked')
+        blacklist.follow()
+        blacklist.followed_at -= 3600
+        with patch('src.mixins.TokenBlacklistMixin.db') as mock_db:
+            mock_db.blacklistedTokens.find.return_value = []
+            blacklist.contains('revoked')
+            self.assertTrue(mock_db.blacklistedTokens.find.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import datetime
+import json
+from mock import patch
+from tests.base import BaseTestCase
+from src.models import User, BlacklistToken
+from src.mixins.TokenBlacklistMixin import BloomFilter, TokenBlacklist
+from app import db, TOKEN_DURATION
+
+
+def new_token(username='pedro_gomez'):
+    return User(username=username, uid='1').encode_auth_token()
+
+
+class TestTokenBlacklist(BaseTestCase):
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(bits=1024, hashes=3)
+        tokens = ['token_{}'.format(number) for number in range(100)]
+        for token in tokens:
+            bloom.add(token)
+        self.assertTrue(all(token in bloom for token in tokens))
+        self.assertFalse('another_token' in BloomFilter(bits=1024, hashes=3))
+
+    def test_revocations_made_by_other_workers_are_refreshed(self):
+        blacklist = TokenBlacklist(refresh_interval=-1)
+        revoked = BlacklistToken(token=new_token())
+        self.assertFalse(blacklist.contains(revoked.digest))
+        revoked.save()
+        self.assertTrue(blacklist.contains(revoked.digest))
+        self.assertTrue(revoked.digest in blacklist.recent)
+
+    def test_old_revocations_are_loaded(self):
+        revoked = BlacklistToken(token=new_token())
+        revoked.save()
+        blacklist = TokenBlacklist()
+        self.assertTrue(blacklist.contains(revoked.digest))
+        self.assertFalse(blacklist.contains(BlacklistToken.digest_of(new_token('another_user'))))
+
+    def test_revoked_tokens_are_stored_by_digest_until_they_expire(self):
+        auth_token = new_token()
+        revoked = BlacklistToken(token=auth_token)
+        revoked.save()
+        revoked.save()
+        self.assertEqual(db.blacklistedTokens.count(), 1)
+        stored = db.blacklistedTokens.find_one()
+        self.assertEqual(stored['digest'], BlacklistToken.digest_of(auth_token))
+        self.assertNotIn('token', stored)
+        expected_expiration = datetime.datetime.utcnow() + datetime.timedelta(seconds=TOKEN_DURATION)
+        self.assertLess(abs((stored['expires_at'] - expected_expiration).total_seconds()), 5)
+        indexes = db.blacklistedTokens.index_information()
+        self.assertTrue(any(index['key'] == [('digest', 1)] and index.get('unique')
+                            for index in indexes.values()))
+        self.assertTrue(any(index['key'] == [('expires_at', 1)] and index.get('expireAfterSeconds') == 0
+                            for index in indexes.values()))
+
+    def test_whole_blacklisted_tokens_are_migrated(self):
+        auth_token = new_token()
+        # Con el indice unico ya creado, el mismo token revocado dos veces
+        db.blacklistedTokens.insert_many([{'token': auth_token, 'blacklisted_on': datetime.datetime.now()},
+                                          {'token': auth_token, 'blacklisted_on': datetime.datetime.now()},
+                                          {'token': 'malformed', 'blacklisted_on': datetime.datetime.now()}])
+        self.assertEqual(BlacklistToken.migrate(), 3)
+        self.assertEqual(BlacklistToken.migrate(), 0)
+        self.assertEqual(db.blacklistedTokens.count(), 1)
+        self.assertEqual(db.blacklistedTokens.find_one()['digest'], BlacklistToken.digest_of(auth_token))
+        self.assertTrue(BlacklistToken.is_blacklisted(auth_token))
+
+    def test_not_revoked_tokens_are_answered_without_the_db(self):
+        blacklist = TokenBlacklist(refresh_interval=3600)
+        self.assertFalse(blacklist.contains('revoked'))
+        blacklist.add('revoked')
+        with patch('src.mixins.TokenBlacklistMixin.db') as mock_db:
+            self.assertTrue(blacklist.contains('revoked'))
+            self.assertFalse(blacklist.contains('not_revoked'))
+            self.assertFalse(mock_db.blacklistedTokens.find_one.called)
+            self.assertFalse(mock_db.blacklistedTokens.find.called)
+
+    def test_token_cant_be_used_after_logout(self):
+        db.users.insert_one(User(username='pedro_gomez', uid='1').__dict__)
+        auth_token = User.get_user_by_username('pedro_gomez').encode_auth_token()
+        with self.client:
+            response = self.client.delete(
+                '/security',
+                headers=dict(
+                    Authorization='Bearer ' + auth_token
+                ),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 200)
+            response = self.client.delete(
+                '/security',
+                headers=dict(
+                    Authorization='Bearer ' + auth_token
+                ),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['message'], 'invalid_token')
+            self.assertEqual(response.status_code, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from tests.base import BaseTestCase
+from src.mixins.TracksMixin import TrackRecorder, TracksMixin, encode_polyline, decode_polyline
+from app import db
+
+
+class TestTracks(BaseTestCase):
+
+    def test_polyline_encoding(self):
+        points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+        self.assertEqual(encode_polyline(points), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(decode_polyline(encode_polyline(points)), points)
+
+    def test_track_is_written_in_chunks(self):
+        recorder = TrackRecorder(chunk_size=3, flush_interval=3600)
+        fixes = [(1000.0 + second, round(45 + second * 0.001, 3), 40.0) for second in range(7)]
+        recorder.record('trip', 'driver', fixes[:2])
+        self.assertEqual(db.tracks.count(), 0)
+        recorder.record('trip', 'driver', fixes[2:])
+        self.assertEqual(sorted(chunk['count'] for chunk in db.tracks.find()), [3, 3])
+        recorder.flush('trip')
+        self.assertEqual(sorted(chunk['count'] for chunk in db.tracks.find()), [1, 3, 3])
+        self.assertEqual(TracksMixin.get_track('trip'), fixes)
+
+    def test_track_distance(self):
+        recorder = TrackRecorder(chunk_size=2, flush_interval=3600)
+        # Fragmentos de distintos workers que se solapan en el tiempo
+        recorder.record('trip', 'driver', [(1000.0, 45.0, 40.0), (1002.0, 45.02, 40.0)])
+        recorder.record('trip', 'driver', [(1001.0, 45.01, 40.0), (1003.0, 45.03, 40.0)])
+        self.assertAlmostEqual(TracksMixin.track_distance('trip'), 3.336, delta=0.01)
+        self.assertIsNone(TracksMixin.track_distance('other_trip'))
+
+    def test_incomplete_track_has_no_distance(self):
+        recorder = TrackRecorder(chunk_size=2, flush_interval=3600)
+        recorder.record('trip', 'driver', [(1000.0, 45.0, 40.0), (1001.0, 45.01, 40.0)])
+        self.assertIsNotNone(TracksMixin.track_distance('trip', 2))
+        # Otro worker midio un fix que todavia no escribio
+        self.assertIsNone(TracksMixin.track_distance('trip', 3))
+
+    def test_stale_fixes_are_written_without_new_ones(self):
+        recorder = TrackRecorder(chunk_size=100, flush_interval=3600)
+        recorder.record('trip', 'driver', [(1000.0, 45.0, 40.0)])
+        recorder.flush_stale()
+        self.assertEqual(db.tracks.count(), 0)
+        recorder.buffers['trip']['since'] -= 7200
+        recorder.flush_stale()
+        self.assertEqual(db.tracks.count(), 1)
+        self.assertEqual(recorder.buffers, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,7 @@ import json
 import time
 from tests.base import BaseTestCase
 from mock import patch, Mock
+from src.mixins.DriversMixin import DriversMixin
 from app import TOKEN_DURATION
 
 directions_return_example = {
@@ -237,10 +238,11 @@ class TestTripStarting(BaseTestCase):
                 )
 
                 with patch('src.handlers.RequestHandler.DriversMixin') as mock_mixin:
-                    with patch('src.handlers.RequestHandler.get_directions') as mock_directions:
+                    with patch('src.mixins.RequestsMixin.get_directions') as mock_directions:
 
-                        mock_mixin.get_closer_driver = Mock()
-                        mock_mixin.get_closer_driver.return_value = 'johny'
+                        # El driver queda reservado de verdad para que el viaje pueda empezar
+                        mock_mixin.claim_closer_driver.side_effect = \
+                            lambda location: ('johny', DriversMixin.claim_driver('johny'))
 
                         mock_directions.return_value = Mock()
                         mock_directions.return_value.ok = True
@@ -571,10 +573,11 @@ class TestTripFinishing(BaseTestCase):
                 )
 
                 with patch('src.handlers.RequestHandler.DriversMixin') as mock_mixin:
-                    with patch('src.handlers.RequestHandler.get_directions') as mock_directions:
+                    with patch('src.mixins.RequestsMixin.get_directions') as mock_directions:
 
-                        mock_mixin.get_closer_driver = Mock()
-                        mock_mixin.get_closer_driver.return_value = 'johny'
+                        # El driver queda reservado de verdad para que el viaje pueda empezar
+                        mock_mixin.claim_closer_driver.side_effect = \
+                            lambda location: ('johny', DriversMixin.claim_driver('johny'))
 
                         mock_directions.return_value = Mock()
                         mock_directions.return_value.ok = True
@@ -734,6 +737,22 @@ class TestTripFinishing(BaseTestCase):
                 self.assertEqual(response.content_type, 'application/json')
                 self.assertEqual(response.status_code, 203)
 
+    def test_finish_trip_away_from_the_destination_keeps_measuring_it(self):
+        with self.client:
+            with patch('src.handlers.TripHandler.TrackingTripsMixin.check_positions_with_location',
+                       return_value=False), \
+                    patch('src.handlers.TripHandler.ODOMETER') as mock_odometer:
+                response = self.client.delete(
+                    '/drivers/johny/trip',
+                    headers=dict(
+                        Authorization='Bearer '+self.driver_auth_token
+                    ),
+                    content_type='application/json'
+                )
+                data = json.loads(response.data.decode())
+                self.assertEqual(data['message'], 'users_not_in_final_location')
+                self.assertFalse(mock_odometer.finish.called)
+
     def test_finish_trip_already_finished_trip_not_found(self):
         with self.client:
             with patch('requests.post') as mock_post:
@@ -0,0 +1,73 @@
+import unittest
+import datetime
+import json
+from mock import patch
+import python_jwt as jwt
+from tests.base import BaseTestCase
+from src.models import User, BlacklistToken
+from src.mixins.AuthenticationMixin import Authenticator, VerifiedTokens, VERIFIED_TOKENS
+from src.mixins.TokenBlacklistMixin import TOKEN_BLACKLIST
+from app import db
+
+
+class TestVerifiedTokens(BaseTestCase):
+
+    def setUp(self):
+        super(TestVerifiedTokens, self).setUp()
+        db.users.insert_one(User(username='pedro_gomez', uid='1').__dict__)
+        self.auth_token = User.get_user_by_username('pedro_gomez').encode_auth_token()
+
+    def test_token_is_verified_only_once(self):
+        with patch('src.models.jwt.verify_jwt', wraps=jwt.verify_jwt) as mock_verify:
+            for _ in range(3):
+                self.assertEqual(Authenticator.authenticate('Bearer ' + self.auth_token), ('pedro_gomez', ''))
+            self.assertEqual(mock_verify.call_count, 1)
+
+    def test_least_recently_used_tokens_are_evicted(self):
+        tokens = VerifiedTokens(size=2)
+        first, second, third = [User(username=username, uid='1').encode_auth_token()
+                                for username in ('first', 'second', 'third')]
+        tokens.put(first, 'first')
+        tokens.put(second, 'second')
+        self.assertEqual(tokens.get(first), 'first')
+        tokens.put(third, 'third')
+        self.assertEqual(tokens.get(first), 'first')
+        self.assertIsNone(tokens.get(second))
+        self.assertEqual(tokens.get(third), 'third')
+
+    def test_expired_tokens_are_not_served(self):
+        tokens = VerifiedTokens()
+        expired = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        with patch('src.models.BlacklistToken.expiration_of', return_value=expired):
+            tokens.put(self.auth_token, 'pedro_gomez')
+        self.assertIsNone(tokens.get(self.auth_token))
+        self.assertNotIn(self.auth_token, tokens.entries)
+
+    def test_token_revoked_by_another_worker_is_not_served(self):
+        Authenticator.authenticate('Bearer ' + self.auth_token)
+        Authenticator.authenticate('Bearer ' + self.auth_token)
+        BlacklistToken(token=self.auth_token).save()
+        TOKEN_BLACKLIST.refreshed_at = 0
+        # Sin noticias de db.revocations la blacklist vuelve a consultar la db
+        with patch.object(TOKEN_BLACKLIST, 'followed', return_value=False):
+            self.assertEqual(Authenticator.authenticate('Bearer ' + self.auth_token), ('', 'invalid_token'))
+        self.assertNotIn(self.auth_token, VERIFIED_TOKENS.entries)
+
+    def test_token_cant_be_used_after_logout(self):
+        Authenticator.authenticate('Bearer ' + self.auth_token)
+        with self.client:
+            response = self.client.delete(
+                '/security',
+                headers=dict(
+                    Authorization='Bearer ' + self.auth_token
+                ),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['message'], 'logout_succesful')
+        self.assertNotIn(self.auth_token, VERIFIED_TOKENS.entries)
+        self.assertEqual(Authenticator.authenticate('Bearer ' + self.auth_token), ('', 'invalid_token'))
+
+
+if __name__ == '__main__':
+    unittest.main()